@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from vectorstore import DEFAULT_COLLECTION_NAME
+
+DEFAULT_THRESHOLD = float(os.getenv("RAGVISOR_ANSWER_CACHE_THRESHOLD", "0.92"))
+DEFAULT_TTL_S = float(os.getenv("RAGVISOR_ANSWER_CACHE_TTL_S", str(24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("RAGVISOR_ANSWER_CACHE_MAX_ENTRIES", "1000"))
+CACHE_FILENAME = "answer_cache.sqlite3"
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """
+    Persistent answer cache shared by every session, keyed by query embedding.
+
+    A lookup returns the stored answer of the most similar earlier question if
+    its cosine similarity is at least `threshold`, it was produced against the
+    current collection version and it is younger than `ttl_s`. Entries live in
+    SQLite so they survive restarts and are visible to other processes; the
+    normalized embeddings are mirrored in a NumPy matrix for a single
+    vectorized similarity scan per lookup.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD, ttl_s=DEFAULT_TTL_S, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                documents TEXT NOT NULL,
+                metadatas TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                collection_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+        self._reset()
+
+    def _reset(self):
+        self._ids, self._versions, self._created = [], [], []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._last_id = 0
+        self._loaded_rows = 0
+
+    def _sync(self):
+        """Load rows written since the last sync (by this or another process)."""
+        cursor = self._conn.execute(
+            "SELECT id, embedding, collection_version, created_at FROM answers WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        )
+        rows = cursor.fetchall()
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        if count < self._loaded_rows + len(rows):
+            # Rows were evicted, possibly by another process: rebuild from scratch.
+            self._reset()
+            rows = self._conn.execute(
+                "SELECT id, embedding, collection_version, created_at FROM answers ORDER BY id"
+            ).fetchall()
+        if not rows:
+            self._loaded_rows = len(self._ids)
+            return
+        vectors = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        self._matrix = vectors if self._matrix.size == 0 else np.vstack([self._matrix, vectors])
+        self._ids.extend(row[0] for row in rows)
+        self._versions.extend(row[2] for row in rows)
+        self._created.extend(row[3] for row in rows)
+        self._last_id = self._ids[-1]
+        self._loaded_rows = len(self._ids)
+
+    def lookup(self, query_embedding, collection_version):
+        """
+        Find a cached answer for a semantically equivalent question.
+        Returns:
+            Dict with answer, documents, metadatas, matched_question and
+            similarity, or None on a miss.
+        """
+        query = _normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            self._sync()
+            if not self._ids:
+                self.misses += 1
+                return None
+            scores = self._matrix @ query
+            valid = (np.array(self._versions) == str(collection_version)) & (
+                now - np.array(self._created) <= self.ttl_s
+            )
+            scores = np.where(valid, scores, -1.0)
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = self._ids[best]
+            row = self._conn.execute(
+                "SELECT question, answer, documents, metadatas FROM answers WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is None:
+                # Evicted by another process since our last sync.
+                self._reset()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_hit_at = ? WHERE id = ?", (now, entry_id))
+            self._conn.commit()
+            self.hits += 1
+        return {
+            "matched_question": row[0],
+            "answer": row[1],
+            "documents": json.loads(row[2]),
+            "metadatas": json.loads(row[3]),
+            "similarity": round(similarity, 4),
+        }
+
+    def store(self, question, query_embedding, answer, documents, metadatas, collection_version):
+        """
+        Cache an answer, then evict entries from older collection versions,
+        expired entries and the least recently hit beyond max_entries.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (question, answer, documents, metadatas, embedding, collection_version, created_at, last_hit_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    question,
+                    answer,
+                    json.dumps(documents),
+                    json.dumps(metadatas),
+                    _normalize(query_embedding).tobytes(),
+                    str(collection_version),
+                    now,
+                    now,
+                ),
+            )
+            # Answers computed against an older collection can never match again.
+            self._conn.execute("DELETE FROM answers WHERE collection_version != ?", (str(collection_version),))
+            self._conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_s,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY last_hit_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            self._sync()
+
+    def stats(self):
+        return {"entries": len(self._ids), "hits": self.hits, "misses": self.misses, "threshold": self.threshold}
+
+
+def get_answer_cache(persist_dir, collections=None, **kwargs):
+    """
+    Return the process-wide SemanticAnswerCache stored alongside a Chroma directory.
+
+    Each set of searched collections gets its own cache file, since an answer
+    drawn from one set of shards is no answer for another (and store() evicts
+    entries from other collection versions).
+    """
+    filename = CACHE_FILENAME
+    if collections and list(collections) != [DEFAULT_COLLECTION_NAME]:
+        scope = hashlib.sha256(",".join(sorted(collections)).encode("utf-8")).hexdigest()[:12]
+        filename = CACHE_FILENAME.replace(".", f"_{scope}.", 1)
+    path = str(Path(persist_dir).resolve() / filename)
+    cache = _caches.get(path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(path)
+            if cache is None:
+                cache = SemanticAnswerCache(path, **kwargs)
+                _caches[path] = cache
+    return cache
@@ -0,0 +1,140 @@
+import json
+import os
+import requests
+
+API_URL = os.getenv("RAGVISOR_API_URL")
+API_TOKEN = os.getenv("RAGVISOR_API_TOKEN")
+
+
+def _payload(payload, mode=None, candidates=None, rerank=None, collections=None, where=None):
+    """Add the optional retrieval options shared by the query endpoints to payload."""
+    if mode:
+        payload["mode"] = mode
+    if candidates:
+        payload["candidates"] = candidates
+    if rerank is not None:
+        payload["rerank"] = rerank
+    if collections:
+        payload["collections"] = [collections] if isinstance(collections, str) else list(collections)
+    if where:
+        payload["where"] = where
+    return payload
+
+
+def _error(response):
+    """Status and detail of a failed response; proxies and crashes may not answer in JSON."""
+    try:
+        detail = response.json().get("detail", response.text)
+    except (ValueError, AttributeError):
+        detail = response.text
+    return f"{response.status_code} {detail}"
+
+
+class APIClient:
+    """
+    Thin client for server.py. Mirrors query_service.run_query and the ingest
+    helpers so the Streamlit app can use either interchangeably.
+    """
+
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()  # keep-alive across reruns
+        if API_TOKEN:
+            self.session.headers["Authorization"] = f"Bearer {API_TOKEN}"
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise RuntimeError(_error(response))
+        return response.json()
+
+    def run_query(self, question, mode=None, candidates=None, rerank=None, collections=None, where=None):
+        """
+        Stream a query from /query/stream.
+        Yields:
+            The same events as query_service.run_query; a server-side failure
+            is raised as RuntimeError.
+        """
+        payload = _payload({"question": question}, mode, candidates, rerank, collections, where)
+        with self.session.post(f"{self.base_url}/query/stream", json=payload, stream=True, timeout=self.timeout) as response:
+            if response.status_code >= 400:
+                raise RuntimeError(_error(response))
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["event"] == "error":
+                    raise RuntimeError(event["detail"])
+                yield event
+
+    def answer_query(self, question, mode=None, candidates=None, rerank=None, collections=None, where=None):
+        payload = _payload({"question": question}, mode, candidates, rerank, collections, where)
+        return self._post("/query", payload)
+
+    def answer_batch(self, questions, mode=None, candidates=None, rerank=None, collections=None, where=None,
+                     max_concurrency=None):
+        payload = _payload({"questions": list(questions)}, mode, candidates, rerank, collections, where)
+        if max_concurrency:
+            payload["max_concurrency"] = max_concurrency
+        return self._post("/query/batch", payload)
+
+    def ingest(self, paths=None, folder=None, urls=None, max_depth=0, max_pages=None, collection=None,
+               background=False):
+        """Returns the ingest summary, or the queued job (see jobs.JobQueue.get) when background is set."""
+        payload = {"paths": paths, "folder": folder, "urls": urls, "max_depth": max_depth, "background": background}
+        if collection:
+            payload["collection"] = collection
+        if max_pages:
+            payload["max_pages"] = max_pages
+        return self._post("/ingest", payload)
+
+    def upload(self, filename, data, collection=None, background=False):
+        params = {"background": "true"} if background else {}
+        if collection:
+            params["collection"] = collection
+        response = self.session.put(f"{self.base_url}/documents/{filename}", data=data, params=params, timeout=self.timeout)
+        if response.status_code >= 400:
+            raise RuntimeError(_error(response))
+        return response.json()
+
+    def jobs(self, limit=20):
+        response = self.session.get(f"{self.base_url}/jobs", params={"limit": limit}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def job(self, job_id):
+        response = self.session.get(f"{self.base_url}/jobs/{job_id}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def describe_collections(self):
+        response = self.session.get(f"{self.base_url}/collections", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def list_collections(self):
+        return [collection["name"] for collection in self.describe_collections()]
+
+    def list_sources(self, collections):
+        """Document names ingested into the given collections."""
+        return sorted({
+            source for collection in self.describe_collections() if collection["name"] in collections
+            for source in collection["sources"]
+        })
+
+    def stats(self):
+        response = self.session.get(f"{self.base_url}/stats", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+_client = None
+
+
+def get_api_client():
+    """Shared client for RAGVISOR_API_URL, or None when the app runs the pipeline in-process."""
+    global _client
+    if API_URL and _client is None:
+        _client = APIClient(API_URL)
+    return _client
@@ -1,97 +1,29 @@
 import streamlit as st
 from pathlib import Path
 import requests
-from bs4 import BeautifulSoup
-from io import BytesIO
-from PIL import Image
 import os
-from datetime import datetime
 from dotenv import load_dotenv
 import hashlib
 import re
 import time
+from datetime import datetime, time as dt_time
 import bleach
-from sentence_transformers import SentenceTransformer
-from chromadb import PersistentClient
-import torch
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from collections import OrderedDict
-
-# Sample implementations of missing modules
-def load_and_split_pdfs(pdf_input, is_uploaded_files=False):
-    """Load and split PDFs into chunks."""
-    try:
-        chunks = []
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        if is_uploaded_files:
-            for file in pdf_input:
-                reader = PdfReader(file)
-                text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
-                chunks.extend(text_splitter.split_text(text))
-        else:
-            for file_path in Path(pdf_input).glob("*.pdf"):
-                reader = PdfReader(file_path)
-                text = "".join(page.extract_text() for page in reader.pages if page.extract_text())
-                chunks.extend(text_splitter.split_text(text))
-        return chunks
-    except Exception as e:
-        st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Failed to load PDFs: {e}</div>', unsafe_allow_html=True)
-        return []
-
-def embed_and_store(chunks, persist_dir):
-    """Embed chunks and store in ChromaDB."""
-    try:
-        model = SentenceTransformer("all-MiniLM-L6-v2", device="cuda" if torch.cuda.is_available() else "cpu")
-        embeddings = model.encode(chunks, batch_size=32, show_progress_bar=False)
-        client = PersistentClient(path=persist_dir)
-        collection = client.get_or_create_collection("rag_pdf")
-        # Generate unique IDs for each chunk
-        ids = [f"chunk_{i}" for i in range(len(chunks))]
-        collection.add(
-            documents=chunks,
-            embeddings=embeddings,
-            metadatas=[{"source": "unknown", "chunk_id": i} for i in range(len(chunks))],
-            ids=ids  # Add the required ids parameter
-        )
-    except Exception as e:
-        st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Failed to embed content: {e}</div>', unsafe_allow_html=True)
-from groq import Groq
+from embedder import service_stats
+from image_store import get_image_store
+from llm import llm_stats
+from reranker import reranker_stats
+from ingest import collection_docs_dir
+from jobs import get_job_queue
+from manifest import IngestManifest
+from vectorstore import (
+    ALL_COLLECTIONS, DEFAULT_COLLECTION_NAME, build_where, list_collections, open_cost, resolve_collections,
+    validate_collection_name,
+)
+from query_service import run_query
+from api_client import get_api_client
+from tracing import get_tracer, record
+from warmup import start_warmup, startup_report
 
-def generate_answer(query, context):
-    """Generate an answer using Groq API."""
-    try:
-        # Initialize Groq client
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        if not groq_api_key:
-            raise ValueError("GROQ_API_KEY is missing in environment variables.")
-        
-        client = Groq(api_key=groq_api_key)
-        
-        # Construct the prompt
-        prompt = f"""You are an AI assistant tasked with answering questions based on provided context. Use the following context to answer the query concisely and accurately. If the context is insufficient, provide a general answer or indicate limitations.
-
-        Query: {query}
-
-        Context: {context}
-
-        Answer:"""
-        
-        # Call Groq API
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            model="llama3-70b-8192",  # Adjust model as needed (e.g., llama3-8b-8192)
-            max_tokens=1000,  # Increase for longer responses
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content.strip()
-    
-    except Exception as e:
-        return f"Error generating answer: {e}"
 # Load environment variables from .env file
 load_dotenv()
 
@@ -107,10 +39,12 @@ st.set_page_config(page_title="RAGvisor", layout="wide", page_icon="🧠")
 
 # ========== Initialize State ==========
 st.session_state.setdefault("qa_history", [])
+# IDs of the images generated in this session; the bytes live in the image store.
 st.session_state.setdefault("images", [])
 st.session_state.setdefault("dark_mode", False)
-st.session_state.setdefault("query_cache", OrderedDict())
 st.session_state.setdefault("chat_history_visible", True)
+# Uploads already queued in this session, so reruns don't queue them again.
+st.session_state.setdefault("queued_uploads", {})
 
 # ========== Custom CSS ==========
 st.markdown("""
@@ -382,38 +316,6 @@ st.markdown("""
                     });
                 }
             });
-            const observeBotMessages = () => {
-                const targetNode = document.querySelector('.main-content');
-                const config = { childList: true, subtree: true };
-                const callback = (mutationsList, observer) => {
-                    for (let mutation of mutationsList) {
-                        if (mutation.addedNodes.length) {
-                            mutation.addedNodes.forEach(node => {
-                                if (node.className && node.className.includes('message bot')) {
-                                    const text = node.textContent.replace(/<[^>]+>/g, '').trim();
-                                    if (text && !node.dataset.typed) {
-                                        node.dataset.typed = 'true';
-                                        node.textContent = '';
-                                        let i = 0;
-                                        const interval = setInterval(() => {
-                                            if (i < text.length) {
-                                                node.textContent += text.charAt(i);
-                                                i++;
-                                            } else {
-                                                clearInterval(interval);
-                                            }
-                                        }, 50);
-                                    }
-                                }
-                            });
-                        }
-                    }
-                };
-                const observer = new MutationObserver(callback);
-                if (targetNode) observer.observe(targetNode, config);
-                return observer;
-            };
-            const observer = observeBotMessages();
             const dropzone = document.querySelector('.stFileUploader');
             if (dropzone) {
                 const dz = dropzone.closest('div').querySelector('div');
@@ -470,10 +372,100 @@ except PermissionError as e:
     st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Permission denied when creating directories: {e}</div>', unsafe_allow_html=True)
     st.stop()
 
+# Load the model and indexes in the background (once per process), so the first question doesn't pay for them.
+if not get_api_client():
+    start_warmup(persist_dir)
+
+# ========== Ingestion Jobs ==========
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+
+def describe_job(job):
+    if job["kind"] == "paths":
+        return ", ".join(Path(path).name for path in job["payload"]["paths"])
+    if job["kind"] == "urls":
+        return ", ".join(job["payload"]["urls"])
+    return f"{Path(job['payload']['folder']).name}/ folder"
+
+
+@st.fragment(run_every=2)
+def render_jobs():
+    """Poll the job queue; only this fragment reruns, so the page stays responsive."""
+    try:
+        api = get_api_client()
+        jobs = api.jobs(limit=10) if api else get_job_queue(persist_dir).list(limit=10)
+    except Exception as e:
+        st.markdown(f'<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> Could not load jobs: {e}</div>', unsafe_allow_html=True)
+        return
+    if not jobs:
+        st.caption("No ingestion jobs yet.")
+    for job in jobs:
+        label = f"{JOB_ICONS.get(job['status'], '')} {describe_job(job)} → {job['collection']}"
+        progress = job["progress"] or {}
+        if job["status"] == "running" and progress.get("total"):
+            st.progress(min(1.0, progress["done"] / progress["total"]), text=f"{label}: {progress['message']}")
+        elif job["status"] == "done":
+            result = job["result"] or {}
+            failed = f", {result['files_failed']} unreadable" if result.get("files_failed") else ""
+            linked = f" (+{result['chunks_linked']} duplicates linked)" if result.get("chunks_linked") else ""
+            st.caption(f"{label}: embedded {result.get('chunks_embedded', 0)} chunks{linked} from {result.get('files_ingested', 0)} changed files ({result.get('files_skipped', 0)} unchanged{failed})")
+        elif job["status"] == "failed":
+            st.caption(f"{label}: failed — {job['error']}")
+        else:
+            st.caption(f"{label}: {progress.get('message', job['status'])}")
+
+
 # ========== Sidebar (Control Panel) ==========
 with st.sidebar:
     st.markdown("<h2><i class='fas fa-cog'></i> Control Panel</h2>", unsafe_allow_html=True)
     
+    # Collections (shards)
+    with st.expander("Collections"):
+        st.markdown("<i class='fas fa-layer-group'></i> Shards", unsafe_allow_html=True)
+        target_collection = st.text_input("Add documents to", value=DEFAULT_COLLECTION_NAME, help="Collection that uploads, websites and embedding go into, e.g. one per team or source type", key="target_collection").strip() or DEFAULT_COLLECTION_NAME
+        try:
+            validate_collection_name(target_collection)
+        except ValueError as e:
+            st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> {e}</div>', unsafe_allow_html=True)
+            st.stop()
+        try:
+            api = get_api_client()
+            known_collections = api.list_collections() if api else list_collections(persist_dir)
+        except Exception as e:
+            known_collections = []
+            st.markdown(f'<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> Could not list collections: {e}</div>', unsafe_allow_html=True)
+        search_collections = st.multiselect(
+            "Search in",
+            options=[ALL_COLLECTIONS] + sorted(set(known_collections) | {DEFAULT_COLLECTION_NAME}),
+            default=[DEFAULT_COLLECTION_NAME],
+            format_func=lambda name: "All collections" if name == ALL_COLLECTIONS else name,
+            help="Questions fan out to every selected collection in parallel",
+            key="search_collections",
+        ) or None
+
+    # Metadata filters, applied inside the vector store before ranking
+    with st.expander("Filters"):
+        st.markdown("<i class='fas fa-filter'></i> Limit the search", unsafe_allow_html=True)
+        try:
+            scope = resolve_collections(persist_dir, search_collections)
+            if api:
+                known_sources = api.list_sources(scope)
+            else:
+                known_sources = sorted({source for name in scope for source in IngestManifest(persist_dir, name).sources()})
+        except Exception as e:
+            known_sources = []
+            st.markdown(f'<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> Could not list documents: {e}</div>', unsafe_allow_html=True)
+        filter_sources = st.multiselect("Documents", options=known_sources, help="Only search these documents (all when empty)", key="filter_sources")
+        filter_types = st.multiselect("Content types", options=["pdf", "text", "web"], help="Only search these kinds of content (all when empty)", key="filter_types")
+        filter_since = st.date_input("Ingested since", value=None, help="Only search chunks embedded on or after this day", key="filter_since")
+        query_where = build_where(
+            sources=filter_sources,
+            content_types=filter_types,
+            ingested_after=datetime.combine(filter_since, dt_time.min).timestamp() if filter_since else None,
+        )
+    docs_folder = collection_docs_dir(pdf_folder, target_collection)
+    docs_folder.mkdir(parents=True, exist_ok=True)
+    
     # PDF Upload with Drag-and-Drop
     with st.expander("Upload Documents", expanded=True):
         st.markdown("<i class='fas fa-upload'></i> Upload PDF files", unsafe_allow_html=True)
@@ -481,18 +473,20 @@ with st.sidebar:
         if uploaded_files:
             for uploaded_file in uploaded_files:
                 filename = re.sub(r'[^\w\-\.]', '_', uploaded_file.name)
-                file_path = Path(pdf_folder) / filename
+                data = uploaded_file.getvalue()
+                upload_key = f"{target_collection}/{filename}/{hashlib.sha256(data).hexdigest()}"
+                if upload_key in st.session_state.queued_uploads:
+                    continue
                 try:
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    st.markdown(f'<div class="custom-success"><i class="fas fa-check-circle"></i> Uploaded: {filename}</div>', unsafe_allow_html=True)
-                    with st.spinner("Embedding uploaded file..."):
-                        chunks = load_and_split_pdfs([uploaded_file], is_uploaded_files=True)
-                        if chunks:
-                            embed_and_store(chunks, persist_dir)
-                            st.markdown(f'<div class="custom-success"><i class="fas fa-check-circle"></i> Embedded {len(chunks)} chunks from {filename}!</div>', unsafe_allow_html=True)
-                        else:
-                            st.markdown(f'<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> No content found in {filename}.</div>', unsafe_allow_html=True)
+                    api = get_api_client()
+                    if api:
+                        job = api.upload(filename, data, collection=target_collection, background=True)
+                    else:
+                        file_path = docs_folder / filename
+                        file_path.write_bytes(data)
+                        job = get_job_queue(persist_dir).submit_paths([file_path], target_collection)
+                    st.session_state.queued_uploads[upload_key] = job["id"]
+                    st.markdown(f'<div class="custom-success"><i class="fas fa-check-circle"></i> Uploaded {filename}; embedding in the background.</div>', unsafe_allow_html=True)
                 except Exception as e:
                     st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Failed to process {filename}: {e}</div>', unsafe_allow_html=True)
     
@@ -500,44 +494,46 @@ with st.sidebar:
     with st.expander("Scrape Website"):
         st.markdown("<i class='fas fa-globe'></i> Website Content", unsafe_allow_html=True)
         website_url = st.text_input("Website URL", placeholder="https://example.com", help="Enter a valid URL to scrape content.", key="website_url")
-        if st.button("⬇️ Load Website", help="Scrape and save website content", key="load_website"):
+        crawl_depth = st.number_input("Link depth", min_value=0, max_value=3, value=0, help="Follow links on the same site this many levels deep (0 = this page only)", key="crawl_depth")
+        crawl_pages = st.number_input("Max pages", min_value=1, max_value=500, value=20, help="Stop after this many pages", key="crawl_pages")
+        if st.button("⬇️ Load Website", help="Scrape and embed website content", key="load_website"):
             if not website_url.startswith(('http://', 'https://')):
                 st.markdown('<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Invalid URL. Please include http:// or https://</div>', unsafe_allow_html=True)
             else:
-                with st.spinner("Scraping website..."):
-                    try:
-                        response = requests.get(website_url, timeout=10)
-                        response.raise_for_status()
-                        soup = BeautifulSoup(response.text, 'html.parser')
-                        text_content = soup.get_text(separator=' ', strip=True)
-                        if len(text_content) > 10000:
-                            st.markdown('<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> Content truncated to 10,000 characters.</div>', unsafe_allow_html=True)
-                            text_content = text_content[:10000]
-                        filename = f"website_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                        Path(pdf_folder, filename).write_text(text_content, encoding="utf-8")
-                        st.markdown(f'<div class="custom-success"><i class="fas fa-check-circle"></i> Website content saved as {filename}.</div>', unsafe_allow_html=True)
-                    except Exception as e:
-                        st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Error scraping website: {e}</div>', unsafe_allow_html=True)
+                try:
+                    api = get_api_client()
+                    if api:
+                        job = api.ingest(urls=[website_url], max_depth=int(crawl_depth), max_pages=int(crawl_pages), collection=target_collection, background=True)
+                    else:
+                        job = get_job_queue(persist_dir).submit_urls([website_url], docs_folder, target_collection, max_depth=int(crawl_depth), max_pages=int(crawl_pages))
+                    if job["deduplicated"]:
+                        st.markdown('<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> This website is already being crawled.</div>', unsafe_allow_html=True)
+                    else:
+                        st.markdown('<div class="custom-success"><i class="fas fa-check-circle"></i> Crawl queued; see Ingestion Jobs for progress.</div>', unsafe_allow_html=True)
+                except Exception as e:
+                    st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Error scraping website: {e}</div>', unsafe_allow_html=True)
     
     # Embed Content
     with st.expander("Embed Content"):
         st.markdown("<i class='fas fa-database'></i> Process Content", unsafe_allow_html=True)
         if st.button("⚙️ Process and Embed", help="Embed all uploaded content into the database", key="process_embed"):
-            with st.spinner("Embedding content..."):
-                try:
-                    chunks = load_and_split_pdfs(pdf_folder, is_uploaded_files=False)
-                    if not chunks:
-                        st.markdown('<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> No content found to embed.</div>', unsafe_allow_html=True)
-                    else:
-                        progress_bar = st.progress(0)
-                        batch_size = 100
-                        for i in range(0, len(chunks), batch_size):
-                            batch = chunks[i:i + batch_size]
-                            embed_and_store(batch, persist_dir)
-                            progress_bar.progress(min((i + batch_size) / len(chunks), 1.0))
-                        st.markdown(f'<div class="custom-success"><i class="fas fa-check-circle"></i> Embedded {len(chunks)} chunks!</div>', unsafe_allow_html=True)
-                except Exception as e:
-                    st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Embedding failed: {e}</div>', unsafe_allow_html=True)
+            try:
+                api = get_api_client()
+                if api:
+                    job = api.ingest(collection=target_collection, background=True)
+                else:
+                    job = get_job_queue(persist_dir).submit_folder(docs_folder, target_collection)
+                if job["deduplicated"]:
+                    st.markdown('<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> This folder is already being embedded.</div>', unsafe_allow_html=True)
+                else:
+                    st.markdown('<div class="custom-success"><i class="fas fa-check-circle"></i> Embedding queued; see Ingestion Jobs for progress.</div>', unsafe_allow_html=True)
+            except Exception as e:
+                st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Embedding failed: {e}</div>', unsafe_allow_html=True)
+
+    # Ingestion Jobs
+    with st.expander("Ingestion Jobs", expanded=True):
+        st.markdown("<i class='fas fa-tasks'></i> Background embedding", unsafe_allow_html=True)
+        render_jobs()
     
     # Appearance
     with st.expander("Appearance"):
@@ -549,13 +545,25 @@ with st.sidebar:
     
     # Clear History
     st.markdown("<i class='fas fa-trash-alt'></i> Clear History", unsafe_allow_html=True)
-    if st.button("Clear History", help="Reset chat and query cache", key="clear_history"):
+    if st.button("Clear History", help="Reset chat history and images", key="clear_history"):
         st.session_state.qa_history = []
-        st.session_state.query_cache = OrderedDict()
         st.session_state.images = []
         st.markdown('<div class="custom-success"><i class="fas fa-check-circle"></i> History cleared.</div>', unsafe_allow_html=True)
 
     st.markdown("---")
+    for model_stats in service_stats():
+        st.caption(f"Embedding model {model_stats['model_name']} ({model_stats['device']}): loaded in {model_stats['load_time_s']}s, {model_stats['memory_mb']} MB")
+        if "cache" in model_stats:
+            cache_stats = model_stats["cache"]
+            st.caption(f"Embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['bytes_saved'] / 1024:.0f} KB served from disk")
+    for rerank_stats in reranker_stats():
+        st.caption(f"Re-ranker {rerank_stats['model_name']}: {rerank_stats['pairs_scored']} pairs scored at {rerank_stats['ms_per_pair']} ms, {rerank_stats['cache_hits']} cached, {rerank_stats['skipped']} skipped over budget")
+    groq_stats = llm_stats()
+    if groq_stats["calls"]:
+        st.caption(f"Groq: {groq_stats['calls']} calls, {groq_stats['mean_first_token_s']}s mean first token, {groq_stats['retries']} retries, {groq_stats['rate_limited']} rate-limited, {groq_stats['coalesced']} coalesced")
+    image_stats = get_image_store().stats()
+    if image_stats["images"]:
+        st.caption(f"Image store: {image_stats['images']} images ({image_stats['bytes'] / (1024 * 1024):.1f} MB), {image_stats['cache']['bytes'] / (1024 * 1024):.1f} MB cached in memory")
     st.caption("Powered by Groq, Hugging Face, ChromaDB, and xAI")
 
 # ========== Main Content ==========
@@ -575,38 +583,80 @@ with st.container():
             st.markdown('<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Query must be at least 3 characters long.</div>', unsafe_allow_html=True)
         else:
             st.session_state.qa_history.append({"type": "user", "text": query})
-            query_hash = hashlib.md5(query.encode()).hexdigest()
-            if query_hash in st.session_state.query_cache:
-                answer, documents, metadatas = st.session_state.query_cache[query_hash]
-                st.session_state.query_cache.move_to_end(query_hash)
-            else:
-                try:
-                    model = st.session_state.get("embedding_model", SentenceTransformer("all-MiniLM-L6-v2", device="cuda" if torch.cuda.is_available() else "cpu"))
-                    st.session_state["embedding_model"] = model
-                    client = PersistentClient(path=persist_dir)
-                    collection = client.get_or_create_collection("rag_pdf")
-                    query_embedding = model.encode(query, show_progress_bar=False).tolist()
-                    results = collection.query(query_embeddings=[query_embedding], n_results=3)
-                    documents = results.get("documents", [[]])[0]
-                    metadatas = results.get("metadatas", [[]])[0] or [{}] * len(documents)
-                    if not documents:
-                        answer = "No relevant information found in the database for your query."
-                        documents = []
-                        metadatas = []
-                    else:
-                        context = "\n\n".join(documents)
-                        with st.spinner("Generating answer..."):
-                            answer = generate_answer(query, context)
-                    st.session_state.query_cache[query_hash] = (answer, documents, metadatas)
-                    if len(st.session_state.query_cache) > 100:
-                        st.session_state.query_cache.popitem(last=False)
-                except Exception as e:
-                    st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Query failed: {e}</div>', unsafe_allow_html=True)
-                    answer = "Sorry, I couldn't process your query due to an error."
-                    documents = []
-                    metadatas = []
+            try:
+                api = get_api_client()
+                events = api.run_query(query, collections=search_collections, where=query_where) if api else run_query(query, persist_dir, collections=search_collections, where=query_where)
+                answer_placeholder = st.empty()
+                tokens = []
+                render_s = 0.0
+                result = None
+                for event in events:
+                    if event["event"] == "token":
+                        tokens.append(event["text"])
+                        render_start = time.perf_counter()
+                        answer_placeholder.markdown(f"<div class='message bot'><i class='fas fa-robot'></i> {''.join(tokens)}▌</div>", unsafe_allow_html=True)
+                        render_s += time.perf_counter() - render_start
+                    elif event["event"] == "done":
+                        result = event
+                answer_placeholder.empty()
+                # Streamlit time spent redrawing the partial answer.
+                record("render", render_s, updates=len(tokens))
+                answer, documents, metadatas = result["answer"], result["documents"], result["metadatas"]
+                if result.get("error"):
+                    st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> The language model could not answer: {result["error"]}</div>', unsafe_allow_html=True)
+                    answer = answer or "Sorry, I couldn't process your query due to an error."
+                st.session_state["last_cache_match"] = result["cache_match"]
+                st.session_state["last_context_stats"] = result["context_stats"]
+                st.session_state["last_query_timings"] = dict(result["timings"], render=render_s)
+            except Exception as e:
+                st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Query failed: {e}</div>', unsafe_allow_html=True)
+                answer = "Sorry, I couldn't process your query due to an error."
+                documents = []
+                metadatas = []
             st.session_state.qa_history.append({"type": "bot", "text": answer})
             time.sleep(0.1)
+    if st.session_state.get("last_cache_match"):
+        match = st.session_state["last_cache_match"]
+        st.caption(f"Answered from the shared cache: matched \"{bleach.clean(match['matched_question'], tags=[], strip=True)}\" (similarity {match['similarity']})")
+    if st.session_state.get("last_context_stats"):
+        packed = st.session_state["last_context_stats"]
+        st.caption(f"Context: {packed['tokens_used']}/{packed['budget']} tokens from {packed['packed']} blocks ({packed['candidates']} candidates, {packed['blocks']} after merging neighbours, {packed['dropped']} over budget)")
+    if st.session_state.get("last_query_timings"):
+        breakdown = " · ".join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in st.session_state["last_query_timings"].items())
+        st.caption(f"Last query latency: {breakdown} (reusing the Chroma handle saves {open_cost(persist_dir) * 1000:.0f} ms per query)")
+    with st.expander("Performance"):
+        st.markdown("<i class='fas fa-tachometer-alt'></i> Stage latency over the last requests", unsafe_allow_html=True)
+        tracer = get_tracer()
+        last_trace = tracer.last_trace("query")
+        if last_trace:
+            st.dataframe(
+                [{"stage": s["name"], "parent": s["parent"], "ms": round(s["duration_s"] * 1000, 2), **s["attrs"]} for s in last_trace],
+                use_container_width=True,
+            )
+        try:
+            stage_summary = get_api_client().stats()["stages"] if get_api_client() else tracer.summary()
+        except Exception as e:
+            stage_summary = []
+            st.markdown(f'<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> Could not load server stats: {e}</div>', unsafe_allow_html=True)
+        if stage_summary:
+            st.dataframe(stage_summary, use_container_width=True)
+            col_prom, col_jsonl = st.columns(2)
+            with col_prom:
+                st.download_button("⬇️ Prometheus metrics", data=tracer.prometheus_text(), file_name="ragvisor_metrics.prom", mime="text/plain", key="download_metrics")
+            with col_jsonl:
+                st.download_button("⬇️ Spans (JSON lines)", data=tracer.jsonl_text(), file_name="ragvisor_spans.jsonl", mime="application/json", key="download_spans")
+        else:
+            st.caption("No spans recorded yet.")
+        try:
+            startup = get_api_client().stats()["startup"] if get_api_client() else startup_report()
+        except Exception:
+            startup = None
+        if startup:
+            imports = " · ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup["imports"].items() if seconds)
+            steps = " · ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup["steps"].items())
+            st.caption(f"Startup: imports {imports or 'preloaded'}; warm-up {steps} ({startup['total_s']} s total, then {startup.get('warm_query_ms', '-')} ms per retrieval)")
+        else:
+            st.caption("Warming up the model and indexes...")
 
 # Chat History with Toggle
 with st.container():
@@ -638,12 +688,27 @@ if "documents" in locals() and documents and metadatas:
                 metadata = {}
             source = metadata.get('source', 'Unknown Source')
             chunk_id = metadata.get('chunk_id', 'Unknown ID')
-            st.markdown(f"<div class='chunk-card'><strong>Chunk {i} (Source: {source}, ID: {chunk_id}):</strong><br>{doc}</div>", unsafe_allow_html=True)
+            page = f", Page: {metadata['page']}" if metadata.get('page') else ""
+            also_in = f", Also in: {', '.join(metadata['duplicate_sources'])}" if metadata.get('duplicate_sources') else ""
+            st.markdown(f"<div class='chunk-card'><strong>Chunk {i} (Source: {source}{page}{also_in}, ID: {chunk_id}):</strong><br>{doc}</div>", unsafe_allow_html=True)
 else:
     st.markdown('<div class="custom-warning"><i class="fas fa-exclamation-triangle"></i> No documents retrieved or metadata missing.</div>', unsafe_allow_html=True)
 
 # ... (rest of the code remains unchanged, including Image Generation, Image Gallery, Footer, and JavaScript)
 # Image Generation Section (Using DeepAI)
+def generate_deepai_image(prompt):
+    """Generate an image with DeepAI text2img and download it; only called for prompts the image store lacks."""
+    headers = {"api-key": os.getenv("DEEPAI_API_KEY")}
+    response = requests.post("https://api.deepai.org/api/text2img", data={"text": prompt}, headers=headers, timeout=30)
+    response.raise_for_status()
+    img_url = response.json().get("output_url")
+    if not img_url:
+        raise ValueError("Failed to retrieve image URL.")
+    img_response = requests.get(img_url, timeout=30)
+    img_response.raise_for_status()
+    return img_response.content
+
+
 with st.container():
     st.markdown('<div class="image-card">', unsafe_allow_html=True)
     st.markdown("## <i class='fas fa-image'></i> Image Generation", unsafe_allow_html=True)
@@ -665,26 +730,15 @@ with st.container():
             else:
                 with st.spinner("Generating image..."):
                     try:
-                        deepai_api_key = os.getenv("DEEPAI_API_KEY")
-                        headers = {"api-key": deepai_api_key}
-                        api_url = "https://api.deepai.org/api/text2img"
-                        payload = {"text": img_prompt}
-                        response = requests.post(api_url, data=payload, headers=headers, timeout=30)
-                        response.raise_for_status()
-                        img_url = response.json().get("output_url")
-                        if img_url:
-                            img_response = requests.get(img_url, timeout=30)
-                            img_response.raise_for_status()
-                            image_bytes = BytesIO(img_response.content)
-                            image = Image.open(image_bytes)
-                            st.image(image, caption=f"🖼️ Generated Image: {img_prompt[:50]}...", use_container_width=True, output_format="PNG")
-                            image_id = hashlib.md5(img_prompt.encode()).hexdigest()
-                            st.session_state.images.append({"id": image_id, "prompt": img_prompt, "image": image_bytes.getvalue()})
-                            st.download_button("⬇️ Download Image", data=image_bytes.getvalue(), file_name=f"generated_{image_id}.png", mime="image/png", key=f"download_image_{image_id}")
-                        else:
-                            st.markdown('<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Failed to retrieve image URL.</div>', unsafe_allow_html=True)
+                        image, cached = get_image_store().get_or_create(img_prompt, generate_deepai_image)
+                        image_bytes = get_image_store().image_bytes(image["id"])
+                        source_note = " (from the image store)" if cached else ""
+                        st.image(image_bytes, caption=f"🖼️ Generated Image{source_note}: {img_prompt[:50]}...", use_container_width=True)
+                        if image["id"] not in st.session_state.images:
+                            st.session_state.images.append(image["id"])
+                        st.download_button("⬇️ Download Image", data=image_bytes, file_name=f"generated_{image['id'][:16]}.{image['format']}", mime=f"image/{image['format']}", key=f"download_image_{image['id']}")
                     except requests.exceptions.HTTPError as e:
-                        if response.status_code == 429:
+                        if e.response is not None and e.response.status_code == 429:
                             st.markdown('<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Rate limit exceeded. Try again later or sign up for a free DeepAI account: <a href="https://deepai.org">DeepAI</a>.</div>', unsafe_allow_html=True)
                         else:
                             st.markdown(f'<div class="custom-error"><i class="fas fa-exclamation-circle"></i> Image generation failed: {e}</div>', unsafe_allow_html=True)
@@ -693,19 +747,40 @@ with st.container():
     st.markdown('</div>', unsafe_allow_html=True)
 
 # Image Gallery
+GALLERY_PAGE_SIZE = 9
+
+
+@st.fragment
+def render_gallery():
+    """Thumbnails of the current page only; paging reruns just this fragment."""
+    if not st.toggle("View Generated Images", key="show_gallery"):
+        return
+    store = get_image_store()
+    image_ids = st.session_state.images
+    pages = (len(image_ids) - 1) // GALLERY_PAGE_SIZE + 1
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, key="image_page")
+    start_idx = (page - 1) * GALLERY_PAGE_SIZE
+    cols = st.columns(3)
+    for i, image_id in enumerate(image_ids[start_idx:start_idx + GALLERY_PAGE_SIZE]):
+        with cols[i % 3]:
+            image = store.get(image_id)
+            thumbnail = store.thumbnail(image_id) if image else None
+            if thumbnail is None:
+                st.caption("This image was removed from the image store.")
+                continue
+            st.image(thumbnail, caption=image["prompt"][:50] + "...", use_container_width=True)
+            # Full-size bytes are read only for the image picked for download, not for every thumbnail on each rerun.
+            if st.session_state.get("gallery_download") == image_id:
+                image_bytes = store.image_bytes(image_id)
+                if image_bytes is not None:
+                    st.download_button("⬇️ Save", data=image_bytes, file_name=f"generated_{image_id[:16]}.{image['format']}", mime=f"image/{image['format']}", key=f"download_gallery_{image_id}")
+            else:
+                st.button("⬇️ Download", key=f"pick_gallery_{image_id}", on_click=st.session_state.__setitem__, args=("gallery_download", image_id))
+
 if st.session_state.images:
     with st.container():
         st.markdown("## <i class='fas fa-images'></i> Image Gallery", unsafe_allow_html=True)
-        with st.expander("View Generated Images"):
-            st.markdown("<i class='fas fa-images'></i> Generated Images", unsafe_allow_html=True)
-            page = st.number_input("Page", min_value=1, max_value=(len(st.session_state.images) // 9) + 1, value=1, key="image_page")
-            start_idx = (page - 1) * 9
-            end_idx = start_idx + 9
-            cols = st.columns(3)
-            for i, img_data in enumerate(st.session_state.images[start_idx:end_idx]):
-                with cols[i % 3]:
-                    st.image(img_data["image"], caption=img_data["prompt"][:50] + "...", use_container_width=True, output_format="PNG")
-                    st.download_button("⬇️ Download", data=img_data["image"], file_name=f"generated_{img_data['id']}.png", mime="image/png", key=f"download_gallery_{i}_{img_data['id']}")
+        render_gallery()
 
 # Footer
 st.markdown("""
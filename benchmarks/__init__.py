@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for ingestion, embedding, Chroma and query latency.
+
+Run with:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json   # fail on regressions
+"""
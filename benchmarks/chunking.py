@@ -0,0 +1,115 @@
+"""
+Chunking throughput and chunk quality: the token-based, structure-aware
+chunker against the character splitter it replaced.
+
+Both split the same synthetic pages (headings, wrapped paragraphs, a few
+over-long lines) after cleaning; the old splitter is langchain's
+RecursiveCharacterTextSplitter at 500/100 characters and is skipped if
+langchain is not installed. Token counts use the embedding model's
+tokenizer (see chunker.TokenCounter).
+
+    python -m benchmarks.chunking --pages 2000
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import textwrap
+import time
+from pathlib import Path
+import numpy as np
+from benchmarks.corpus import _paragraph
+from chunker import CHUNK_TOKENS, chunk_text, get_token_counter, is_heading
+from loader import clean_text
+
+# all-MiniLM-L6-v2 reads 256 tokens including [CLS] and [SEP]; the rest is truncated.
+MODEL_MAX_TOKENS = 254
+
+
+def synthetic_pages(n, seed=0):
+    """Pages shaped like extracted PDF text: numbered and all-caps headings over wrapped paragraphs."""
+    rng = random.Random(seed)
+    pages = []
+    for page in range(n):
+        lines = []
+        for section in range(rng.randint(1, 3)):
+            lines.append(f"{page + 1}.{section + 1} Section {section + 1} overview" if section % 2 else f"PART {page + 1} SUMMARY")
+            for _ in range(rng.randint(1, 4)):
+                lines.extend(textwrap.wrap(_paragraph(rng, rng.randint(2, 8)), 90))
+                lines.append("")
+        if rng.random() < 0.1:
+            lines.append(_paragraph(rng, 30))
+        pages.append("\n".join(lines))
+    return pages
+
+
+def legacy_clean_text(text):
+    """The line-by-line cleaner that clean_text() replaced."""
+    clean_lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or "placeholder response" in line.lower():
+            continue
+        if re.match(r"^answer to '.*?':", line.lower()):
+            continue
+        clean_lines.append(line)
+    return "\n".join(clean_lines)
+
+
+def _time(fn, pages):
+    start = time.perf_counter()
+    result = [fn(page) for page in pages]
+    return result, time.perf_counter() - start
+
+
+def _quality(chunks, elapsed, counter):
+    tokens = np.array(counter.count(chunks)) if chunks else np.zeros(1)
+    return {
+        "chunks": len(chunks),
+        "chunks_per_s": round(len(chunks) / (elapsed or 1e-9), 1),
+        "mean_tokens": round(float(tokens.mean()), 1),
+        "p95_tokens": int(np.percentile(tokens, 95)),
+        "truncated_by_model": int((tokens > MODEL_MAX_TOKENS).sum()),
+        "ending_in_heading": sum(is_heading(chunk.rsplit("\n", 1)[-1].strip()) for chunk in chunks),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chunking engine.")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    raw = synthetic_pages(args.pages)
+    counter = get_token_counter()
+    results = {"pages": args.pages, "megabytes": round(sum(len(p) for p in raw) / 1e6, 2), "exact_tokens": counter.exact}
+
+    _, legacy_s = _time(legacy_clean_text, raw)
+    pages, clean_s = _time(clean_text, raw)
+    results["clean"] = {
+        "legacy_pages_per_s": round(len(raw) / legacy_s, 1),
+        "pages_per_s": round(len(raw) / clean_s, 1),
+    }
+
+    chunked, elapsed = _time(chunk_text, pages)
+    results["token_chunker"] = _quality([chunk for page in chunked for chunk, _, _ in page], elapsed, counter)
+    results["token_chunker"]["max_tokens"] = CHUNK_TOKENS
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+    except ImportError:
+        results["character_splitter"] = None
+    else:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+        # The old cleaner dropped blank lines, so the splitter never saw paragraph breaks.
+        split, elapsed = _time(splitter.split_text, [legacy_clean_text(page) for page in raw])
+        results["character_splitter"] = _quality([chunk for page in split for chunk in page], elapsed, counter)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Synthetic corpus with a labelled question set.
+
+Every document mixes filler prose with a few unique "facts" (project access
+codes, error codes, clause numbers). Each fact yields one question whose
+expected answer string must appear in a retrieved chunk for a recall hit.
+"""
+import json
+import random
+import textwrap
+from pathlib import Path
+
+_WORDS = (
+    "system data report policy network service customer process support update "
+    "document account release security version module storage analysis review "
+    "request response quality budget schedule resource contract vendor training"
+).split()
+
+_FACT_TEMPLATES = [
+    ("The access code for project {name} is {code}.", "What is the access code for project {name}?"),
+    ("Error {code} in the {name} module means the cache was exhausted.", "What does error {code} mean in the {name} module?"),
+    ("Clause {code} of the {name} agreement covers early termination.", "Which clause of the {name} agreement covers early termination?"),
+]
+
+
+def _sentence(rng, length=14):
+    words = [rng.choice(_WORDS) for _ in range(length)]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng, sentences=6):
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def _escape_pdf(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages, line_width=90):
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)."""
+    objects = []
+
+    def add(obj):
+        objects.append(obj)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n"):
+            lines.extend(textwrap.wrap(paragraph, line_width))
+            lines.append("")
+        ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+        ops += [f"({_escape_pdf(line)}) Tj T*" for line in lines[:64]]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    Path(path).write_bytes(bytes(out))
+
+
+def generate_corpus(folder, n_pdfs=20, n_texts=20, pages_per_pdf=5, facts_per_doc=3, seed=42):
+    """
+    Write a synthetic corpus and its question set to folder.
+    Returns:
+        List of {"question", "answer", "source"} dicts (also saved as questions.json).
+    """
+    rng = random.Random(seed)
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    questions = []
+
+    def make_facts(source):
+        facts = []
+        for _ in range(facts_per_doc):
+            fact_template, question_template = rng.choice(_FACT_TEMPLATES)
+            name = f"{rng.choice(_WORDS)}{rng.randint(100, 999)}"
+            code = f"{rng.choice('ABCDEFGHJK')}-{rng.randint(1000, 9999)}"
+            facts.append(fact_template.format(name=name, code=code))
+            questions.append({
+                "question": question_template.format(name=name, code=code),
+                "answer": code,
+                "source": source,
+            })
+        return facts
+
+    for i in range(n_pdfs):
+        source = f"synthetic_{i:04d}.pdf"
+        facts = make_facts(source)
+        pages = []
+        for page in range(pages_per_pdf):
+            paragraphs = [_paragraph(rng, sentences=4) for _ in range(3)]
+            if page < len(facts):
+                paragraphs.insert(rng.randint(0, len(paragraphs)), facts[page])
+            pages.append("\n".join(paragraphs))
+        write_pdf(folder / source, pages)
+
+    for i in range(n_texts):
+        source = f"synthetic_{i:04d}.txt"
+        paragraphs = [_paragraph(rng) for _ in range(8)]
+        for fact in make_facts(source):
+            paragraphs.insert(rng.randint(0, len(paragraphs)), fact)
+        (folder / source).write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+    (folder / "questions.json").write_text(json.dumps(questions, indent=2), encoding="utf-8")
+    return questions
+
+
+def load_questions(path):
+    """Load a labelled question set ([{"question", "answer", "source"}, ...])."""
+    return json.loads(Path(path).read_text(encoding="utf-8"))
@@ -0,0 +1,84 @@
+"""
+Memory / recall / latency trade-offs of the compact vector modes.
+
+Builds float16 and int8 QuantizedVectorIndex copies of a synthetic clustered
+embedding set and compares their top-k against exact float32 search, with
+and without oversampled re-ranking.
+
+    python -m benchmarks.quantization --vectors 200000 --dimension 384
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from vector_index import QuantizedVectorIndex
+
+
+def synthetic_embeddings(n, dimension, clusters=256, seed=0):
+    """Unit vectors scattered around random centroids, roughly like sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centroids = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centroids[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors, queries, k, block=16384):
+    sqnorms = np.einsum("ij,ij->i", vectors, vectors)
+    distances = np.empty((len(vectors), len(queries)), dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        distances[start:start + block] = sqnorms[start:start + block, None] - 2 * vectors[start:start + block] @ queries.T
+    return [set(np.argpartition(distances[:, j], k)[:k].tolist()) for j in range(len(queries))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark quantized vector storage.")
+    parser.add_argument("--vectors", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", default="1,4,10", help="Re-rank shortlist multipliers to compare")
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args(argv)
+
+    vectors = synthetic_embeddings(args.vectors, args.dimension)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dimension)).astype(np.float32)
+    truth = exact_top_k(vectors, queries, args.k)
+    ids = [str(i) for i in range(len(vectors))]
+
+    results = {"float32": {"bytes": int(vectors.nbytes), "recall_at_k": 1.0}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("float16", "int8"):
+            index = QuantizedVectorIndex(Path(tmp) / f"bench.{mode}", mode)
+            start = time.perf_counter()
+            for offset in range(0, len(vectors), 10000):
+                index.add(ids[offset:offset + 10000], vectors[offset:offset + 10000])
+            build_s = time.perf_counter() - start
+            stats = index.stats()
+            results[mode] = {"bytes": stats["code_bytes"], "build_s": round(build_s, 2)}
+            for oversample in [int(x) for x in args.oversample.split(",")]:
+                latencies = []
+                hits = 0
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    found = index.search(query, k=args.k, oversample=oversample)[0]
+                    latencies.append(time.perf_counter() - start)
+                    hits += len(expected & {int(chunk_id) for chunk_id, _ in found})
+                results[mode][f"oversample_{oversample}"] = {
+                    "recall_at_k": round(hits / (args.k * len(queries)), 4),
+                    "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                    "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+                }
+            results[mode]["memory_vs_float32"] = round(stats["code_bytes"] / vectors.nbytes, 3)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
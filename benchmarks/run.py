@@ -0,0 +1,360 @@
+"""
+Offline benchmark suite: ingestion, embedding, Chroma upserts, query latency,
+recall@k, web crawling against a local site, cold start in a fresh process,
+end-to-end answer latency against a local Groq stub, and the Groq client's
+retries, Retry-After handling and request coalescing against failing stubs.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json --tolerance 0.15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+
+def _percentiles(samples_s):
+    samples_ms = np.array(samples_s) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 2),
+    }
+
+
+def bench_ingest(corpus_dir, persist_dir):
+    from ingest import ingest_folder
+
+    summary = ingest_folder(corpus_dir, persist_dir)
+    pages = sum(stats.get("pages", 0) for stats in summary["file_timings"])
+    wall = summary["wall_s"] or 1e-9
+    return {
+        "files": summary["files_ingested"],
+        "pages": pages,
+        "chunks": summary["chunks_embedded"],
+        "chunks_linked": summary["chunks_linked"],
+        "wall_s": wall,
+        "pages_per_s": round(pages / wall, 2),
+        "chunks_per_s": round(summary["chunks_embedded"] / wall, 2),
+        "stage_s": summary["stage_s"],
+    }
+
+
+def bench_embedding(texts, batch_sizes):
+    from embedder import get_embedding_service
+
+    model = get_embedding_service().model  # bypass the embedding cache
+    results = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+        elapsed = time.perf_counter() - start
+        results[f"batch_{batch_size}"] = {"texts_per_s": round(len(texts) / elapsed, 2)}
+    return results
+
+
+def bench_upsert(persist_dir, dimension, n_vectors=5000, batch_size=500):
+    """
+    Upsert numpy batches as ingest does: full embeddings into Chroma (float32
+    mode), and placeholders into Chroma plus the int8 sidecar (compact mode).
+    """
+    from vector_index import get_vector_index
+    from vectorstore import get_collection
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n_vectors, dimension)).astype(np.float32)
+    results = {"vectors": n_vectors}
+    for mode in ("float32", "int8"):
+        name = f"bench_upsert_{mode}"
+        collection = get_collection(persist_dir, name)
+        index = get_vector_index(persist_dir, name, collection, mode=mode)
+        start = time.perf_counter()
+        for i in range(0, n_vectors, batch_size):
+            batch = vectors[i:i + batch_size]
+            ids = [f"bench_{j}" for j in range(i, i + len(batch))]
+            collection.upsert(
+                ids=ids,
+                embeddings=batch if index is None else index.chroma_embeddings(collection, batch),
+                documents=[f"benchmark vector {j}" for j in range(i, i + len(batch))],
+            )
+            if index is not None:
+                index.add(ids, batch)
+        if index is not None:
+            index.save()
+        elapsed = time.perf_counter() - start
+        if mode == "float32":
+            results["vectors_per_s"] = round(n_vectors / elapsed, 2)
+        else:
+            results[mode] = {"vectors_per_s": round(n_vectors / elapsed, 2), **index.stats()}
+    return results
+
+
+def bench_queries(questions, persist_dir, k, modes=("dense", "lexical", "hybrid")):
+    from embedder import get_embedding_service
+    from retriever import retrieve
+
+    service = get_embedding_service()
+    embeddings = service.encode_queries([q["question"] for q in questions])
+    results = {}
+    for mode in modes:
+        # "<mode>+rerank" adds the cross-encoder stage, without a latency budget.
+        base_mode, rerank = mode.split("+")[0], mode.endswith("+rerank")
+        latencies = []
+        hits = 0
+        for question, embedding in zip(questions, embeddings):
+            start = time.perf_counter()
+            retrieved = retrieve(question["question"], persist_dir, query_embedding=embedding, n_results=k,
+                                 mode=base_mode, rerank=rerank, rerank_budget_ms=None)
+            latencies.append(time.perf_counter() - start)
+            if any(question["answer"] in document for document in retrieved["documents"]):
+                hits += 1
+        results[mode] = dict(_percentiles(latencies), **{f"recall_at_{k}": round(hits / len(questions), 4)})
+    return results
+
+
+def bench_crawl(workdir, n_pages=60, delay=0.02):
+    from benchmarks.stub_site import StubSite, linked_site
+    from crawler import CRAWL_CONCURRENCY, Crawler
+
+    results = {}
+    with StubSite(linked_site(n_pages), delay=delay) as site:
+        for concurrency in sorted({1, CRAWL_CONCURRENCY}):
+            out_dir = Path(workdir) / f"crawl_{concurrency}"
+            crawler = Crawler(out_dir, max_depth=10, max_pages=n_pages, concurrency=concurrency)
+            summary = crawler.crawl(site.url("/page/0.html"))
+            results[f"concurrency_{concurrency}"] = {
+                "pages": summary["pages_fetched"],
+                "pages_per_s": round(summary["pages_fetched"] / (summary["wall_s"] or 1e-9), 2),
+            }
+        # Re-crawl: every page should come back 304 Not Modified.
+        requests_before = len(site.requests)
+        summary = Crawler(out_dir, max_depth=10, max_pages=n_pages, concurrency=concurrency).crawl(site.url("/page/0.html"))
+        statuses = [status for _, status in site.requests[requests_before:]]
+        results["recrawl"] = {
+            "pages_unchanged": summary["pages_unchanged"],
+            "not_modified": statuses.count(304),
+            "pages_per_s": round(len(summary["pages"]) / (summary["wall_s"] or 1e-9), 2),
+        }
+        results["checks"] = {"recrawl_304": statuses.count(304) == len(statuses) == n_pages}
+
+        # Redirects are followed on the crawled host only; "localhost" is another host to the crawler.
+        port = site.url("/").rsplit(":", 1)[1].split("/")[0]
+        site.redirects.update({"/moved": "/page/1.html", "/away": f"http://localhost:{port}/page/2.html"})
+        requests_before = len(site.requests)
+        redirect_dir = Path(workdir) / "crawl_redirects"
+        moved = Crawler(redirect_dir).fetch(site.url("/moved"))
+        away = Crawler(redirect_dir).fetch(site.url("/away"))
+        requested = [path for path, _ in site.requests[requests_before:]]
+        results["checks"]["redirect_same_host"] = moved["status"] == "fetched"
+        results["checks"]["redirect_off_host_refused"] = away["status"] == "failed" and "/page/2.html" not in requested
+    results["stub_delay_ms"] = delay * 1000
+    return results
+
+
+def bench_startup(persist_dir):
+    """Warm up a fresh interpreter (python -m warmup), the way a restarted container starts."""
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-m", "warmup", "--persist-dir", str(persist_dir), "--json"],
+        capture_output=True, text=True, check=True, cwd=Path(__file__).resolve().parent.parent,
+    )
+    wall = time.perf_counter() - start
+    report = json.loads(completed.stdout[completed.stdout.index("{"):])
+    return {
+        "process_wall_s": round(wall, 3),
+        "imports_s": {name: seconds for name, seconds in report["imports"].items() if seconds is not None},
+        "steps_s": report["steps"],
+        "warm_query_ms": report.get("warm_query_ms"),
+    }
+
+
+def bench_end_to_end(questions, persist_dir, first_token_delay, token_delay):
+    from benchmarks.stub_llm import StubGroqServer
+
+    with StubGroqServer(first_token_delay=first_token_delay, token_delay=token_delay) as stub:
+        os.environ["GROQ_BASE_URL"] = stub.base_url
+        os.environ.setdefault("GROQ_API_KEY", "benchmark-stub")
+        import llm
+        from context_builder import build_context, context_budget
+        from retriever import retrieve
+
+        llm.GROQ_BASE_URL = stub.base_url
+        llm._client = None
+
+        first_tokens = []
+        totals = []
+        for question in questions:
+            start = time.perf_counter()
+            retrieved = retrieve(question["question"], persist_dir, n_results=20)
+            packed = build_context(
+                retrieved["ids"], retrieved["documents"], retrieved["metadatas"], retrieved["scores"],
+                context_budget(llm.DEFAULT_MODEL, 1000, question["question"]),
+            )
+            first = None
+            for _ in llm.stream_answer(question["question"], packed["context"]):
+                if first is None:
+                    first = time.perf_counter() - start
+            first_tokens.append(first or 0.0)
+            totals.append(time.perf_counter() - start)
+    return {
+        "first_token": _percentiles(first_tokens),
+        "total": _percentiles(totals),
+        "stub_first_token_delay_ms": first_token_delay * 1000,
+    }
+
+
+def bench_llm_resilience(first_token_delay, token_delay, retry_after_s=0.3, callers=8):
+    """
+    Answer through stubs that fail first: 5xx retries, a 429 with Retry-After
+    (seconds, then an unparseable value), and identical concurrent prompts.
+    Checks are False when the client sent more or fewer upstream requests
+    than expected or did not wait out Retry-After.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from benchmarks.stub_llm import StubGroqServer
+    import llm
+
+    def answer(stub, question="What does the contract say?"):
+        llm.GROQ_BASE_URL = stub.base_url
+        llm._client = None
+        start = time.perf_counter()
+        llm.generate_answer(question, "The contract says nothing of note.")
+        return time.perf_counter() - start
+
+    results = {"checks": {}}
+    scenarios = {
+        "retry_5xx": [503, 502],
+        "retry_after_429": [(429, {"Retry-After": str(retry_after_s)})],
+        "bad_retry_after": [(503, {"Retry-After": "soon"})],
+    }
+    for name, failures in scenarios.items():
+        with StubGroqServer(first_token_delay=first_token_delay, token_delay=token_delay, failures=failures) as stub:
+            before = llm.llm_stats()
+            elapsed = answer(stub)
+            retries = llm.llm_stats()["retries"] - before["retries"]
+        results[name] = {"wall_ms": round(elapsed * 1000, 2), "upstream_requests": len(stub.requests), "retries": retries}
+        results["checks"][name] = len(stub.requests) == len(failures) + 1 and retries == len(failures)
+    results["checks"]["retry_after_429"] &= results["retry_after_429"]["wall_ms"] >= retry_after_s * 1000
+
+    with StubGroqServer(first_token_delay=max(first_token_delay, 0.2), token_delay=token_delay) as stub:
+        before = llm.llm_stats()["coalesced"]
+        llm.GROQ_BASE_URL = stub.base_url
+        llm._client = None
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            list(pool.map(lambda _: llm.generate_answer("Same question?", "Same context."), range(callers)))
+        coalesced = llm.llm_stats()["coalesced"] - before
+    results["coalescing"] = {"callers": callers, "upstream_requests": len(stub.requests), "coalesced": coalesced}
+    results["checks"]["coalescing"] = len(stub.requests) == 1 and coalesced == callers - 1
+    llm._client = None
+    return results
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare against a baseline run.
+    Returns:
+        List of human-readable regressions (throughput/recall that dropped or
+        latency that grew by more than tolerance).
+    """
+    current = _flatten(results)
+    regressions = []
+    for name, old in _flatten(baseline).items():
+        new = current.get(name)
+        if new is None or not old:
+            continue
+        if name.endswith("_per_s") or ".recall_at_" in name:
+            if new < old * (1 - tolerance):
+                regressions.append(f"{name}: {old} -> {new}")
+        elif name.endswith("_ms") and "stub_" not in name:
+            if new > old * (1 + tolerance):
+                regressions.append(f"{name}: {old} -> {new}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline RAGvisor benchmark suite.")
+    parser.add_argument("--corpus", help="Existing corpus folder with questions.json (default: generate one)")
+    parser.add_argument("--pdfs", type=int, default=20, help="Synthetic PDFs to generate")
+    parser.add_argument("--texts", type=int, default=20, help="Synthetic text files to generate")
+    parser.add_argument("--pages", type=int, default=5, help="Pages per synthetic PDF")
+    parser.add_argument("--k", type=int, default=3, help="k for recall@k")
+    parser.add_argument("--batch-sizes", default="8,32,64,128", help="Embedding batch sizes to compare")
+    parser.add_argument("--rerank", action="store_true", help="Also measure hybrid retrieval with cross-encoder re-ranking")
+    parser.add_argument("--first-token-delay", type=float, default=0.1, help="Stub LLM time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Stub LLM delay per token (s)")
+    parser.add_argument("--workdir", help="Where to put the corpus and Chroma data (default: temp dir)")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--baseline", help="Baseline results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(args.workdir or tmp)
+        # Keep the benchmark out of the app's caches so every run starts cold.
+        os.environ["RAGVISOR_EMBED_CACHE_DIR"] = str(workdir / "embedding_cache")
+        # The stub has no quota; don't let the Groq rate limiter pace the run.
+        os.environ.setdefault("GROQ_RPM", "1000000")
+        os.environ.setdefault("GROQ_TPM", "1000000000")
+        from benchmarks.corpus import generate_corpus, load_questions
+
+        if args.corpus:
+            corpus_dir = Path(args.corpus)
+            questions = load_questions(corpus_dir / "questions.json")
+        else:
+            corpus_dir = workdir / "corpus"
+            questions = generate_corpus(corpus_dir, n_pdfs=args.pdfs, n_texts=args.texts, pages_per_pdf=args.pages)
+        persist_dir = str(workdir / "chroma_db")
+
+        from embedder import get_embedding_service
+
+        service = get_embedding_service()
+        results = {"embedding_model": {"load_time_s": round(service.load_time, 3)}}
+        results["ingest"] = bench_ingest(corpus_dir, persist_dir)
+
+        from vectorstore import get_collection
+
+        sample = get_collection(persist_dir).get(limit=512, include=["documents"])["documents"]
+        batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+        results["embedding"] = bench_embedding(sample, batch_sizes)
+        results["upsert"] = bench_upsert(persist_dir, service.dimension)
+        modes = ("dense", "lexical", "hybrid") + (("hybrid+rerank",) if args.rerank else ())
+        results["query"] = bench_queries(questions, persist_dir, args.k, modes)
+        results["crawl"] = bench_crawl(workdir)
+        results["startup"] = bench_startup(persist_dir)
+        results["end_to_end"] = bench_end_to_end(questions, persist_dir, args.first_token_delay, args.token_delay)
+        results["llm_resilience"] = bench_llm_resilience(args.first_token_delay, args.token_delay)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Local stand-in for the Groq OpenAI-compatible chat completions endpoint.
+
+Answers with a canned reply, streamed as server-sent events when the request
+asks for stream=True, with configurable time-to-first-token and per-token
+delays so end-to-end latency can be measured without network access.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGroqServer:
+    """
+    Usage:
+        with StubGroqServer(first_token_delay=0.2) as server:
+            os.environ["GROQ_BASE_URL"] = server.base_url
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_delay=0.1, token_delay=0.005,
+                 reply="This is a stubbed answer based on the provided context.", status=200, headers=None,
+                 failures=None):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.reply = reply
+        self.status = status
+        self.headers = headers or {}
+        # Statuses (or (status, headers) pairs) returned by the first requests
+        # before answering normally, e.g. [429, 503] to exercise client retries.
+        self.failures = list(failures or [])
+        self._lock = threading.Lock()
+        self.requests = []
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/openai/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests.append(body)
+                    failure = stub.failures.pop(0) if stub.failures else None
+                status, headers = stub.status, stub.headers
+                if failure is not None:
+                    status, headers = failure if isinstance(failure, tuple) else (failure, {})
+                if status != 200:
+                    payload = json.dumps({"error": {"message": "stub error", "type": "stub"}}).encode()
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                model = body.get("model", "stub")
+                tokens = [word + " " for word in stub.reply.split()]
+                time.sleep(stub.first_token_delay)
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for i, token in enumerate(tokens):
+                        if i:
+                            time.sleep(stub.token_delay)
+                        chunk = {
+                            "id": "stub",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        prompt_tokens = sum(len(m.get("content", "")) // 4 for m in body.get("messages", []))
+                        chunk = {
+                            "id": "stub",
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [],
+                            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                      "total_tokens": prompt_tokens + len(tokens)},
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    return
+
+                time.sleep(stub.token_delay * max(len(tokens) - 1, 0))
+                payload = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": stub.reply},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-groq", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,125 @@
+"""
+Local static website for exercising the crawler without network access.
+
+Serves a dict of path -> HTML with ETag and Last-Modified headers, answers
+conditional GETs with 304 Not Modified, redirects the paths in redirects
+(path -> Location) with a 302, and can add a per-request delay to simulate a
+slow origin.
+"""
+import hashlib
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def linked_site(n_pages, links_per_page=3, words_per_page=400):
+    """A tree of n_pages HTML pages, each linking to its children and back to the root."""
+    pages = {}
+    for i in range(n_pages):
+        children = [j for j in range(i * links_per_page + 1, (i + 1) * links_per_page + 1) if j < n_pages]
+        links = "".join(f'<li><a href="/page/{j}.html#top">Page {j}</a></li>' for j in children)
+        body = " ".join(f"page{i}word{k % 50}" for k in range(words_per_page))
+        pages[f"/page/{i}.html"] = (
+            f"<html><head><title>Page {i}</title><style>p {{ color: red; }}</style></head><body>"
+            f"<nav><a href=\"/page/0.html\">Home</a></nav><h1>Page {i}</h1><p>{body}</p>"
+            f"<ul>{links}</ul><script>var tracking = {i};</script></body></html>"
+        )
+    pages["/"] = pages["/page/0.html"]
+    return pages
+
+
+class StubSite:
+    """
+    Usage:
+        with StubSite(linked_site(50)) as site:
+            Crawler(out_dir, max_depth=3).crawl(site.url("/"))
+    """
+
+    def __init__(self, pages, host="127.0.0.1", port=0, delay=0.0, etag=True, last_modified=True, redirects=None):
+        self.pages = dict(pages)
+        self.redirects = dict(redirects or {})
+        self.delay = delay
+        self.etag = etag
+        self.last_modified = last_modified
+        self.modified_at = formatdate(time.time() - 3600, usegmt=True)
+        self._lock = threading.Lock()
+        self.requests = []  # (path, status) per request
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    def url(self, path="/"):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def set_page(self, path, html):
+        with self._lock:
+            self.pages[path] = html
+            self.modified_at = formatdate(time.time(), usegmt=True)
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if site.delay:
+                    time.sleep(site.delay)
+                with site._lock:
+                    html = site.pages.get(self.path)
+                    modified_at = site.modified_at
+                    location = site.redirects.get(self.path)
+                if location is not None:
+                    with site._lock:
+                        site.requests.append((self.path, 302))
+                    self.send_response(302)
+                    self.send_header("Location", location)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if html is None:
+                    status = 404
+                    payload = b"not found"
+                else:
+                    payload = html.encode("utf-8")
+                    tag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+                    not_modified = (
+                        (site.etag and self.headers.get("If-None-Match") == tag)
+                        or (not site.etag and site.last_modified and self.headers.get("If-Modified-Since") == modified_at)
+                    )
+                    status = 304 if not_modified else 200
+                with site._lock:
+                    site.requests.append((self.path, status))
+
+                self.send_response(status)
+                if html is not None:
+                    if site.etag:
+                        self.send_header("ETag", tag)
+                    if site.last_modified:
+                        self.send_header("Last-Modified", modified_at)
+                if status == 304:
+                    self.end_headers()
+                    return
+                self.send_header("Content-Type", "text/html; charset=utf-8" if html is not None else "text/plain")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-site", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
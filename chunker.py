@@ -0,0 +1,184 @@
+"""
+Structure-aware chunking measured in embedding-model tokens.
+
+Chunks are packed from whole lines of one page at a time, up to CHUNK_TOKENS
+tokens of the embedding model's own tokenizer, so the encoder never silently
+truncates a chunk and no chunk straddles two pages. A heading closes the
+chunk before it (and is never left dangling at the end of one), a line is
+only cut at sentence boundaries when it doesn't fit on its own, and every
+chunk is an exact slice of its page, returned with its character offsets.
+
+    python -m benchmarks.chunking
+"""
+import os
+import re
+import threading
+
+CHUNK_TOKENS = int(os.getenv("RAGVISOR_CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("RAGVISOR_CHUNK_OVERLAP_TOKENS", "30"))
+# Tokenizer of the embedding model (all-MiniLM-L6-v2 reads at most 256 tokens).
+TOKENIZER_NAME = os.getenv("RAGVISOR_CHUNK_TOKENIZER", "sentence-transformers/all-MiniLM-L6-v2")
+# A heading starts a new chunk once the current one holds this share of the budget.
+SECTION_MIN_FILL = 0.25
+MAX_HEADING_CHARS = 80
+
+_LINE_RE = re.compile(r"[^\n]+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_WORD_RE = re.compile(r"\S+")
+_HEADING_RE = re.compile(
+    r"#{1,6}\s+\S.*"
+    r"|(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|(?:Chapter|Section|Part|Appendix)\s+[\dIVXLCA-Z]+[.:]?)\s+[A-Z].*"
+    r"|[A-Z][A-Z0-9 ,&:'()/\-]{3,}"
+)
+# WordPiece keeps common words whole and cuts long ones into pieces of a few characters.
+_APPROX_TOKEN_RE = re.compile(r"\w{1,6}|[^\w\s]")
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+class TokenCounter:
+    """
+    Counts tokens with the embedding model's tokenizer.
+
+    Falls back to a regex estimate of WordPiece tokens when the tokenizers
+    package or the model's tokenizer.json is not available (exact is False).
+    """
+
+    def __init__(self, name=TOKENIZER_NAME):
+        self.name = name
+        self._tokenizer = None
+        try:
+            from huggingface_hub import hf_hub_download
+            from tokenizers import Tokenizer
+
+            tokenizer = Tokenizer.from_file(hf_hub_download(name, "tokenizer.json"))
+            tokenizer.no_truncation()
+            tokenizer.no_padding()
+            self._tokenizer = tokenizer
+        except Exception as e:
+            print(f"[WARN] Tokenizer {name} unavailable, estimating chunk sizes — {e}")
+
+    @property
+    def exact(self):
+        return self._tokenizer is not None
+
+    def count(self, texts):
+        """Token count of each text, without special tokens."""
+        if not texts:
+            return []
+        if self._tokenizer is None:
+            return [len(_APPROX_TOKEN_RE.findall(text)) for text in texts]
+        return [len(encoding.ids) for encoding in self._tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def get_token_counter():
+    """The process-wide TokenCounter (each parser process loads its own)."""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter()
+    return _counter
+
+
+def is_heading(line):
+    """Markdown, numbered ("2.1 Scope", "Section 4: Fees") or all-caps title lines."""
+    return len(line) <= MAX_HEADING_CHARS and not line.endswith((".", ",", ";")) and bool(_HEADING_RE.fullmatch(line))
+
+
+def _pieces(text, start, end, pattern, counter):
+    """Cut text[start:end] at the separators matched by pattern; returns [(start, end, tokens)]."""
+    spans = []
+    for match in pattern.finditer(text, start, end):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, end))
+    return [(a, b, tokens) for (a, b), tokens in zip(spans, counter.count([text[a:b] for a, b in spans]))]
+
+
+def _units(text, max_tokens, counter):
+    """
+    Lines of text as (start, end, tokens, heading) units, with lines over
+    max_tokens cut into sentences and sentences still over it into words.
+    """
+    lines = [(match.start(), match.end()) for match in _LINE_RE.finditer(text)]
+    units = []
+    for (start, end), tokens in zip(lines, counter.count([text[a:b] for a, b in lines])):
+        if tokens <= max_tokens:
+            units.append((start, end, tokens, is_heading(text[start:end])))
+            continue
+        for s_start, s_end, s_tokens in _pieces(text, start, end, _SENTENCE_END_RE, counter):
+            if s_tokens <= max_tokens:
+                units.append((s_start, s_end, s_tokens, False))
+            else:
+                words = [(m.start(), m.end()) for m in _WORD_RE.finditer(text, s_start, s_end)]
+                counts = counter.count([text[a:b] for a, b in words])
+                for (a, b), tokens in zip(words, counts):
+                    units.extend(_split_word(text, a, b, tokens, max_tokens, counter))
+    return units
+
+
+def _split_word(text, start, end, tokens, max_tokens, counter):
+    """
+    A run without whitespace (URLs, base64, tables) cut into character windows
+    that fit; the window size is only an estimate, so each window is recounted
+    and cut again until it is within max_tokens.
+    """
+    if tokens <= max_tokens or end - start <= 1:
+        return [(start, end, tokens, False)]
+    step = max(1, (end - start) * max_tokens // (tokens * 2))
+    spans = [(a, min(a + step, end)) for a in range(start, end, step)]
+    units = []
+    for (a, b), n in zip(spans, counter.count([text[a:b] for a, b in spans])):
+        units.extend(_split_word(text, a, b, n, max_tokens, counter))
+    return units
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, counter=None):
+    """
+    Split one page into chunks of at most max_tokens tokens.
+
+    Chunks end at line (or, for over-long lines, sentence) boundaries, start
+    a new one at a heading once the current chunk is SECTION_MIN_FILL full,
+    and repeat up to overlap_tokens of trailing lines from the previous
+    chunk, except at the start of a section.
+    Args:
+        text: Cleaned page text.
+        max_tokens: Chunk budget in tokens of the embedding model.
+        overlap_tokens: Tokens carried over between neighbouring chunks.
+        counter: TokenCounter to use; defaults to get_token_counter().
+    Returns:
+        List of (chunk_text, start_offset, end_offset) with
+        chunk_text == text[start_offset:end_offset].
+    """
+    counter = counter or get_token_counter()
+    units = _units(text, max_tokens, counter)
+    chunks = []
+
+    def emit(first, last):
+        start, end = units[first][0], units[last - 1][1]
+        chunks.append((text[start:end], start, end))
+
+    first = 0
+    tokens = 0
+    for i, (_, _, unit_tokens, heading) in enumerate(units):
+        if i > first and (tokens + unit_tokens > max_tokens or (heading and tokens >= SECTION_MIN_FILL * max_tokens)):
+            # Headings at the end of the chunk belong to the text after them.
+            end = i
+            while end - 1 > first and units[end - 1][3]:
+                end -= 1
+            emit(first, end)
+            next_first = end
+            if not units[end][3]:
+                while next_first - 1 > first and sum(u[2] for u in units[next_first - 1:end]) <= overlap_tokens:
+                    next_first -= 1
+            first = next_first
+            tokens = sum(u[2] for u in units[first:i])
+            while first < i and tokens + unit_tokens > max_tokens:
+                tokens -= units[first][2]
+                first += 1
+        tokens += unit_tokens
+    if first < len(units):
+        emit(first, len(units))
+    return chunks
@@ -0,0 +1,127 @@
+import math
+import os
+
+# Context windows of the Groq models we use (tokens).
+MODEL_CONTEXT_WINDOWS = {
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "gemma2-9b-it": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+PROMPT_OVERHEAD_TOKENS = 150
+BLOCK_SEPARATOR = "\n\n"
+DEFAULT_MAX_CONTEXT_TOKENS = int(os.getenv("RAGVISOR_CONTEXT_MAX_TOKENS", "2000"))
+
+
+def estimate_tokens(text):
+    """
+    Approximate LLM token count (~4 characters per token for English text).
+    Cheap enough to run on every candidate chunk at query time.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def context_budget(model, max_answer_tokens, question="", max_context_tokens=DEFAULT_MAX_CONTEXT_TOKENS):
+    """
+    Tokens available for retrieved context: the model's window minus the
+    answer allowance, the prompt template and the question, capped at
+    max_context_tokens (lower it to trade answer quality for latency).
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    available = window - max_answer_tokens - PROMPT_OVERHEAD_TOKENS - estimate_tokens(question)
+    return max(0, min(available, max_context_tokens))
+
+
+def _merge_neighbours(candidates):
+    """
+    Merge overlapping or adjacent chunks from the same source into single
+    blocks, using the start_index offsets recorded at ingest time.
+    """
+    by_source = {}
+    loose = []
+    for candidate in candidates:
+        metadata = candidate["metadata"] or {}
+        if "start_index" in metadata and "source" in metadata:
+            by_source.setdefault(metadata["source"], []).append(candidate)
+        else:
+            loose.append(candidate)
+
+    blocks = []
+    for source, items in by_source.items():
+        items.sort(key=lambda c: c["metadata"]["start_index"])
+        current = None
+        for item in items:
+            start = item["metadata"]["start_index"]
+            end = start + len(item["document"])
+            if current and start <= current["end"]:
+                if end > current["end"]:
+                    current["document"] += item["document"][current["end"] - start:]
+                    current["end"] = end
+                current["ids"].append(item["id"])
+                current["score"] = max(current["score"], item["score"])
+                continue
+            current = {
+                "ids": [item["id"]],
+                "document": item["document"],
+                "metadata": item["metadata"],
+                "score": item["score"],
+                "start": start,
+                "end": end,
+            }
+            blocks.append(current)
+
+    for item in loose:
+        blocks.append({
+            "ids": [item["id"]],
+            "document": item["document"],
+            "metadata": item["metadata"] or {},
+            "score": item["score"],
+        })
+    return blocks
+
+
+def build_context(ids, documents, metadatas, scores, budget_tokens):
+    """
+    Pack retrieved chunks into a context string that fits a token budget.
+
+    Overlapping neighbour chunks are merged into one block (dropping the
+    duplicated overlap), then blocks are added best-score first while they
+    fit the budget.
+    Args:
+        ids, documents, metadatas, scores: Parallel lists from retriever.retrieve.
+        budget_tokens: Maximum context size in tokens.
+    Returns:
+        Dict with context, documents/metadatas of the packed blocks,
+        tokens_used, budget and counts of candidates, blocks and dropped blocks.
+    """
+    candidates = [
+        {"id": i, "document": d, "metadata": m, "score": s}
+        for i, d, m, s in zip(ids, documents, metadatas, scores)
+    ]
+    blocks = sorted(_merge_neighbours(candidates), key=lambda b: b["score"], reverse=True)
+
+    separator_tokens = estimate_tokens(BLOCK_SEPARATOR)
+    packed = []
+    used = 0
+    dropped = 0
+    for block in blocks:
+        cost = estimate_tokens(block["document"]) + (separator_tokens if packed else 0)
+        if used + cost > budget_tokens:
+            dropped += 1
+            continue
+        packed.append(block)
+        used += cost
+
+    return {
+        "context": BLOCK_SEPARATOR.join(block["document"] for block in packed),
+        "documents": [block["document"] for block in packed],
+        "metadatas": [dict(block["metadata"], merged_chunks=len(block["ids"])) for block in packed],
+        "tokens_used": used,
+        "budget": budget_tokens,
+        "candidates": len(candidates),
+        "blocks": len(blocks),
+        "dropped": dropped,
+    }
@@ -0,0 +1,324 @@
+"""
+Web ingestion: a bounded-concurrency crawler that saves pages as documents.
+
+Pages are fetched over one pooled keep-alive session, converted from HTML to
+text while the response streams in (no DOM is built and nothing is
+truncated), and written as .txt files into the docs folder, where the
+incremental ingest pipeline picks them up like any other document. ETag and
+Last-Modified validators are kept per URL, so a re-crawl sends conditional
+GETs and unchanged pages cost a 304 instead of a download and re-embed.
+
+Usage:
+    python -m ingest docs/ --url https://example.com --depth 1 --max-pages 50
+"""
+import codecs
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urldefrag, urljoin, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from loader import clean_text
+from tracing import span
+
+CRAWL_CONCURRENCY = int(os.getenv("RAGVISOR_CRAWL_CONCURRENCY", "8"))
+CRAWL_TIMEOUT_S = float(os.getenv("RAGVISOR_CRAWL_TIMEOUT_S", "10"))
+CRAWL_MAX_PAGES = int(os.getenv("RAGVISOR_CRAWL_MAX_PAGES", "50"))
+# Larger responses are rejected rather than truncated.
+MAX_PAGE_BYTES = int(os.getenv("RAGVISOR_CRAWL_MAX_PAGE_BYTES", str(20 * 1024 * 1024)))
+USER_AGENT = "RAGvisor/1.0 (+https://github.com/TheharshVardhan01/RAGvisor)"
+STATE_FILENAME = ".crawl_state.json"
+READ_CHUNK_BYTES = 64 * 1024
+MAX_REDIRECTS = 5
+
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+SKIP_TAGS = {"script", "style", "title", "nav", "footer", "header", "form", "noscript", "template", "svg", "iframe"}
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "h1", "h2", "h3",
+    "h4", "h5", "h6", "hr", "li", "main", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class _TextExtractor(HTMLParser):
+    """Incremental HTML-to-text converter that also collects outgoing links."""
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.parts = []
+        self.links = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "base":
+            href = dict(attrs).get("href")
+            if href:
+                self.base_url = urljoin(self.base_url, href)
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(urljoin(self.base_url, href))
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+    def text(self):
+        return clean_text(re.sub(r"[^\S\n]+", " ", "".join(self.parts)))
+
+
+def _new_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def normalize_url(url):
+    """Drop the #fragment so in-page anchors aren't crawled as separate pages."""
+    return urldefrag(url)[0]
+
+
+def page_filename(url):
+    """Stable, filesystem-safe document name for a URL, so re-crawls overwrite the same file."""
+    parts = urlsplit(url)
+    slug = re.sub(r"[^\w\-]", "_", f"{parts.netloc}{parts.path}").strip("_")[:80]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+    return f"web_{slug}_{digest}.txt"
+
+
+def _charset(content_type):
+    match = re.search(r"charset=([\w\-]+)", content_type, re.I)
+    if match:
+        try:
+            return codecs.lookup(match.group(1)).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+class Crawler:
+    """
+    Breadth-first crawler writing each page's text to out_dir.
+
+    Up to concurrency pages are in flight at once. Links are followed to
+    max_depth (0 fetches only the start URLs), only on the start URLs' hosts
+    and their subdomains unless allowed_domains is given, and at most
+    max_pages pages are visited per crawl. Validators, content hashes and
+    outgoing links are kept in out_dir/.crawl_state.json, so unchanged pages
+    are neither rewritten nor re-embedded but their links are still followed.
+    """
+
+    def __init__(self, out_dir, max_depth=0, max_pages=CRAWL_MAX_PAGES, allowed_domains=None,
+                 concurrency=CRAWL_CONCURRENCY, timeout=CRAWL_TIMEOUT_S, session=None):
+        self.out_dir = Path(out_dir)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.allowed_domains = [d.lower() for d in allowed_domains] if allowed_domains else None
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.session = session or _new_session(self.concurrency)
+        self.state_path = self.out_dir / STATE_FILENAME
+        self._lock = threading.Lock()
+        try:
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+
+    def _save_state(self):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with self._lock:
+            data = json.dumps(self.state)
+        tmp_path.write_text(data, encoding="utf-8")
+        os.replace(tmp_path, self.state_path)
+
+    def _allowed(self, url, domains):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            return False
+        host = (parts.hostname or "").lower()
+        return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+    def _get(self, url, headers, domains):
+        """
+        GET url, following redirects by hand so every hop is checked against
+        the allowed domains (requests would follow them to any host).
+        Returns:
+            The final, still-open streamed response.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True, allow_redirects=False)
+            if not response.is_redirect:
+                return response
+            response.close()
+            url = urljoin(url, response.headers["Location"])
+            if not self._allowed(url, domains):
+                raise ValueError(f"redirect to {url} leaves the allowed domains")
+        raise ValueError(f"more than {MAX_REDIRECTS} redirects")
+
+    def fetch(self, url, domains=None):
+        """
+        Fetch one page (conditionally, if it was seen before) and save its text.
+        Redirects are only followed within domains (by default the allowed
+        domains, or else the URL's own host).
+        Returns:
+            Dict with url, status ("fetched", "unchanged" or "failed"), path,
+            bytes, links, http_status and fetch_s.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            previous = self.state.get(url, {})
+        result = {"url": url, "status": "failed", "path": None, "bytes": 0, "links": [], "http_status": None}
+        headers = {}
+        # Only revalidate when the saved file still exists, otherwise it must be rebuilt.
+        if previous.get("file") and (self.out_dir / previous["file"]).exists():
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        domains = domains or self.allowed_domains or [(urlsplit(url).hostname or "").lower()]
+        try:
+            with self._get(url, headers, domains) as response:
+                result["http_status"] = response.status_code
+                if response.status_code == 304:
+                    result.update(status="unchanged", path=str(self.out_dir / previous["file"]),
+                                  links=previous.get("links", []))
+                    return result
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "text/html").lower()
+                is_html = content_type.startswith(HTML_TYPES)
+                if not is_html and not content_type.startswith("text/plain"):
+                    raise ValueError(f"unsupported content type {content_type.split(';')[0]}")
+
+                # Decode and parse chunk by chunk as the body arrives.
+                decoder = codecs.getincrementaldecoder(_charset(content_type))(errors="replace")
+                extractor = _TextExtractor(response.url) if is_html else None
+                plain = []
+                size = 0
+                for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > MAX_PAGE_BYTES:
+                        raise ValueError(f"page larger than {MAX_PAGE_BYTES} bytes")
+                    decoded = decoder.decode(chunk)
+                    if extractor:
+                        extractor.feed(decoded)
+                    else:
+                        plain.append(decoded)
+                tail = decoder.decode(b"", final=True)
+                if extractor:
+                    extractor.feed(tail)
+                    extractor.close()
+                    text, links = extractor.text(), extractor.links
+                else:
+                    text, links = clean_text("".join(plain) + tail), []
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            result.update(bytes=size, links=links)
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            filename = previous.get("file") or page_filename(url)
+            path = self.out_dir / filename
+            if digest == previous.get("sha256") and path.exists():
+                result["status"] = "unchanged"
+            elif text:
+                self.out_dir.mkdir(parents=True, exist_ok=True)
+                path.write_text(text, encoding="utf-8")
+                result["status"] = "fetched"
+            else:
+                raise ValueError("no text content")
+            result["path"] = str(path)
+            with self._lock:
+                self.state[url] = {
+                    "file": filename,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "sha256": digest,
+                    "links": links,
+                }
+        except Exception as e:
+            result["error"] = str(e)
+            print(f"[ERROR] Web fetch failed: {url} — {e}")
+        finally:
+            result["fetch_s"] = round(time.perf_counter() - start, 4)
+        return result
+
+    def crawl(self, start_urls, progress_callback=None):
+        """
+        Crawl from start_urls.
+        Args:
+            start_urls: URL or list of URLs.
+            progress_callback: Optional callable(done, page_result) called as
+                each page finishes.
+        Returns:
+            Summary dict with pages_fetched, pages_unchanged, pages_failed,
+            bytes, wall_s, files (every page file from this crawl) and pages
+            (per-page results without their link lists).
+        """
+        if isinstance(start_urls, str):
+            start_urls = [start_urls]
+        start_urls = [normalize_url(url.strip()) for url in start_urls]
+        domains = self.allowed_domains or sorted({(urlsplit(url).hostname or "").lower() for url in start_urls})
+        wall_start = time.perf_counter()
+        summary = {"pages_fetched": 0, "pages_unchanged": 0, "pages_failed": 0, "bytes": 0, "files": [], "pages": []}
+
+        seen = set()
+        frontier = deque()
+        for url in start_urls:
+            if url not in seen and self._allowed(url, domains):
+                seen.add(url)
+                frontier.append((url, 0))
+
+        with span("crawl", start_urls=len(start_urls)) as attrs:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="crawl") as pool:
+                in_flight = {}
+                submitted = 0
+                while in_flight or (frontier and submitted < self.max_pages):
+                    while frontier and len(in_flight) < self.concurrency and submitted < self.max_pages:
+                        url, depth = frontier.popleft()
+                        in_flight[pool.submit(self.fetch, url, domains)] = depth
+                        submitted += 1
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        depth = in_flight.pop(future)
+                        result = future.result()
+                        summary[f"pages_{result['status']}"] += 1
+                        summary["bytes"] += result["bytes"]
+                        if result["path"]:
+                            summary["files"].append(result["path"])
+                        if depth < self.max_depth:
+                            for link in result["links"]:
+                                link = normalize_url(link)
+                                if link not in seen and self._allowed(link, domains):
+                                    seen.add(link)
+                                    frontier.append((link, depth + 1))
+                        page = {key: value for key, value in result.items() if key != "links"}
+                        page["depth"] = depth
+                        summary["pages"].append(page)
+                        if progress_callback:
+                            progress_callback(len(summary["pages"]), page)
+            self._save_state()
+            summary["wall_s"] = round(time.perf_counter() - wall_start, 3)
+            attrs.update(pages=len(summary["pages"]), fetched=summary["pages_fetched"], bytes=summary["bytes"])
+        return summary
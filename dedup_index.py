@@ -0,0 +1,349 @@
+import os
+import pickle
+import threading
+import zlib
+from pathlib import Path
+import numpy as np
+from lexical_index import tokenize
+from manifest import text_sha256
+from vectorstore import matches_where, where_sources
+
+DEDUP_ENABLED = os.getenv("RAGVISOR_DEDUP", "1").lower() in ("1", "true", "yes")
+# Estimated Jaccard similarity of word 3-shingles above which a chunk counts as a copy.
+DEDUP_THRESHOLD = float(os.getenv("RAGVISOR_DEDUP_THRESHOLD", "0.9"))
+INDEX_FILENAME = "dedup_{name}.idx"
+PERMUTATIONS = 128
+BANDS = 16  # 16 bands of 8 rows: pairs at Jaccard 0.9 collide in some band with p > 0.999
+SHINGLE_WORDS = 3
+# Chunks with fewer shingles than this only match exact copies.
+MIN_SHINGLES = 8
+
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32, so a * x + b fits in uint64
+_rng = np.random.default_rng(20240611)
+_HASH_A = _rng.integers(1, int(_PRIME), PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, int(_PRIME), PERMUTATIONS, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 1 << 63, PERMUTATIONS // BANDS, dtype=np.uint64) | np.uint64(1)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_MISSING = object()
+
+
+def minhash(text):
+    """
+    MinHash signature of a text's word 3-shingles.
+    Returns:
+        uint32 array of PERMUTATIONS values, or None if the text has fewer
+        than MIN_SHINGLES shingles.
+    """
+    tokens = np.array([zlib.crc32(token.encode("utf-8")) for token in tokenize(text)], dtype=np.uint64)
+    if len(tokens) < SHINGLE_WORDS + MIN_SHINGLES - 1:
+        return None
+    # Combine consecutive token hashes (uint64 arithmetic wraps) and fold into 32 bits.
+    shingles = tokens[:-2] * np.uint64(0x9E3779B1) + tokens[1:-1] * np.uint64(0x85EBCA77) + tokens[2:]
+    shingles = np.unique(shingles & np.uint64(0xFFFFFFFF))
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashed = (_HASH_A[:, None] * shingles[None, :] + _HASH_B[:, None]) % _PRIME
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def _band_keys(signature):
+    rows = signature.astype(np.uint64).reshape(BANDS, -1)
+    return (rows * _BAND_MIX).sum(axis=1).tolist()
+
+
+class DedupIndex:
+    """
+    Near-duplicate detector for the chunks of one collection (MinHash + LSH).
+
+    Only representatives are embedded and stored in Chroma. A new chunk that
+    is an exact copy of one, or whose estimated Jaccard similarity with one
+    reaches threshold, is recorded as its duplicate instead, with its text and
+    metadata, so retrieval can list every source of a passage and a duplicate
+    can take over when its representative is deleted or changes.
+    """
+
+    def __init__(self, path, threshold=DEDUP_THRESHOLD):
+        self.path = Path(path)
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._mtime_ns = None
+        self._undo = None
+        self._clear()
+        if self.path.exists():
+            self._load()
+
+    def _clear(self):
+        # A reload replaces every mapping; an open transaction can no longer be undone.
+        self._undo = None
+        self.hashes = {}      # representative chunk_id -> content hash
+        self.exact = {}       # content hash -> representative chunk_id
+        self.signatures = {}  # representative chunk_id -> MinHash signature
+        self.buckets = [{} for _ in range(BANDS)]  # band key -> {representative chunk_id}
+        self.duplicates = {}  # duplicate chunk_id -> (representative chunk_id, text, metadata)
+        self.members = {}     # representative chunk_id -> {duplicate chunk_id}
+        self.by_source = {}   # source -> {duplicate chunk_id}
+
+    # ---- persistence ----
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        self._clear()
+        for chunk_id, content_hash in state["hashes"].items():
+            signature = state["signatures"].get(chunk_id)
+            self._add_representative(
+                chunk_id, content_hash, None if signature is None else np.frombuffer(signature, dtype=np.uint32)
+            )
+        for chunk_id, (representative, text, metadata) in state["duplicates"].items():
+            self._link(chunk_id, representative, text, metadata)
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def reload_if_changed(self):
+        """Pick up an index saved by another process (e.g. the ingest CLI)."""
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime_ns != self._mtime_ns:
+                self._load()
+
+    def save(self):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "hashes": self.hashes,
+                        "signatures": {chunk_id: sig.tobytes() for chunk_id, sig in self.signatures.items()},
+                        "duplicates": self.duplicates,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self.path)
+            self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    # ---- transactions ----
+
+    def begin(self):
+        """Start recording changes, so rollback() can undo everything up to commit()."""
+        with self._lock:
+            self._undo = {}
+
+    def commit(self):
+        with self._lock:
+            self._undo = None
+
+    def rollback(self):
+        """Undo every change since begin(), e.g. when the chunks they describe were never stored."""
+        with self._lock:
+            for mapping, key, value in (self._undo or {}).values():
+                if value is _MISSING:
+                    mapping.pop(key, None)
+                else:
+                    mapping[key] = value
+            self._undo = None
+
+    def _touch(self, mapping, key):
+        """Remember mapping[key] as it was before its first change in the open transaction."""
+        if self._undo is not None and (id(mapping), key) not in self._undo:
+            value = mapping.get(key, _MISSING)
+            self._undo[(id(mapping), key)] = (mapping, key, set(value) if isinstance(value, set) else value)
+
+    # ---- updates ----
+
+    def _add_representative(self, chunk_id, content_hash, signature):
+        self._touch(self.hashes, chunk_id)
+        self._touch(self.exact, content_hash)
+        self.hashes[chunk_id] = content_hash
+        self.exact[content_hash] = chunk_id
+        if signature is not None:
+            self._touch(self.signatures, chunk_id)
+            self.signatures[chunk_id] = signature
+            for bucket, key in zip(self.buckets, _band_keys(signature)):
+                self._touch(bucket, key)
+                bucket.setdefault(key, set()).add(chunk_id)
+
+    def _link(self, chunk_id, representative, text, metadata):
+        source = metadata.get("source", "")
+        self._touch(self.duplicates, chunk_id)
+        self._touch(self.members, representative)
+        self._touch(self.by_source, source)
+        self.duplicates[chunk_id] = (representative, text, metadata)
+        self.members.setdefault(representative, set()).add(chunk_id)
+        self.by_source.setdefault(source, set()).add(chunk_id)
+
+    def _unlink(self, chunk_id):
+        """Forget a duplicate; returns its (representative, text, metadata)."""
+        self._touch(self.duplicates, chunk_id)
+        link = self.duplicates.pop(chunk_id)
+        source = link[2].get("source", "")
+        self._touch(self.by_source, source)
+        self.by_source[source].discard(chunk_id)
+        if not self.by_source[source]:
+            del self.by_source[source]
+        return link
+
+    def _detach(self, chunk_id):
+        """Drop a chunk; returns the (chunk_id, text, metadata) duplicates left without a representative."""
+        if chunk_id in self.duplicates:
+            representative = self._unlink(chunk_id)[0]
+            self._touch(self.members, representative)
+            members = self.members[representative]
+            members.discard(chunk_id)
+            if not members:
+                del self.members[representative]
+            return []
+        if chunk_id not in self.hashes:
+            return []
+        self._touch(self.hashes, chunk_id)
+        content_hash = self.hashes.pop(chunk_id)
+        if self.exact.get(content_hash) == chunk_id:
+            self._touch(self.exact, content_hash)
+            del self.exact[content_hash]
+        self._touch(self.signatures, chunk_id)
+        signature = self.signatures.pop(chunk_id, None)
+        if signature is not None:
+            for bucket, key in zip(self.buckets, _band_keys(signature)):
+                self._touch(bucket, key)
+                ids = bucket[key]
+                ids.discard(chunk_id)
+                if not ids:
+                    del bucket[key]
+        self._touch(self.members, chunk_id)
+        return [(dup, *self._unlink(dup)[1:]) for dup in sorted(self.members.pop(chunk_id, ()))]
+
+    def _match(self, content_hash, signature, exclude):
+        match = self.exact.get(content_hash)
+        if match is not None and match not in exclude:
+            return match
+        if signature is None:
+            return None
+        candidates = set()
+        for bucket, key in zip(self.buckets, _band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in candidates - exclude:
+            similarity = np.count_nonzero(self.signatures[candidate] == signature) / PERMUTATIONS
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def _place(self, items, exclude):
+        representatives = []
+        for chunk_id, text, metadata in items:
+            content_hash = metadata.get("content_hash") or text_sha256(text)
+            signature = minhash(text)
+            match = self._match(content_hash, signature, exclude)
+            if match is None:
+                self._add_representative(chunk_id, content_hash, signature)
+                representatives.append((chunk_id, text, metadata))
+            else:
+                self._link(chunk_id, match, text, metadata)
+        return representatives
+
+    def add(self, items, exclude=()):
+        """
+        Register new or changed chunks, linking near-duplicates to an existing
+        representative (or to an earlier item of the same call).
+        Args:
+            items: (chunk_id, text, metadata) tuples about to be embedded.
+            exclude: Chunk IDs that are about to be deleted and must not
+                become anyone's representative.
+        Returns:
+            The items (plus any duplicates orphaned by a changed
+            representative) that must be embedded and stored.
+        """
+        with self._lock:
+            items = list(items)
+            exclude = set(exclude)
+            orphans = []
+            for chunk_id, _, _ in items:
+                orphans.extend(self._detach(chunk_id))
+            ids = {chunk_id for chunk_id, _, _ in items}
+            return self._place(items + [item for item in orphans if item[0] not in ids], exclude)
+
+    def remove(self, chunk_ids):
+        """
+        Forget deleted chunks.
+        Returns:
+            (chunk_id, text, metadata) duplicates promoted to representatives
+            because theirs was deleted; they must be embedded and stored.
+        """
+        with self._lock:
+            orphans = []
+            for chunk_id in chunk_ids:
+                orphans.extend(self._detach(chunk_id))
+            removed = set(chunk_ids)
+            return self._place([item for item in orphans if item[0] not in removed], removed)
+
+    def rebuild_from_collection(self, collection, batch_size=1000):
+        """Register every chunk already stored in a Chroma collection as a representative."""
+        with self._lock:
+            self._clear()
+            offset = 0
+            while True:
+                batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                    content_hash = (metadata or {}).get("content_hash") or text_sha256(text)
+                    self._add_representative(chunk_id, content_hash, minhash(text))
+                offset += len(batch["ids"])
+
+    # ---- lookups ----
+
+    def duplicate_sources(self, chunk_id):
+        """Sources of the chunks linked to a representative as its duplicates."""
+        with self._lock:
+            return sorted({self.duplicates[dup][2].get("source", "") for dup in self.members.get(chunk_id, ())} - {""})
+
+    def representatives_matching(self, where):
+        """
+        Representatives of the duplicates whose own metadata matches a Chroma
+        where clause: a filtered search must include them, since the
+        duplicates themselves are not stored in Chroma.
+        """
+        with self._lock:
+            sources = where_sources(where)
+            if sources is None:
+                candidates = self.duplicates
+            else:
+                candidates = [dup for source in sources for dup in self.by_source.get(source, ())]
+            return {
+                self.duplicates[dup][0] for dup in candidates if matches_where(self.duplicates[dup][2], where)
+            }
+
+    def stats(self):
+        return {"representatives": len(self.hashes), "duplicates": len(self.duplicates)}
+
+
+def get_dedup_index(persist_dir, collection_name, collection=None):
+    """
+    Return the process-wide DedupIndex for a collection, or None when
+    deduplication is off (RAGVISOR_DEDUP=0).
+
+    If no index file exists yet but the collection already holds chunks, they
+    are registered as representatives once.
+    """
+    if not DEDUP_ENABLED:
+        return None
+    path = Path(persist_dir).resolve() / INDEX_FILENAME.format(name=collection_name)
+    key = str(path)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = DedupIndex(path)
+                if not path.exists() and collection is not None and collection.count():
+                    index.rebuild_from_collection(collection)
+                    index.save()
+                _indexes[key] = index
+    else:
+        index.reload_if_changed()
+    return index
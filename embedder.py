@@ -1,46 +1,168 @@
-from sentence_transformers import SentenceTransformer
-from chromadb import PersistentClient
-import uuid
+from embedding_cache import DEFAULT_CACHE_DIR, EmbeddingCache, text_hash
+import numpy as np
+import threading
+import time
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class EmbeddingService:
+    """
+    Process-wide wrapper around a single SentenceTransformer model.
+
+    Loaded once per (model name, device) and shared by every Streamlit
+    session and the ingestion code. Use get_embedding_service() instead of
+    constructing this directly. When cache_dir is set, texts that were
+    encoded before are served from an EmbeddingCache instead of the model.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, device=None, cache_dir=DEFAULT_CACHE_DIR):
+        # torch and sentence-transformers take seconds to import; only pay for
+        # them once a model is actually needed (see warmup.py).
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+        start = time.perf_counter()
+        self.model = SentenceTransformer(model_name, device=self.device)
+        self.load_time = time.perf_counter() - start
+        self.memory_bytes = sum(
+            t.numel() * t.element_size()
+            for t in list(self.model.parameters()) + list(self.model.buffers())
+        )
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.cache = EmbeddingCache(cache_dir, model_name, self.dimension) if cache_dir else None
+
+    def _encode(self, texts, batch_size, show_progress_bar):
+        texts = list(texts)
+        if self.cache is None or not texts:
+            return self.model.encode(
+                texts, batch_size=batch_size, show_progress_bar=show_progress_bar, convert_to_numpy=True
+            )
+
+        hashes = [text_hash(text) for text in texts]
+        found, missing = self.cache.get_many(hashes)
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, vector in found.items():
+            embeddings[i] = vector
+        if missing:
+            encoded = self.model.encode(
+                [texts[i] for i in missing],
+                batch_size=batch_size,
+                show_progress_bar=show_progress_bar,
+                convert_to_numpy=True,
+            )
+            embeddings[missing] = encoded
+            self.cache.put_many([hashes[i] for i in missing], encoded)
+        return embeddings
+
+    def encode_documents(self, texts, batch_size=32, show_progress_bar=False):
+        """
+        Encode a batch of document chunks.
+        Args:
+            texts: List of chunk strings.
+            batch_size: Encoder batch size.
+            show_progress_bar: Forwarded to SentenceTransformer.encode.
+        Returns:
+            numpy.ndarray of shape (len(texts), dimension).
+        """
+        return self._encode(texts, batch_size, show_progress_bar)
+
+    def encode_queries(self, queries, batch_size=32):
+        """
+        Encode one or more user queries.
+        Args:
+            queries: A query string or a list of query strings.
+            batch_size: Encoder batch size.
+        Returns:
+            numpy.ndarray of shape (n_queries, dimension).
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        return self._encode(queries, batch_size, False)
+
+    def stats(self):
+        stats = {
+            "model_name": self.model_name,
+            "device": self.device,
+            "dimension": self.dimension,
+            "load_time_s": round(self.load_time, 3),
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 1),
+        }
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
+
+
+def get_embedding_service(model_name=DEFAULT_MODEL_NAME, device=None):
+    """
+    Return the shared EmbeddingService for model_name, loading it on first use.
+    """
+    key = (model_name, device)
+    service = _services.get(key)
+    if service is None:
+        with _services_lock:
+            service = _services.get(key)
+            if service is None:
+                service = EmbeddingService(model_name, device=device)
+                _services[key] = service
+    return service
+
+
+def service_stats():
+    """Load time and memory footprint of every embedding model loaded so far."""
+    return [service.stats() for service in list(_services.values())]
+
+
 
 def embed_and_store(chunks, persist_dir, collection_name=None, overwrite=False):
     """
-    Embed text chunks and store them in ChromaDB.
-    
+    Legacy helper: embed (text, metadata) chunks and store them in a collection.
+
+    Kept as a thin wrapper over the ingest pipeline's store step. It does not
+    update the ingest manifest or dedup index, so prefer ingest.ingest_paths.
     Args:
-        chunks: List of (text, metadata) tuples.
+        chunks: List of (text, metadata) tuples; metadata must hold chunk_id.
         persist_dir: Path to save ChromaDB DB.
-        collection_name: Optional. Defaults to 'rag_pdf_<uuid>'.
+        collection_name: Target collection (shard). Defaults to the one the app queries.
         overwrite: If True, clears collection before inserting.
-    
     Returns:
         collection_name used
     """
-    if not collection_name:
-        collection_name = f"rag_pdf_{str(uuid.uuid4())[:8]}"
-
-    try:
-        # Initialize model & Chroma client
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-        client = PersistentClient(path=persist_dir)
-        collection = client.get_or_create_collection(name=collection_name)
-
-        if overwrite:
-            collection.delete(where={})  # Clear old entries
-
-        texts = [chunk[0] for chunk in chunks]
-        metadatas = [chunk[1] for chunk in chunks]
-        ids = [meta["chunk_id"] for meta in metadatas]
-
-        embeddings = model.encode(texts, show_progress_bar=True).tolist()
-
-        collection.upsert(
-            documents=texts,
-            embeddings=embeddings,
-            metadatas=metadatas,
-            ids=ids,
-        )
+    # ingest imports this module, so its helpers are imported on use.
+    from collections import defaultdict
+    from ingest import _store_chunks
+    from lexical_index import get_lexical_index
+    from manifest import text_sha256
+    from vector_index import get_vector_index
+    from vectorstore import DEFAULT_COLLECTION_NAME, bump_collection_version, get_collection
 
-        return collection_name
+    collection_name = collection_name or DEFAULT_COLLECTION_NAME
+    collection = get_collection(persist_dir, collection_name)
+    lexical = get_lexical_index(persist_dir, collection_name, collection)
+    vectors = get_vector_index(persist_dir, collection_name, collection)
+    if overwrite:
+        existing = collection.get(include=[])["ids"]
+        if existing:
+            collection.delete(ids=existing)
+        lexical.remove(list(lexical.doc_numbers))
+        if vectors is not None:
+            vectors.remove(list(vectors.rows))
 
-    except Exception as e:
-        raise RuntimeError(f"[EMBED FAIL] {e}")
+    ingested_at = int(time.time())
+    items = [
+        (metadata["chunk_id"], text, dict({"ingested_at": ingested_at, "content_hash": text_sha256(text)}, **metadata))
+        for text, metadata in chunks
+    ]
+    if items:
+        _store_chunks(items, collection, lexical, vectors, defaultdict(float))
+    lexical.save()
+    if vectors is not None:
+        vectors.save()
+    bump_collection_version(persist_dir, collection_name)
+    return collection_name
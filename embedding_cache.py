@@ -0,0 +1,156 @@
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process locking only
+    fcntl = None
+
+# Kept next to the Chroma data rather than in the working directory.
+DEFAULT_CACHE_DIR = os.getenv(
+    "RAGVISOR_EMBED_CACHE_DIR",
+    os.path.join(os.getenv("RAGVISOR_PERSIST_DIR", "chroma_db"), "embedding_cache"),
+)
+
+_KEY_BYTES = 65  # 64 hex chars + newline
+_INITIAL_ROWS = 1024
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk cache from (model name, text hash) to a float32 embedding.
+
+    Each model gets two files in cache_dir:
+        <model>.f32   raw float32 rows, opened with numpy.memmap
+        <model>.keys  one fixed-width text hash per line, line N == row N
+
+    Lookups index straight into the memory-mapped array, so nothing is
+    deserialized and the OS page cache is shared between processes. Writers
+    take an exclusive flock on the key file and append vectors before keys,
+    so a crash can only leave unused rows behind.
+    """
+
+    def __init__(self, cache_dir, model_name, dimension):
+        self.dimension = dimension
+        safe_name = re.sub(r"[^\w\-.]", "_", model_name)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_dir / f"{safe_name}.f32"
+        self.keys_path = self.cache_dir / f"{safe_name}.keys"
+        self.keys_path.touch(exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() == 0:
+                f.truncate(_INITIAL_ROWS * dimension * 4)
+
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._keys_offset = 0
+        self._vectors = None
+        self._capacity = 0
+        self.hits = 0
+        self.misses = 0
+
+        with self._lock:
+            self._refresh()
+
+    # ---- internal helpers (call with self._lock held) ----
+
+    def _open_vectors(self):
+        size = os.path.getsize(self.vectors_path)
+        self._capacity = size // (self.dimension * 4)
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dimension)
+        )
+
+    def _refresh(self):
+        """Pick up keys appended by other processes since the last read."""
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+        usable = len(data) - len(data) % _KEY_BYTES
+        row = self._keys_offset // _KEY_BYTES
+        for start in range(0, usable, _KEY_BYTES):
+            self._rows[data[start:start + 64].decode("ascii")] = row
+            row += 1
+        self._keys_offset += usable
+        if self._vectors is None or row > self._capacity:
+            self._open_vectors()
+
+    def _ensure_capacity(self, rows):
+        if rows <= self._capacity:
+            return
+        self._open_vectors()  # another process may already have grown the file
+        if rows <= self._capacity:
+            return
+        new_capacity = max(rows, self._capacity * 2)
+        self._vectors.flush()
+        self._vectors = None
+        os.truncate(self.vectors_path, new_capacity * self.dimension * 4)
+        self._open_vectors()
+
+    # ---- public API ----
+
+    def get_many(self, hashes):
+        """
+        Look up cached vectors.
+        Returns:
+            (found, missing) where found maps index -> vector for hits and
+            missing lists the indexes of hashes that are not cached.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            if any(h not in self._rows for h in hashes):
+                self._refresh()
+            for i, h in enumerate(hashes):
+                row = self._rows.get(h)
+                if row is None:
+                    missing.append(i)
+                else:
+                    found[i] = np.array(self._vectors[row])
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, hashes, vectors):
+        """Append vectors for hashes that are not cached yet."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, open(self.keys_path, "ab") as keys_file:
+            if fcntl:
+                fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                new = {}
+                for h, vector in zip(hashes, vectors):
+                    if h not in self._rows and h not in new:
+                        new[h] = vector
+                if not new:
+                    return
+                first_row = self._keys_offset // _KEY_BYTES
+                self._ensure_capacity(first_row + len(new))
+                self._vectors[first_row:first_row + len(new)] = np.stack(list(new.values()))
+                self._vectors.flush()
+                keys_file.write("".join(f"{h}\n" for h in new).encode("ascii"))
+                keys_file.flush()
+                for offset, h in enumerate(new):
+                    self._rows[h] = first_row + offset
+                self._keys_offset += len(new) * _KEY_BYTES
+            finally:
+                if fcntl:
+                    fcntl.flock(keys_file, fcntl.LOCK_UN)
+
+    def stats(self):
+        return {
+            "entries": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_saved": self.hits * self.dimension * 4,
+        }
@@ -0,0 +1,275 @@
+"""
+Persistent store for generated images.
+
+Image bytes are written once under their SHA-256 (blobs/ab/abcd....png) with
+a small JPEG thumbnail next to them, and a SQLite table maps the hash of each
+prompt to its image, so generating the same prompt again is served from disk
+instead of another DeepAI round trip. Sessions keep only image IDs; bytes are
+read on demand through an LRU cache with a byte cap shared by every session.
+The store keeps at most RAGVISOR_IMAGE_STORE_MAX images, dropping the least
+recently used.
+
+Usage:
+    store = get_image_store()
+    image, cached = store.get_or_create(prompt, generate)  # generate(prompt) -> bytes
+    store.thumbnail(image["id"])
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+
+DEFAULT_IMAGE_DIR = os.getenv("RAGVISOR_IMAGE_DIR", "image_store")
+IMAGE_CACHE_BYTES = int(os.getenv("RAGVISOR_IMAGE_CACHE_MB", "64")) * 1024 * 1024
+MAX_IMAGES = int(os.getenv("RAGVISOR_IMAGE_STORE_MAX", "500"))
+THUMBNAIL_SIZE = (384, 384)
+INDEX_FILENAME = "images.sqlite3"
+_COLUMNS = "id, prompt, content_hash, format, width, height, bytes, created_at"
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def prompt_hash(prompt):
+    """ID of a prompt: the hash of its text with whitespace runs collapsed."""
+    return hashlib.sha256(" ".join(prompt.split()).encode("utf-8")).hexdigest()
+
+
+class LRUBytesCache:
+    """Thread-safe LRU of byte strings, evicting least recently used entries above max_bytes."""
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = data
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def discard(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self.bytes -= len(data)
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
+
+
+class ImageStore:
+    """
+    Content-addressed on-disk image store indexed by prompt hash.
+
+    Use get_image_store() instead of constructing this directly.
+    """
+
+    def __init__(self, root, max_images=MAX_IMAGES, cache_bytes=IMAGE_CACHE_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_images = max_images
+        self.cache = LRUBytesCache(cache_bytes)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._conn = sqlite3.connect(self.root / INDEX_FILENAME, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+                id TEXT PRIMARY KEY,
+                prompt TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                format TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS images_content ON images (content_hash)")
+        self._conn.commit()
+
+    # ---- paths ----
+
+    def _blob_path(self, content_hash, fmt):
+        return self.root / "blobs" / content_hash[:2] / f"{content_hash}.{fmt}"
+
+    def _thumb_path(self, content_hash):
+        return self.root / "thumbs" / content_hash[:2] / f"{content_hash}.jpg"
+
+    @staticmethod
+    def _write_atomic(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    # ---- index ----
+
+    @staticmethod
+    def _to_image(row):
+        return dict(zip(_COLUMNS.split(", "), row)) if row else None
+
+    def get(self, image_id):
+        """Image record (id, prompt, content_hash, format, width, height, bytes, created_at), or None."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM images WHERE id = ?", (image_id,)).fetchone()
+        return self._to_image(row)
+
+    def find(self, prompt):
+        """The stored image for a prompt, or None; marks it as recently used."""
+        image = self.get(prompt_hash(prompt))
+        if image is not None:
+            with self._lock:
+                self._conn.execute("UPDATE images SET last_used_at = ? WHERE id = ?", (time.time(), image["id"]))
+                self._conn.commit()
+        return image
+
+    def put(self, prompt, data):
+        """
+        Store image bytes for a prompt, writing the blob and its thumbnail
+        only if these exact bytes are not stored yet.
+        Returns:
+            The image record.
+        """
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+            fmt = (image.format or "png").lower()
+            width, height = image.size
+            content_hash = hashlib.sha256(data).hexdigest()
+            blob_path = self._blob_path(content_hash, fmt)
+            if not blob_path.exists():
+                self._write_atomic(blob_path, data)
+            thumb_path = self._thumb_path(content_hash)
+            if not thumb_path.exists():
+                thumb = image.convert("RGB")
+                thumb.thumbnail(THUMBNAIL_SIZE)
+                buffer = BytesIO()
+                thumb.save(buffer, format="JPEG", quality=85)
+                self._write_atomic(thumb_path, buffer.getvalue())
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images (id, prompt, content_hash, format, width, height, bytes, created_at, "
+                "last_used_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (prompt_hash(prompt), prompt, content_hash, fmt, width, height, len(data), now, now),
+            )
+            self._conn.commit()
+            self._prune()
+        self.cache.put(("image", content_hash), data)
+        return self.get(prompt_hash(prompt))
+
+    def _prune(self):
+        """Drop the least recently used images beyond max_images (call with self._lock held)."""
+        rows = self._conn.execute(
+            "SELECT id, content_hash, format FROM images ORDER BY last_used_at DESC LIMIT -1 OFFSET ?",
+            (self.max_images,),
+        ).fetchall()
+        if not rows:
+            return
+        self._conn.executemany("DELETE FROM images WHERE id = ?", [(row[0],) for row in rows])
+        self._conn.commit()
+        for _, content_hash, fmt in rows:
+            # Several prompts can share one blob; keep it while any still refers to it.
+            if self._conn.execute("SELECT 1 FROM images WHERE content_hash = ? LIMIT 1", (content_hash,)).fetchone():
+                continue
+            for path in (self._blob_path(content_hash, fmt), self._thumb_path(content_hash)):
+                path.unlink(missing_ok=True)
+            self.cache.discard(("image", content_hash))
+            self.cache.discard(("thumb", content_hash))
+
+    def get_or_create(self, prompt, generate):
+        """
+        The stored image for prompt, or a new one from generate(prompt) ->
+        image bytes. Concurrent calls for the same prompt share one generate().
+        Returns:
+            (image record, cached) where cached is True if nothing was generated.
+        """
+        image = self.find(prompt)
+        if image is not None:
+            return image, True
+        key = prompt_hash(prompt)
+        with self._lock:
+            lock = self._inflight.setdefault(key, threading.Lock())
+        with lock:
+            image = self.find(prompt)
+            if image is not None:
+                return image, True
+            try:
+                return self.put(prompt, generate(prompt)), False
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    # ---- bytes ----
+
+    def _read(self, kind, image_id):
+        image = self.get(image_id)
+        if image is None:
+            return None
+        key = (kind, image["content_hash"])
+        data = self.cache.get(key)
+        if data is None:
+            path = (self._blob_path(image["content_hash"], image["format"]) if kind == "image"
+                    else self._thumb_path(image["content_hash"]))
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                return None
+            self.cache.put(key, data)
+        return data
+
+    def image_bytes(self, image_id):
+        """Full-size image bytes, or None if the image was pruned."""
+        return self._read("image", image_id)
+
+    def thumbnail(self, image_id):
+        """JPEG thumbnail bytes (at most THUMBNAIL_SIZE), or None if the image was pruned."""
+        return self._read("thumb", image_id)
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images").fetchone()
+        return {"images": count, "bytes": total, "max_images": self.max_images, "cache": self.cache.stats()}
+
+
+def get_image_store(root=DEFAULT_IMAGE_DIR):
+    """Return the process-wide ImageStore for a directory."""
+    key = str(Path(root).resolve())
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = ImageStore(key)
+                _stores[key] = store
+    return store
@@ -0,0 +1,482 @@
+"""
+Incremental ingestion of .pdf / .txt files into ChromaDB.
+
+Parsing, embedding and upserting run as a pipeline connected by bounded
+queues, so the parser pool, the encoder and Chroma all work at the same time
+and a slow stage applies backpressure to the ones before it.
+
+Usage:
+    python -m ingest docs/ [--persist-dir chroma_db] [--collection rag_pdf]
+    python -m ingest docs/ --url https://example.com [--depth 1] [--max-pages 50]
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from crawler import CRAWL_MAX_PAGES, Crawler
+from dedup_index import get_dedup_index
+from embedder import get_embedding_service
+from lexical_index import get_lexical_index
+from loader import parse_files_parallel
+from manifest import IngestManifest, make_chunk_id, text_sha256
+from tracing import record, span
+from vector_index import get_vector_index
+from vectorstore import DEFAULT_COLLECTION_NAME, bump_collection_version, get_collection, validate_collection_name
+
+SUPPORTED_SUFFIXES = (".pdf", ".txt")
+CONTENT_TYPES = {".pdf": "pdf", ".txt": "text"}
+
+_DONE = object()
+
+
+def _new_summary():
+    return {
+        "files_skipped": 0,
+        "files_ingested": 0,
+        "files_removed": 0,
+        "files_failed": 0,
+        "chunks_embedded": 0,
+        "chunks_linked": 0,
+        "chunks_unchanged": 0,
+        "chunks_deleted": 0,
+        "file_timings": [],
+        "stage_s": {"parse": 0.0, "embed": 0.0, "upsert": 0.0},
+        "wall_s": 0.0,
+    }
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once the pipeline is being torn down."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _file_metadata(file_path, file_hash, extra=None):
+    """
+    Metadata shared by every chunk of a file. Timestamps are integer epoch
+    seconds so they can be range-filtered ($gte / $lt) in Chroma.
+    """
+    metadata = {
+        "source": file_path.name,
+        "file_hash": file_hash,
+        "content_type": CONTENT_TYPES.get(file_path.suffix, "text"),
+        "ingested_at": int(time.time()),
+        "modified_at": int(file_path.stat().st_mtime),
+    }
+    metadata.update(extra or {})
+    return metadata
+
+
+def _diff_chunks(parsed, file_metadata, manifest):
+    """
+    Compare a parsed file with its manifest entry.
+    Returns:
+        (pending, new_chunks, stale_ids) where pending holds the
+        (chunk_id, text, metadata) items whose text changed.
+    """
+    source = Path(parsed["path"]).name
+    old_chunks = manifest.chunk_hashes(source)
+
+    new_chunks = {}
+    pending = []
+    for chunk, offset, page_number in parsed["chunks"]:
+        chunk_id = make_chunk_id(source, offset)
+        chunk_hash = text_sha256(chunk)
+        new_chunks[chunk_id] = chunk_hash
+        if old_chunks.get(chunk_id) != chunk_hash:
+            pending.append((chunk_id, chunk, dict(
+                file_metadata,
+                chunk_id=chunk_id,
+                content_hash=chunk_hash,
+                start_index=offset,
+                end_index=offset + len(chunk),
+                page=page_number,
+            )))
+
+    stale_ids = [chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks]
+    return pending, new_chunks, stale_ids
+
+
+def _store_chunks(items, collection, lexical, vectors, stage_s):
+    """Embed and store (chunk_id, text, metadata) items in the calling thread."""
+    start = time.perf_counter()
+    embeddings = get_embedding_service().encode_documents([item[1] for item in items])
+    stage_s["embed"] += time.perf_counter() - start
+    _upsert(items, embeddings, collection, lexical, vectors, stage_s)
+
+
+def _upsert(items, embeddings, collection, lexical, vectors, stage_s):
+    ids = [item[0] for item in items]
+    documents = [item[1] for item in items]
+    start = time.perf_counter()
+    # In a compact vector mode dense search never reads Chroma's copy.
+    stored = embeddings if vectors is None else vectors.chroma_embeddings(collection, embeddings)
+    collection.upsert(ids=ids, documents=documents, embeddings=stored, metadatas=[item[2] for item in items])
+    lexical.add(ids, documents)
+    if vectors is not None:
+        vectors.add(ids, embeddings)
+    stage_s["upsert"] += time.perf_counter() - start
+
+
+def _delete_chunks(stale_ids, collection, lexical, vectors, dedup, stage_s):
+    """
+    Delete chunks everywhere. Duplicates that pointed at a deleted
+    representative are promoted and stored in its place.
+    Returns:
+        Number of promoted duplicates.
+    """
+    collection.delete(ids=stale_ids)
+    lexical.remove(stale_ids)
+    if vectors is not None:
+        vectors.remove(stale_ids)
+    promoted = dedup.remove(stale_ids) if dedup is not None else []
+    if promoted:
+        _store_chunks(promoted, collection, lexical, vectors, stage_s)
+    return len(promoted)
+
+
+def _parse_stage(changed, max_workers, parsed_q, stop, stage_s, errors):
+    try:
+        for parsed in parse_files_parallel(changed, max_workers):
+            parsed["received_at"] = time.perf_counter()
+            stage_s["parse"] += parsed["parse_s"]
+            if not _put(parsed_q, parsed, stop):
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(parsed_q, _DONE, stop)
+
+
+def _embed_stage(changed, manifest, dedup, batch_size, parsed_q, upsert_q, stop, stage_s, errors):
+    """
+    Batch pending chunks across files and encode them. With a DedupIndex,
+    near-duplicates of stored chunks are linked to them instead of encoded.
+
+    A per-file marker is forwarded after the batch holding that file's last
+    chunk, so the upsert stage knows when a file is fully stored.
+    """
+    service = get_embedding_service()
+    buffer = []
+    waiting_markers = []
+    queued_total = 0
+    flushed_total = 0
+
+    def flush(limit):
+        nonlocal buffer, flushed_total
+        while buffer and len(buffer) >= limit:
+            batch, buffer = buffer[:batch_size], buffer[batch_size:]
+            start = time.perf_counter()
+            embeddings = service.encode_documents([item[1] for item in batch])
+            stage_s["embed"] += time.perf_counter() - start
+            if not _put(upsert_q, ("batch", batch, embeddings), stop):
+                return False
+            flushed_total += len(batch)
+        while waiting_markers and waiting_markers[0][0] <= flushed_total:
+            if not _put(upsert_q, waiting_markers.pop(0)[1], stop):
+                return False
+        return True
+
+    try:
+        while not stop.is_set():
+            try:
+                parsed = parsed_q.get(timeout=0.5)
+            except queue.Empty:
+                # Parsers are busy: encode what we have rather than sit idle.
+                if not flush(1):
+                    return
+                continue
+            if parsed is _DONE:
+                break
+            if "error" in parsed:
+                marker = ("error", parsed, None, None, None)
+            else:
+                file_metadata = changed[parsed["path"]]
+                file_hash = file_metadata["file_hash"]
+                pending, new_chunks, stale_ids = _diff_chunks(parsed, file_metadata, manifest)
+                unchanged = len(new_chunks) - len(pending)
+                linked = 0
+                if dedup is not None and pending:
+                    # This file's stale chunks are about to be deleted; don't link to them.
+                    stored = dedup.add(pending, exclude=stale_ids)
+                    kept = {item[0] for item in stored}
+                    linked = sum(1 for item in pending if item[0] not in kept)
+                    pending = stored
+                buffer.extend(pending)
+                queued_total += len(pending)
+                marker = ("file", parsed, file_hash, new_chunks, (len(pending), linked, unchanged, stale_ids))
+            waiting_markers.append((queued_total, marker))
+            if not flush(batch_size):
+                return
+        flush(1)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        _put(upsert_q, _DONE, stop)
+
+
+def ingest_paths(paths, persist_dir, collection_name=DEFAULT_COLLECTION_NAME,
+                 remove_missing=False, batch_size=100, max_workers=None, queue_size=8,
+                 progress_callback=None, source_metadata=None):
+    """
+    Incrementally embed files into a Chroma collection.
+
+    Files whose content hash matches the manifest are skipped. Changed files are
+    parsed across a process pool, encoded in batches and upserted, with the
+    three stages overlapped through bounded queues; only chunks whose text hash
+    changed are re-embedded, near-duplicates of stored chunks are only linked
+    to them (see dedup_index.py), and chunks that no longer exist are deleted.
+
+    Args:
+        paths: Iterable of .pdf / .txt file paths.
+        persist_dir: ChromaDB directory; the manifest is stored alongside it.
+        collection_name: Target collection.
+        remove_missing: If True, sources in the manifest that are not in paths
+            are treated as deleted and their chunks removed.
+        batch_size: Chunks per encode/upsert batch.
+        max_workers: Parser process pool size (see loader.parse_files_parallel).
+        queue_size: Capacity of each inter-stage queue.
+        progress_callback: Optional callable(done, total, file_stats) called from
+            the calling thread after each changed file is stored, with its
+            source, pages, chunks, parse_s and store_s.
+        source_metadata: Optional {file name: {key: value}} merged into the
+            metadata of that file's chunks (e.g. the URL of a crawled page).
+            Every chunk already carries source, page, content_type,
+            ingested_at, modified_at, file_hash and content_hash.
+    Returns:
+        Summary dict with file and chunk counts, per-file timings and busy
+        time per stage.
+    """
+    wall_start = time.perf_counter()
+    paths = [Path(p) for p in paths if Path(p).suffix in SUPPORTED_SUFFIXES]
+    manifest = IngestManifest(persist_dir, collection_name)
+    collection = get_collection(persist_dir, collection_name)
+    lexical = get_lexical_index(persist_dir, collection_name, collection)
+    vectors = get_vector_index(persist_dir, collection_name, collection)
+    dedup = get_dedup_index(persist_dir, collection_name, collection)
+    summary = _new_summary()
+
+    with span("ingest", paths=len(paths)) as attrs:
+        try:
+            if remove_missing:
+                present = {p.name for p in paths}
+                for source in manifest.sources():
+                    if source not in present:
+                        stale_ids = manifest.forget(source)
+                        if stale_ids:
+                            summary["chunks_embedded"] += _delete_chunks(
+                                stale_ids, collection, lexical, vectors, dedup, summary["stage_s"]
+                            )
+                        summary["files_removed"] += 1
+                        summary["chunks_deleted"] += len(stale_ids)
+
+            changed = {}
+            seen = set()
+            for file_path in paths:
+                if file_path.name in seen:
+                    # Chunk IDs and the manifest are keyed by file name within a collection.
+                    summary["files_failed"] += 1
+                    print(f"[ERROR] Ingest failed: {file_path} — another file named {file_path.name} is in this run")
+                    continue
+                seen.add(file_path.name)
+                try:
+                    file_hash, is_changed = manifest.check(file_path.name, file_path)
+                except OSError as e:
+                    summary["files_failed"] += 1
+                    print(f"[ERROR] Ingest failed: {file_path} — {e}")
+                    continue
+                if is_changed:
+                    changed[str(file_path)] = _file_metadata(
+                        file_path, file_hash, (source_metadata or {}).get(file_path.name)
+                    )
+                else:
+                    summary["files_skipped"] += 1
+
+            if changed:
+                _run_pipeline(changed, manifest, collection, lexical, vectors, dedup, summary, batch_size,
+                              max_workers, queue_size, progress_callback)
+        finally:
+            manifest.save()
+            if dedup is not None and (summary["chunks_embedded"] or summary["chunks_linked"] or summary["chunks_deleted"]):
+                dedup.save()
+            if summary["chunks_embedded"] or summary["chunks_deleted"]:
+                lexical.save()
+                if vectors is not None:
+                    vectors.save()
+                bump_collection_version(persist_dir, collection_name)
+            summary["wall_s"] = round(time.perf_counter() - wall_start, 3)
+            summary["stage_s"] = {stage: round(seconds, 3) for stage, seconds in summary["stage_s"].items()}
+            attrs.update(files=summary["files_ingested"], chunks=summary["chunks_embedded"], linked=summary["chunks_linked"])
+            for stage, seconds in summary["stage_s"].items():
+                # Stage busy time, summed over the worker threads.
+                record(f"ingest.{stage}", seconds)
+
+    return summary
+
+
+def _run_pipeline(changed, manifest, collection, lexical, vectors, dedup, summary, batch_size, max_workers,
+                  queue_size, progress_callback):
+    """Run parse -> embed stages in threads and the upsert stage in the calling thread."""
+    parsed_q = queue.Queue(maxsize=queue_size)
+    upsert_q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    stage_s = summary["stage_s"]
+
+    workers = [
+        threading.Thread(
+            target=_parse_stage,
+            args=(changed, max_workers, parsed_q, stop, stage_s, errors),
+            name="ingest-parse",
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_embed_stage,
+            args=(changed, manifest, dedup, batch_size, parsed_q, upsert_q, stop, stage_s, errors),
+            name="ingest-embed",
+            daemon=True,
+        ),
+    ]
+    # Dedup links are made before their chunks are embedded, and the manifest
+    # is updated per file; both are only kept if the whole run succeeds.
+    previous = manifest.entries([Path(path).name for path in changed])
+    if dedup is not None:
+        dedup.begin()
+    for worker in workers:
+        worker.start()
+
+    done = 0
+    completed = False
+    try:
+        while True:
+            item = upsert_q.get()
+            if item is _DONE:
+                break
+            kind = item[0]
+            if kind == "batch":
+                _, batch, embeddings = item
+                _upsert(batch, embeddings, collection, lexical, vectors, stage_s)
+                continue
+
+            _, parsed, file_hash, new_chunks, counts = item
+            file_path = Path(parsed["path"])
+            file_stats = {"source": file_path.name, "parse_s": round(parsed["parse_s"], 3)}
+            if kind == "error":
+                summary["files_failed"] += 1
+                print(f"[ERROR] Ingest failed: {parsed['path']} — {parsed['error']}")
+            else:
+                embedded, linked, unchanged, stale_ids = counts
+                if stale_ids:
+                    embedded += _delete_chunks(stale_ids, collection, lexical, vectors, dedup, stage_s)
+                manifest.record(file_path.name, file_path, file_hash, new_chunks)
+                summary["files_ingested"] += 1
+                summary["chunks_embedded"] += embedded
+                summary["chunks_linked"] += linked
+                summary["chunks_unchanged"] += unchanged
+                summary["chunks_deleted"] += len(stale_ids)
+                file_stats.update(pages=parsed["pages"], chunks=len(parsed["chunks"]))
+            file_stats["store_s"] = round(time.perf_counter() - parsed["received_at"], 3)
+            summary["file_timings"].append(file_stats)
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(changed), file_stats)
+        completed = True
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        if completed and not errors:
+            if dedup is not None:
+                dedup.commit()
+        else:
+            # Files this run did store are diffed (and re-stored from the embedding cache) next time.
+            manifest.restore(previous)
+            if dedup is not None:
+                dedup.rollback()
+
+    if errors:
+        raise RuntimeError(f"[INGEST FAIL] {errors[0]}") from errors[0]
+
+
+def collection_docs_dir(docs_dir, collection_name=DEFAULT_COLLECTION_NAME):
+    """
+    Folder holding a collection's source documents: docs_dir itself for the
+    default collection, docs_dir/<collection_name> for other shards. Folder
+    syncs don't recurse, so shards never pick up each other's files.
+    """
+    if not collection_name or collection_name == DEFAULT_COLLECTION_NAME:
+        return Path(docs_dir)
+    return Path(docs_dir) / validate_collection_name(collection_name)
+
+
+def ingest_folder(folder, persist_dir, collection_name=DEFAULT_COLLECTION_NAME, remove_missing=True, **kwargs):
+    """
+    Sync a folder into a collection: new/changed files are embedded and, with
+    remove_missing, files deleted from the folder have their chunks removed.
+    """
+    paths = sorted(p for p in Path(folder).glob("*") if p.suffix in SUPPORTED_SUFFIXES)
+    return ingest_paths(paths, persist_dir, collection_name, remove_missing=remove_missing, **kwargs)
+
+
+def ingest_urls(urls, docs_dir, persist_dir, collection_name=DEFAULT_COLLECTION_NAME, max_depth=0,
+                max_pages=CRAWL_MAX_PAGES, allowed_domains=None, crawl_callback=None, **kwargs):
+    """
+    Crawl web pages into docs_dir (see crawler.Crawler) and ingest the pages
+    that were fetched. Unchanged pages answer the conditional GET with 304
+    and are skipped by the manifest, so re-crawling a site is cheap.
+    crawl_callback is Crawler.crawl's progress_callback; other keyword
+    arguments go to ingest_paths.
+    Returns:
+        The ingest_paths summary with the crawl summary under "crawl".
+    """
+    crawler = Crawler(docs_dir, max_depth=max_depth, max_pages=max_pages, allowed_domains=allowed_domains)
+    crawl = crawler.crawl(urls, progress_callback=crawl_callback)
+    pages = {
+        Path(page["path"]).name: {"content_type": "web", "url": page["url"]}
+        for page in crawl["pages"] if page["path"]
+    }
+    summary = ingest_paths(crawl["files"], persist_dir, collection_name, source_metadata=pages, **kwargs)
+    summary["crawl"] = crawl
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incrementally ingest a folder of PDFs/text files into ChromaDB.")
+    parser.add_argument("folder", help="Folder containing .pdf / .txt files")
+    parser.add_argument("--persist-dir", default="chroma_db", help="ChromaDB directory (default: chroma_db)")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION_NAME, help="Collection name")
+    parser.add_argument("--batch-size", type=int, default=100, help="Chunks per encode/upsert batch")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=8, help="Capacity of each pipeline queue")
+    parser.add_argument("--url", action="append", help="Crawl this URL into the folder and ingest its pages (repeatable)")
+    parser.add_argument("--depth", type=int, default=0, help="Link depth to follow from --url (default: 0)")
+    parser.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES, help="Page limit per crawl")
+    args = parser.parse_args(argv)
+
+    def report(done, total, file_stats):
+        print(f"[{done}/{total}] {file_stats['source']} "
+              f"pages={file_stats.get('pages', '-')} chunks={file_stats.get('chunks', '-')} "
+              f"parse={file_stats['parse_s']}s store={file_stats['store_s']}s")
+
+    options = dict(batch_size=args.batch_size, max_workers=args.workers, queue_size=args.queue_size,
+                   progress_callback=report)
+    if args.url:
+        summary = ingest_urls(args.url, args.folder, args.persist_dir, args.collection, max_depth=args.depth,
+                              max_pages=args.max_pages, **options)
+        summary["crawl"].pop("pages")
+        summary["crawl"].pop("files")
+    else:
+        summary = ingest_folder(args.folder, args.persist_dir, args.collection, **options)
+    summary.pop("file_timings")
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+Background ingestion jobs.
+
+Uploads, folder syncs and website crawls are queued in a SQLite table next to
+the Chroma data and run by a small pool of worker threads, so the Streamlit
+script run and the HTTP handlers return immediately and poll for status.
+Jobs survive restarts: anything queued, or left running by a process that
+died, is picked up again (ingestion is incremental, so a re-run only redoes
+unfinished files). At most one job per collection runs at a time, across
+processes and hosts sharing the directory, because the ingest manifest of a
+collection has a single writer. A running job holds a lease that its worker
+renews every few seconds; only when the lease lapses (or its process is gone
+from this host) is the job taken to be orphaned and queued again.
+
+Usage:
+    queue = get_job_queue("chroma_db")
+    job = queue.submit_paths(["docs/report.pdf"])
+    queue.get(job["id"])  # {"status": "running", "progress": {"done": 0, "total": 1, ...}, ...}
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from crawler import CRAWL_MAX_PAGES
+from ingest import ingest_folder, ingest_paths, ingest_urls
+from manifest import file_sha256
+from tracing import span
+from vectorstore import DEFAULT_COLLECTION_NAME
+
+JOB_WORKERS = int(os.getenv("RAGVISOR_JOB_WORKERS", "2"))
+# Finished jobs kept for status queries; older ones are pruned.
+JOB_HISTORY = int(os.getenv("RAGVISOR_JOB_HISTORY", "200"))
+JOBS_FILENAME = "ingest_jobs.sqlite3"
+# A running job whose owner hasn't renewed its lease for this long is requeued.
+JOB_LEASE_S = float(os.getenv("RAGVISOR_JOB_LEASE_S", "60"))
+HOST_ID = socket.gethostname()
+# How often idle workers look for jobs submitted by other processes.
+POLL_S = 1.0
+ACTIVE_STATUSES = ("queued", "running")
+_COLUMNS = "id, kind, collection, payload, status, progress, result, error, created_at, started_at, finished_at"
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Persistent ingest job queue with a worker pool.
+
+    Submitting the same work again (same file contents, folder or crawl, for
+    the same collection) while an earlier job for it is still queued or
+    running returns that job instead of adding a new one. Use get_job_queue()
+    instead of constructing this directly.
+    """
+
+    def __init__(self, persist_dir, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.persist_dir = str(persist_dir)
+        self.path = Path(persist_dir) / JOBS_FILENAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.history = history
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                collection TEXT NOT NULL,
+                dedupe_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                owner_host TEXT,
+                owner_pid INTEGER,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )"""
+        )
+        # Tables created before leases existed.
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner_host", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._running = set()  # IDs of the jobs this process's workers hold leases on
+        self._requeue_orphans(startup=True)
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"ingest-job-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+        threading.Thread(target=self._heartbeat, name="ingest-job-lease", daemon=True).start()
+
+    # ---- storage ----
+
+    @contextmanager
+    def _write(self):
+        """Hold the lock inside an IMMEDIATE transaction, so other processes' writers wait too."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _requeue_orphans(self, startup=False):
+        """
+        Queue again the running jobs whose lease expired, and those owned by a
+        process on this host that no longer exists (or, at startup, by an
+        earlier process with this PID) without waiting for their lease.
+        """
+        now = time.time()
+        requeued = 0
+        with self._write() as conn:
+            rows = conn.execute(
+                "SELECT id, owner_host, owner_pid, lease_until FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            for job_id, host, pid, lease_until in rows:
+                if job_id in self._running:
+                    continue
+                local = host == HOST_ID and pid is not None
+                dead = local and ((startup and pid == os.getpid()) or not _pid_alive(pid))
+                if dead or lease_until is None or lease_until < now:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'queued', started_at = NULL, owner_host = NULL, owner_pid = NULL, "
+                        "lease_until = NULL WHERE id = ?",
+                        (job_id,),
+                    )
+                    requeued += 1
+            if requeued:
+                self._wakeup.notify_all()
+        return requeued
+
+    @staticmethod
+    def _to_job(row):
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS.split(", "), row))
+        for key in ("payload", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    # ---- submitting ----
+
+    def submit(self, kind, payload, collection_name=DEFAULT_COLLECTION_NAME, dedupe_key=None):
+        """
+        Queue a job, or return the queued/running job with the same dedupe_key.
+        Args:
+            kind: "paths", "folder" or "urls".
+            payload: JSON-serializable arguments for the ingest function.
+        Returns:
+            Job dict (see get()), with deduplicated=True if an existing job was returned.
+        """
+        dedupe_key = dedupe_key or hashlib.sha256(
+            json.dumps([kind, collection_name, payload], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        job_id = uuid.uuid4().hex
+        with self._write() as conn:
+            existing = conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1",
+                (dedupe_key, *ACTIVE_STATUSES),
+            ).fetchone()
+            if existing is None:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, collection, dedupe_key, payload, status, progress, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                    (job_id, kind, collection_name, dedupe_key, json.dumps(payload),
+                     json.dumps({"done": 0, "total": None, "message": "Queued"}), time.time()),
+                )
+                self._wakeup.notify()
+        if existing is not None:
+            return dict(self._to_job(existing), deduplicated=True)
+        return dict(self.get(job_id), deduplicated=False)
+
+    def submit_paths(self, paths, collection_name=DEFAULT_COLLECTION_NAME, remove_missing=False):
+        """Queue ingest_paths for files; deduplicated on the files' contents."""
+        paths = [str(Path(p).resolve()) for p in paths]
+        contents = []
+        for path in sorted(paths):
+            try:
+                contents.append((Path(path).name, file_sha256(path)))
+            except OSError:
+                contents.append((path, None))  # fails when run, with the real error
+        key = hashlib.sha256(json.dumps(["paths", collection_name, remove_missing, contents]).encode("utf-8")).hexdigest()
+        return self.submit("paths", {"paths": paths, "remove_missing": remove_missing}, collection_name, key)
+
+    def submit_folder(self, folder, collection_name=DEFAULT_COLLECTION_NAME, remove_missing=True):
+        """Queue ingest_folder (a full sync of the folder into the collection unless remove_missing is off)."""
+        return self.submit("folder", {"folder": str(Path(folder).resolve()), "remove_missing": remove_missing},
+                           collection_name)
+
+    def submit_urls(self, urls, docs_dir, collection_name=DEFAULT_COLLECTION_NAME, max_depth=0,
+                    max_pages=CRAWL_MAX_PAGES):
+        """Queue ingest_urls (crawl into docs_dir, then embed the fetched pages)."""
+        payload = {"urls": sorted(urls), "docs_dir": str(Path(docs_dir).resolve()), "max_depth": max_depth,
+                   "max_pages": max_pages}
+        return self.submit("urls", payload, collection_name)
+
+    # ---- status ----
+
+    def get(self, job_id):
+        """
+        Returns:
+            Dict with id, kind, collection, payload, status ("queued",
+            "running", "done" or "failed"), progress ({done, total, message}),
+            result (the ingest summary), error and created/started/finished
+            timestamps; None for an unknown or pruned job.
+        """
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_job(row)
+
+    def list(self, limit=20, statuses=None):
+        """Most recent jobs first, optionally only those in statuses."""
+        sql = f"SELECT {_COLUMNS} FROM jobs"
+        params = []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def wait(self, job_id, timeout=None, poll_s=0.2):
+        """Block until a job finishes (or timeout seconds pass) and return it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_s)
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in ("queued", "running", "done", "failed")}
+        counts.update(dict(rows))
+        counts["workers"] = len(self._threads)
+        return counts
+
+    # ---- workers ----
+
+    def _claim(self):
+        """Atomically take the oldest queued job whose collection has nothing running."""
+        with self._write() as conn:
+            row = conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE status = 'queued' AND collection NOT IN "
+                "(SELECT collection FROM jobs WHERE status = 'running') ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, owner_host = ?, owner_pid = ?, "
+                    "lease_until = ? WHERE id = ?",
+                    (now, HOST_ID, os.getpid(), now + JOB_LEASE_S, row[0]),
+                )
+                self._running.add(row[0])
+        return self._to_job(row)
+
+    def _heartbeat(self):
+        """Renew the leases of this process's running jobs and requeue other owners' expired ones."""
+        while True:
+            time.sleep(JOB_LEASE_S / 3)
+            try:
+                with self._write() as conn:
+                    for job_id in self._running:
+                        conn.execute(
+                            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND owner_host = ? "
+                            "AND owner_pid = ?",
+                            (time.time() + JOB_LEASE_S, job_id, HOST_ID, os.getpid()),
+                        )
+                self._requeue_orphans()
+            except Exception as e:
+                print(f"[ERROR] Ingest job lease renewal failed — {e}")
+
+    def _set_progress(self, job_id, done, total, message):
+        progress = json.dumps({"done": done, "total": total, "message": message})
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+
+    def _finish(self, job_id, result=None, error=None):
+        with self._write() as conn:
+            self._running.discard(job_id)
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+                "WHERE id = ? AND owner_host = ? AND owner_pid = ?",
+                ("failed" if error else "done", None if result is None else json.dumps(result, default=str),
+                 error, time.time(), job_id, HOST_ID, os.getpid()),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status NOT IN (?, ?) AND id NOT IN "
+                "(SELECT id FROM jobs WHERE status NOT IN (?, ?) ORDER BY finished_at DESC LIMIT ?)",
+                (*ACTIVE_STATUSES, *ACTIVE_STATUSES, self.history),
+            )
+
+    def _run(self, job):
+        job_id, payload, collection = job["id"], job["payload"], job["collection"]
+
+        def on_file(done, total, file_stats):
+            self._set_progress(job_id, done, total, f"Embedded {file_stats['source']}")
+
+        if job["kind"] == "paths":
+            return ingest_paths(payload["paths"], self.persist_dir, collection,
+                                remove_missing=payload.get("remove_missing", False), progress_callback=on_file)
+        if job["kind"] == "folder":
+            return ingest_folder(payload["folder"], self.persist_dir, collection,
+                                 remove_missing=payload.get("remove_missing", True), progress_callback=on_file)
+        if job["kind"] == "urls":
+            def on_page(done, page):
+                self._set_progress(job_id, done, payload["max_pages"], f"Crawled {page['url']}")
+
+            summary = ingest_urls(payload["urls"], payload["docs_dir"], self.persist_dir, collection,
+                                  max_depth=payload["max_depth"], max_pages=payload["max_pages"],
+                                  crawl_callback=on_page, progress_callback=on_file)
+            # The per-page list can be long; the counts are what callers show.
+            summary["crawl"].pop("pages", None)
+            return summary
+        raise ValueError(f"Unknown job kind: {job['kind']}")
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_S)
+                continue
+            with span("ingest_job", kind=job["kind"]) as attrs:
+                try:
+                    summary = self._run(job)
+                    attrs["chunks"] = summary.get("chunks_embedded", 0)
+                    self._finish(job["id"], result=summary)
+                except Exception as e:
+                    print(f"[ERROR] Ingest job {job['id']} ({job['kind']}) failed — {e}")
+                    self._finish(job["id"], error=str(e))
+
+
+def get_job_queue(persist_dir, workers=JOB_WORKERS):
+    """
+    Return the process-wide JobQueue for persist_dir, starting its workers on first use.
+    """
+    key = str(Path(persist_dir).resolve())
+    queue = _queues.get(key)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(key)
+            if queue is None:
+                queue = JobQueue(persist_dir, workers=workers)
+                _queues[key] = queue
+    return queue
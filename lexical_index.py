@@ -0,0 +1,242 @@
+import math
+import os
+import pickle
+import re
+import threading
+from array import array
+from pathlib import Path
+import numpy as np
+
+INDEX_FILENAME = "lexical_{name}.idx"
+
+# Keeps identifiers such as "E-1042", "ISO-9001", "4.2.1" or "part_no" as single tokens.
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[\-_./][a-z0-9]+)*")
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index kept next to a Chroma collection.
+
+    Postings are stored per term as two parallel typed arrays (uint32 document
+    numbers, uint16 term frequencies), i.e. 6 bytes per posting, and scored
+    with NumPy against a dense score vector. Removed chunks are tombstoned and
+    physically dropped by compact() once they make up a quarter of the index.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._mtime_ns = None
+        self._clear()
+        if self.path.exists():
+            self._load()
+
+    def _clear(self):
+        self.chunk_ids = []
+        self.doc_numbers = {}
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.postings = {}
+        self.total_length = 0
+        self.live_docs = 0
+
+    # ---- persistence ----
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        self._clear()
+        self.chunk_ids = state["chunk_ids"]
+        self.lengths = state["lengths"]
+        self.alive = state["alive"]
+        self.postings = state["postings"]
+        self.doc_numbers = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids) if self.alive[i]}
+        self.live_docs = len(self.doc_numbers)
+        self.total_length = sum(self.lengths[i] for i in self.doc_numbers.values())
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def reload_if_changed(self):
+        """Pick up an index saved by another process (e.g. the ingest CLI)."""
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime_ns != self._mtime_ns:
+                self._load()
+
+    def save(self):
+        with self._lock:
+            if self.alive.count(0) > len(self.alive) // 4:
+                self.compact()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "chunk_ids": self.chunk_ids,
+                        "lengths": self.lengths,
+                        "alive": self.alive,
+                        "postings": self.postings,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self.path)
+            self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    # ---- updates ----
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                doc = self.doc_numbers.pop(chunk_id, None)
+                if doc is not None:
+                    self.alive[doc] = 0
+                    self.total_length -= self.lengths[doc]
+                    self.live_docs -= 1
+
+    def add(self, chunk_ids, texts):
+        """Index chunks, replacing any earlier version of the same chunk IDs."""
+        with self._lock:
+            self.remove(chunk_ids)
+            for chunk_id, text in zip(chunk_ids, texts):
+                tokens = tokenize(text)
+                doc = len(self.chunk_ids)
+                self.chunk_ids.append(chunk_id)
+                self.doc_numbers[chunk_id] = doc
+                self.lengths.append(len(tokens))
+                self.alive.append(1)
+                self.total_length += len(tokens)
+                self.live_docs += 1
+
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    entry = self.postings.get(token)
+                    if entry is None:
+                        entry = self.postings[token] = (array("I"), array("H"))
+                    entry[0].append(doc)
+                    entry[1].append(min(tf, 65535))
+
+    def compact(self):
+        """Rewrite postings without tombstoned documents and renumber the rest."""
+        with self._lock:
+            remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+            live = [i for i, flag in enumerate(self.alive) if flag]
+            remap[live] = np.arange(len(live))
+            postings = {}
+            for token, (docs, tfs) in self.postings.items():
+                docs_np = np.frombuffer(docs, dtype=np.uint32)
+                keep = remap[docs_np] >= 0
+                if keep.any():
+                    postings[token] = (
+                        array("I", remap[docs_np[keep]].astype(np.uint32).tobytes()),
+                        array("H", np.frombuffer(tfs, dtype=np.uint16)[keep].tobytes()),
+                    )
+            self.chunk_ids = [self.chunk_ids[i] for i in live]
+            self.lengths = array("I", [self.lengths[i] for i in live])
+            self.alive = bytearray(b"\x01" * len(live))
+            self.postings = postings
+            self.doc_numbers = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+
+    def rebuild_from_collection(self, collection, batch_size=1000):
+        """Index every chunk already stored in a Chroma collection."""
+        with self._lock:
+            self._clear()
+            offset = 0
+            while True:
+                batch = collection.get(include=["documents"], limit=batch_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                self.add(batch["ids"], batch["documents"])
+                offset += len(batch["ids"])
+
+    # ---- search ----
+
+    def search(self, query, k=20, allowed_ids=None):
+        """
+        BM25 top-k for a query.
+        Args:
+            allowed_ids: Optional set of chunk IDs to restrict results to
+                (a metadata pre-filter); other chunks are never scored.
+        Returns:
+            List of (chunk_id, score), best first.
+        """
+        with self._lock:
+            if not self.live_docs:
+                return []
+            terms = set(tokenize(query))
+            n_docs = self.live_docs
+            avgdl = self.total_length / n_docs
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+            alive = np.frombuffer(self.alive, dtype=np.uint8)
+            scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+            if allowed_ids is not None:
+                allowed = np.zeros(len(self.chunk_ids), dtype=bool)
+                allowed[[self.doc_numbers[c] for c in allowed_ids if c in self.doc_numbers]] = True
+                alive = alive & allowed
+            for term in terms:
+                entry = self.postings.get(term)
+                if entry is None:
+                    continue
+                docs = np.frombuffer(entry[0], dtype=np.uint32)
+                tfs = np.frombuffer(entry[1], dtype=np.uint16).astype(np.float32)
+                live = alive[docs].astype(bool)
+                docs, tfs = docs[live], tfs[live]
+                if not len(docs):
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs].astype(np.float32) / avgdl)
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            return [(self.chunk_ids[i], float(scores[i])) for i in candidates]
+
+    def stats(self):
+        postings = sum(len(docs) for docs, _ in self.postings.values())
+        return {
+            "documents": self.live_docs,
+            "terms": len(self.postings),
+            "postings": postings,
+            "postings_bytes": postings * 6,
+        }
+
+
+def get_lexical_index(persist_dir, collection_name, collection=None):
+    """
+    Return the process-wide LexicalIndex for a collection.
+
+    If no index file exists yet but the collection already holds chunks, the
+    index is built from the collection once.
+    """
+    path = Path(persist_dir).resolve() / INDEX_FILENAME.format(name=collection_name)
+    key = str(path)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = LexicalIndex(path)
+                if not path.exists() and collection is not None and collection.count():
+                    index.rebuild_from_collection(collection)
+                    index.save()
+                _indexes[key] = index
+    else:
+        index.reload_if_changed()
+    return index
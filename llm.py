@@ -1,18 +1,312 @@
+import asyncio
+import email.utils
+import hashlib
+import json
 import os
-from openai import OpenAI
+import random
+import threading
+import time
 from dotenv import load_dotenv
+from context_builder import estimate_tokens
+from ratelimit import TokenBucket
+from tracing import record, span
 
 load_dotenv()
 
-# ✅ Load API key from .env
-client = OpenAI(
-    api_key=os.getenv("GROQ_API_KEY"),
-    base_url="https://api.groq.com/openai/v1"
-)
-
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1")
 DEFAULT_MODEL = "llama3-70b-8192"
 
-def generate_answer(question, context, model=DEFAULT_MODEL):
+# Size these to the Groq tier (free tier: 30 requests and 6000 tokens per minute).
+REQUESTS_PER_MINUTE = float(os.getenv("GROQ_RPM", "30"))
+TOKENS_PER_MINUTE = float(os.getenv("GROQ_TPM", "6000"))
+MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "4"))
+MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+REQUEST_TIMEOUT_S = float(os.getenv("GROQ_TIMEOUT_S", "60"))
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 20.0
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+_client = None
+_client_lock = threading.Lock()
+# Buckets hold one minute of quota, like Groq's own per-minute windows. Each
+# call reserves its estimated prompt plus max_tokens, as Groq counts it.
+_request_bucket = TokenBucket(REQUESTS_PER_MINUTE / 60.0, capacity=max(1.0, REQUESTS_PER_MINUTE))
+_token_bucket = TokenBucket(TOKENS_PER_MINUTE / 60.0, capacity=max(1.0, TOKENS_PER_MINUTE))
+_cooldown_until = 0.0  # set from Retry-After on a 429; every caller waits it out
+_inflight = {}
+_inflight_lock = threading.Lock()  # guards _inflight and _cooldown_until
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "coalesced": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "errors": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "latency_s": 0.0,
+    "first_token_s": 0.0,
+    "limiter_wait_s": 0.0,
+}
+
+
+class LLMError(Exception):
+    """A Groq call failed (after retries); raised instead of returning error text as the answer."""
+
+
+def _api_key():
+    # ✅ Load API key from .env
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY is missing in environment variables.")
+    return api_key
+
+
+def _get_client():
+    """
+    Process-wide client on a pooled keep-alive connection, so calls after the
+    first skip the TCP/TLS handshake. Retries are handled here, not by the SDK.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # The SDK takes ~0.5 s to import; load it with the first call (or warm-up).
+                import httpx
+                from openai import OpenAI
+
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS, keepalive_expiry=60),
+                    timeout=REQUEST_TIMEOUT_S,
+                )
+                _client = OpenAI(api_key=_api_key(), base_url=GROQ_BASE_URL, max_retries=0, http_client=http_client)
+    return _client
+
+
+def prepare_client():
+    """Import the SDK and open the pooled client ahead of the first call (see warmup.py)."""
+    _get_client()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+
+def llm_stats():
+    """Counters for Groq calls made by this process (tokens, retries, 429s, latency)."""
+    with _stats_lock:
+        stats = dict(_stats)
+    calls = stats["calls"] or 1
+    stats["mean_latency_s"] = round(stats["latency_s"] / calls, 3)
+    stats["mean_first_token_s"] = round(stats["first_token_s"] / calls, 3)
+    return stats
+
+
+def _retry_after(error):
+    """Seconds from a Retry-After header (delta seconds or HTTP date), or None."""
+    value = error.response.headers.get("retry-after") if error.response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before retrying error, or None if it should not be retried."""
+    global _cooldown_until
+    from openai import APIConnectionError, APIStatusError
+
+    if isinstance(error, APIStatusError):
+        if error.status_code not in RETRY_STATUSES:
+            return None
+        delay = _retry_after(error)
+        if error.status_code == 429:
+            _count(rate_limited=1)
+            if delay is not None:
+                with _inflight_lock:
+                    _cooldown_until = max(_cooldown_until, time.monotonic() + delay)
+        if delay is not None:
+            return min(delay, BACKOFF_MAX_S * 3)
+    elif not isinstance(error, APIConnectionError):
+        return None
+    backoff = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt)
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+def _wait_for_capacity(estimated_tokens):
+    """Block until the rate limiters (and any server-requested cooldown) allow another call."""
+    waited = 0.0
+    with _inflight_lock:
+        cooldown = _cooldown_until - time.monotonic()
+    if cooldown > 0:
+        time.sleep(cooldown)
+        waited += cooldown
+    waited += _request_bucket.acquire()
+    waited += _token_bucket.acquire(estimated_tokens)
+    return waited
+
+
+class _SharedCall:
+    """
+    One upstream completion whose deltas are fanned out to every caller that
+    asked for the identical prompt while it was in flight.
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._async_subscribers = []
+
+    def _publish(self, item):
+        """Hand item to every async subscriber; one whose event loop has closed is dropped."""
+        live = []
+        for loop, queue in self._async_subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+                live.append((loop, queue))
+            except RuntimeError:
+                pass
+        self._async_subscribers = live
+
+    def push(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._cond.notify_all()
+            self._publish(token)
+
+    def finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+            self._publish(None)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.tokens) and not self.done:
+                    self._cond.wait()
+                pending = self.tokens[index:]
+                finished = self.done
+            for token in pending:
+                yield token
+            index += len(pending)
+            if finished and index >= len(self.tokens):
+                if self.error:
+                    raise self.error
+                return
+
+    async def aiter(self):
+        queue = asyncio.Queue()
+        with self._cond:
+            for token in self.tokens:
+                queue.put_nowait(token)
+            if self.done:
+                queue.put_nowait(None)
+            else:
+                self._async_subscribers.append((asyncio.get_running_loop(), queue))
+        while (token := await queue.get()) is not None:
+            yield token
+        if self.error:
+            raise self.error
+
+
+def _upstream(shared, key, messages, model, temperature, max_tokens):
+    """Run one streamed completion with rate limiting and retries, feeding shared."""
+    estimated_prompt = sum(estimate_tokens(message["content"]) for message in messages)
+    attempt = 0
+    start = time.perf_counter()
+    try:
+        with span("llm.call", model=model) as attrs:
+            while True:
+                waited = _wait_for_capacity(estimated_prompt + max_tokens)
+                _count(limiter_wait_s=waited)
+                usage = None
+                try:
+                    stream = _get_client().chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if not shared.tokens:
+                                first_token = time.perf_counter() - start
+                                record("llm.call.first_token", first_token)
+                                _count(first_token_s=first_token)
+                            shared.push(chunk.choices[0].delta.content)
+                        if getattr(chunk, "usage", None):
+                            usage = chunk.usage
+                    break
+                except Exception as e:
+                    # Once tokens have reached callers the call can't be replayed.
+                    delay = None if shared.tokens or attempt >= MAX_RETRIES else _retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                    attempt += 1
+                    _count(retries=1)
+                    print(f"[ERROR] Groq call failed ({e}); retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+                    time.sleep(delay)
+
+            prompt_tokens = usage.prompt_tokens if usage else estimated_prompt
+            completion_tokens = usage.completion_tokens if usage else estimate_tokens("".join(shared.tokens))
+            attrs.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, retries=attempt)
+            _count(calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                   latency_s=time.perf_counter() - start)
+        shared.finish()
+    except Exception as e:
+        _count(calls=1, errors=1, latency_s=time.perf_counter() - start)
+        shared.finish(e)
+    finally:
+        with _inflight_lock:
+            if _inflight.get(key) is shared:
+                del _inflight[key]
+
+
+def _shared_call(messages, model, temperature, max_tokens):
+    """Join the in-flight call for an identical request, or start a new one."""
+    key = hashlib.sha256(json.dumps([model, messages, temperature, max_tokens]).encode("utf-8")).hexdigest()
+    with _inflight_lock:
+        shared = _inflight.get(key)
+        if shared is not None:
+            _count(coalesced=1)
+            return shared
+        shared = _inflight[key] = _SharedCall()
+    threading.Thread(
+        target=_upstream, args=(shared, key, messages, model, temperature, max_tokens), name="groq-call", daemon=True
+    ).start()
+    return shared
+
+
+def _build_messages(question, context):
+    prompt = (
+        "You are a helpful assistant. Use the provided context to answer the question precisely.\n\n"
+        f"Context:\n{context}\n\n"
+        f"Question:\n{question}\n\n"
+        "Answer:"
+    )
+    return [
+        {"role": "system", "content": "You are a helpful assistant for answering document-related questions."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def generate_answer(question, context, model=DEFAULT_MODEL, temperature=0.3, max_tokens=400):
     """
     Generate an answer using a Groq-hosted LLM with given context.
     Args:
@@ -21,32 +315,56 @@ def generate_answer(question, context, model=DEFAULT_MODEL):
         model (str): LLM model name.
     Returns:
         str: Generated answer.
+    Raises:
+        LLMError: If the Groq call fails.
+    """
+    try:
+        return "".join(_shared_call(_build_messages(question, context), model, temperature, max_tokens)).strip()
+
+    except Exception as e:
+        raise LLMError(str(e)) from e
+
+
+def stream_answer(question, context, model=DEFAULT_MODEL, temperature=0.3, max_tokens=400):
+    """
+    Stream an answer token by token as Groq produces it.
+    Args:
+        question (str): User query.
+        context (str): Retrieved RAG context.
+        model (str): LLM model name.
+    Yields:
+        str: Text deltas.
+    Raises:
+        LLMError: If the Groq call fails, possibly after some deltas were yielded.
+    """
+    try:
+        for token in _shared_call(_build_messages(question, context), model, temperature, max_tokens):
+            yield token
+
+    except Exception as e:
+        raise LLMError(str(e)) from e
+
+
+async def astream_answer(question, context, model=DEFAULT_MODEL, temperature=0.3, max_tokens=400):
+    """
+    Async variant of stream_answer for use inside an event loop.
+    Yields:
+        str: Text deltas.
+    Raises:
+        LLMError: If the Groq call fails.
     """
     try:
-        prompt = (
-            "You are a helpful assistant. Use the provided context to answer the question precisely.\n\n"
-            f"Context:\n{context}\n\n"
-            f"Question:\n{question}\n\n"
-            "Answer:"
-        )
-
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant for answering document-related questions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=400,
-        )
-
-        return response.choices[0].message.content.strip()
+        async for token in _shared_call(_build_messages(question, context), model, temperature, max_tokens).aiter():
+            yield token
 
     except Exception as e:
-        return f"[LLM Error] {e}"
+        raise LLMError(str(e)) from e
 
 
 if __name__ == "__main__":
     context = "RAG helps reduce hallucination in LLMs by retrieving grounded, relevant knowledge chunks from a database."
     question = "How does RAG help LLMs overcome hallucinations?"
-    print("Answer:\n", generate_answer(question, context))
+    print("Answer:")
+    for token in stream_answer(question, context):
+        print(token, end="", flush=True)
+    print()
@@ -1,110 +1,153 @@
+import os
 import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import requests
-from bs4 import BeautifulSoup
+from chunker import chunk_text
 
-splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+_FILLER_RE = re.compile(r"answer to '.*?':|.*placeholder response", re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
 
 def clean_text(text):
-    lines = text.splitlines()
-    clean_lines = []
-    for line in lines:
-        line = line.strip()
-        if not line or "placeholder response" in line.lower():
-            continue
-        if re.match(r"^answer to '.*?':", line.lower()):
-            continue
-        clean_lines.append(line)
-    return "\n".join(clean_lines)
-
-    def load_and_split_url(url):
     """
-    Load and split content from a URL into chunks with metadata.
-    Args:
-        url: The web page URL (str).
-    Returns:
-        List of tuples (chunk_text, metadata_dict)
+    Strip every line, drop filler lines and keep runs of blank lines as a
+    single paragraph break (the chunker splits on structure).
     """
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, "html.parser")
+    lines = [line.strip() for line in text.splitlines()]
+    # str methods run in C; whole-text regex passes are slower here, since
+    # patterns that can start with optional whitespace are tried at every
+    # position. The regexes only run on the rare pages that need them.
+    lowered = text.lower()
+    if "placeholder response" in lowered or "answer to '" in lowered:
+        lines = [line for line in lines if not _FILLER_RE.match(line)]
+    text = "\n".join(lines)
+    if "\n\n\n" in text:
+        text = _BLANK_LINES_RE.sub("\n\n", text)
+    return text.strip()
 
-        # Remove unwanted tags
-        for tag in soup(["script", "style", "nav", "footer", "header", "form", "noscript"]):
-            tag.decompose()
+def iter_pdf_pages(file):
+    """
+    Yield (page_number, cleaned_text) for each page of a PDF, one page at a time.
+    """
+    from PyPDF2 import PdfReader
 
-        # Extract and clean text
-        text = soup.get_text(separator="\n")
-        cleaned_text = clean_text(text)
+    reader = PdfReader(file)
+    for page_number, page in enumerate(reader.pages, 1):
+        yield page_number, clean_text(page.extract_text() or "")
 
-        # Split text into chunks
-        splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        split_texts = splitter.split_text(cleaned_text)
+def load_pdf_text(file):
+    return "\n".join(text for _, text in iter_pdf_pages(file))
 
-        chunks = []
-        for i, chunk in enumerate(split_texts):
-            chunks.append((chunk, {"source": url, "chunk_id": f"{url}_chunk_{i}"}))
+def load_text_file(file_path):
+    return clean_text(file_path.read_text(encoding="utf-8"))
 
-        return chunks
-    except Exception as e:
-        print(f"Error loading URL {url}: {e}")
-        return []
+def split_with_offsets(text):
+    """
+    Split text into token-sized, structure-aware chunks (see chunker.py) and
+    report where each chunk starts.
+    Returns:
+        List of (chunk_text, start_offset) tuples.
+    """
+    return [(chunk, start) for chunk, start, _ in chunk_text(text)]
 
+def iter_file_pages(file_path):
+    """Yield (page_number, text) for a .pdf (one per page) or a .txt file (a single page)."""
+    file_path = Path(file_path)
+    if file_path.suffix == ".pdf":
+        with open(file_path, "rb") as f:
+            yield from iter_pdf_pages(f)
+    elif file_path.suffix == ".txt":
+        yield 1, load_text_file(file_path)
 
-def load_pdf_text(file):
-    reader = PdfReader(file)
-    text = ""
-    for page in reader.pages:
-        page_text = page.extract_text() or ""
-        text += page_text + "\n"
-    return clean_text(text)
+def iter_chunks(file_path):
+    """
+    Stream (chunk_text, offset, page_number) for a file.
 
-def load_text_file(file_path):
-    return clean_text(file_path.read_text(encoding="utf-8"))
+    Pages are split one at a time so only the current page is held in memory
+    and no chunk spans two pages; offsets index into the file's pages joined
+    by newlines.
+    """
+    yield from _page_chunks(iter_file_pages(file_path))
+
+def _page_chunks(pages):
+    offset = 0
+    for page_number, text in pages:
+        for chunk, start in split_with_offsets(text):
+            yield chunk, offset + start, page_number
+        offset += len(text) + 1
 
 def load_and_split_pdfs(source, is_uploaded_files=False):
-    chunks = []
+    """
+    Legacy helper: chunk a folder of .pdf/.txt files or a list of uploaded PDFs
+    in memory. Kept as a thin wrapper over iter_chunks; ingest.ingest_paths
+    streams the same chunks and stores them incrementally.
+    Args:
+        source: Folder path, or uploaded file objects (with .name) if is_uploaded_files.
+        is_uploaded_files: Whether source holds uploaded PDFs.
+    Returns:
+        List of (chunk_text, metadata) tuples, with chunk IDs as ingest_paths assigns them.
+    """
+    from manifest import make_chunk_id
+
     if is_uploaded_files:
-        for uploaded_file in source:
-            try:
-                text = load_pdf_text(uploaded_file)
-                split_texts = splitter.split_text(text)
-                for i, chunk in enumerate(split_texts):
-                    chunks.append((chunk, {"source": uploaded_file.name, "chunk_id": f"{uploaded_file.name}_{i}"}))
-            except Exception as e:
-                print(f"[ERROR] PDF load failed: {uploaded_file.name} — {e}")
+        files = [(f.name, "pdf", lambda f=f: _page_chunks(iter_pdf_pages(f))) for f in source]
     else:
-        folder = Path(source)
-        for file_path in folder.glob("*"):
-            try:
-                if file_path.suffix == ".pdf":
-                    with open(file_path, "rb") as f:
-                        text = load_pdf_text(f)
-                elif file_path.suffix == ".txt":
-                    text = load_text_file(file_path)
-                else:
-                    continue
-                split_texts = splitter.split_text(text)
-                for i, chunk in enumerate(split_texts):
-                    chunks.append((chunk, {"source": file_path.name, "chunk_id": f"{file_path.name}_{i}"}))
-            except Exception as e:
-                print(f"[ERROR] File read failed: {file_path} — {e}")
+        files = [
+            (path.name, "pdf" if path.suffix == ".pdf" else "text", lambda path=path: iter_chunks(path))
+            for path in sorted(Path(source).glob("*")) if path.suffix in (".pdf", ".txt")
+        ]
+    chunks = []
+    for name, content_type, file_chunks in files:
+        try:
+            for chunk, offset, page_number in file_chunks():
+                chunks.append((chunk, {"source": name, "chunk_id": make_chunk_id(name, offset),
+                                       "content_type": content_type, "page": page_number}))
+        except Exception as e:
+            print(f"[ERROR] File read failed: {name} — {e}")
     return chunks
 
-def load_text_from_web(url):
+def parse_file(file_path):
+    """
+    Parse and split one file.
+    Returns:
+        Dict with path, chunks [(text, offset, page)], page count and parse time,
+        or path and error if the file could not be read.
+    """
+    start = time.perf_counter()
     try:
-        response = requests.get(url, timeout=5)
-        soup = BeautifulSoup(response.text, "html.parser")
-        text = soup.get_text()
-        cleaned = clean_text(text)
-        split_texts = splitter.split_text(cleaned)
         chunks = []
-        for i, chunk in enumerate(split_texts):
-            chunks.append((chunk, {"source": url, "chunk_id": f"{url}_{i}"}))
-        return chunks
+        pages = 0
+        for chunk, offset, page_number in iter_chunks(file_path):
+            chunks.append((chunk, offset, page_number))
+            pages = max(pages, page_number)
+        return {"path": str(file_path), "chunks": chunks, "pages": pages, "parse_s": time.perf_counter() - start}
     except Exception as e:
-        print(f"[ERROR] Web scraping failed: {url} — {e}")
-        return []
+        return {"path": str(file_path), "error": str(e), "parse_s": time.perf_counter() - start}
+
+def parse_files_parallel(paths, max_workers=None):
+    """
+    Parse files across a process pool, yielding parse_file() results as each file finishes.
+
+    At most two files per worker are in flight, so a slow consumer of this
+    generator holds back parsing instead of letting parsed files pile up.
+    Args:
+        paths: File paths to parse.
+        max_workers: Pool size; defaults to the CPU count, capped at the number of files.
+    """
+    paths = [str(p) for p in paths]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    if max_workers <= 1:
+        for path in paths:
+            yield parse_file(path)
+        return
+    remaining = iter(paths)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {pool.submit(parse_file, path) for path in islice(remaining, max_workers * 2)}
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    in_flight.add(pool.submit(parse_file, next_path))
+                yield future.result()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from vectorstore import DEFAULT_COLLECTION_NAME
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+
+def file_sha256(path, block_size=1 << 20):
+    """Content hash of a file, read in blocks so large PDFs aren't loaded at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(source, offset):
+    """
+    Stable chunk ID derived from a hash of the source name and the chunk's character offset.
+
+    Re-ingesting an edited file reuses the IDs of chunks that did not move, so
+    they are overwritten in place instead of piling up next to stale copies.
+    The file's content hash is deliberately left out: it would give every
+    chunk of an edited file a new ID and force a full delete and re-upsert.
+    Content changes are tracked per chunk by the manifest's text hashes
+    instead. IDs only need to be unique within a collection, which has one
+    manifest entry per source name (ingest_paths refuses two files with the
+    same name in one run); a renamed file gets new IDs, and its vectors come
+    from the embedding cache.
+    """
+    return f"{text_sha256(source)[:16]}_{offset}"
+
+
+class IngestManifest:
+    """
+    Persisted record of every source file that has been embedded.
+
+    Layout of the JSON file:
+        {"files": {source: {"file_hash", "size", "mtime", "chunks": {chunk_id: text_hash}}}}
+
+    A file whose size and mtime are unchanged is not re-hashed, so scanning an
+    unchanged corpus only costs one stat() per file.
+    """
+
+    def __init__(self, persist_dir, collection_name=None):
+        # One manifest per collection, so a file can be ingested into several shards.
+        filename = MANIFEST_FILENAME
+        if collection_name and collection_name != DEFAULT_COLLECTION_NAME:
+            filename = MANIFEST_FILENAME.replace(".json", f"_{collection_name}.json")
+        self.path = Path(persist_dir) / filename
+        self._lock = threading.Lock()
+        self.files = {}
+        if self.path.exists():
+            try:
+                self.files = json.loads(self.path.read_text(encoding="utf-8")).get("files", {})
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Ignoring unreadable manifest {self.path}: {e}")
+
+    def check(self, source, file_path):
+        """
+        Compare a file on disk with its manifest entry.
+        Args:
+            source: Manifest key (usually the file name).
+            file_path: Path of the file on disk.
+        Returns:
+            (file_hash, changed) where changed is False when the file is already embedded.
+        """
+        stat = os.stat(file_path)
+        entry = self.files.get(source)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["file_hash"], False
+
+        file_hash = file_sha256(file_path)
+        if entry and entry["file_hash"] == file_hash:
+            # Touched but not modified: refresh the stat fields only.
+            with self._lock:
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime
+            return file_hash, False
+        return file_hash, True
+
+    def chunk_hashes(self, source):
+        entry = self.files.get(source)
+        return dict(entry["chunks"]) if entry else {}
+
+    def record(self, source, file_path, file_hash, chunks):
+        """
+        Store the chunk IDs and text hashes produced for a source.
+        Args:
+            chunks: Mapping of chunk_id -> text hash.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            self.files[source] = {
+                "file_hash": file_hash,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "chunks": dict(chunks),
+            }
+
+    def entries(self, sources):
+        """Copies of the entries for sources (None where there is none), for restore()."""
+        with self._lock:
+            return {source: json.loads(json.dumps(self.files[source])) if source in self.files else None
+                    for source in sources}
+
+    def restore(self, entries):
+        """Put back entries taken with entries(), e.g. after an ingest run failed."""
+        with self._lock:
+            for source, entry in entries.items():
+                if entry is None:
+                    self.files.pop(source, None)
+                else:
+                    self.files[source] = entry
+
+    def forget(self, source):
+        """Drop a source from the manifest and return the chunk IDs it owned."""
+        with self._lock:
+            entry = self.files.pop(source, None)
+        return list(entry["chunks"]) if entry else []
+
+    def sources(self):
+        return list(self.files)
+
+    def save(self):
+        """Write the manifest atomically so an interrupted ingest can't corrupt it."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with self._lock:
+            data = json.dumps({"files": self.files})
+        tmp_path.write_text(data, encoding="utf-8")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,255 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from answer_cache import get_answer_cache
+from context_builder import build_context, context_budget
+from embedder import get_embedding_service
+from llm import DEFAULT_MODEL, LLMError, generate_answer, stream_answer
+from reranker import RERANK_ENABLED, RERANK_KEEP
+from retriever import retrieve, retrieve_batch
+from tracing import get_tracer, record, span
+from vectorstore import collections_version, get_collection, resolve_collections
+
+DEFAULT_RETRIEVAL_MODE = os.getenv("RAGVISOR_RETRIEVAL_MODE", "hybrid")
+DEFAULT_CONTEXT_CANDIDATES = int(os.getenv("RAGVISOR_CONTEXT_CANDIDATES", "20"))
+ANSWER_MAX_TOKENS = 1000
+NO_RESULTS_ANSWER = "No relevant information found in the database for your query."
+BATCH_CONCURRENCY = int(os.getenv("RAGVISOR_BATCH_CONCURRENCY", "4"))
+
+
+def _context_stats(packed):
+    stats = {key: packed[key] for key in ("tokens_used", "budget", "candidates", "blocks", "dropped")}
+    stats["packed"] = len(packed["documents"])
+    return stats
+
+
+def _context_candidates(candidates, rerank):
+    # Re-ranked chunks are good enough that fewer of them fill the context.
+    return min(candidates, RERANK_KEEP) if rerank else candidates
+
+
+def run_query(query, persist_dir, mode=DEFAULT_RETRIEVAL_MODE, candidates=DEFAULT_CONTEXT_CANDIDATES,
+              model=DEFAULT_MODEL, temperature=0.7, max_tokens=ANSWER_MAX_TOKENS, rerank=RERANK_ENABLED,
+              collections=None, where=None):
+    """
+    Answer a question, yielding progress events as they happen.
+
+    Shared by the Streamlit app and the HTTP server so both serve exactly the
+    same pipeline: encode -> semantic answer cache -> retrieve (optionally
+    cross-encoder re-ranked) -> pack context -> stream from Groq -> store in
+    the cache. collections selects the shards to search: a name, a list of
+    names or "*" for all (default: the default collection). where is an
+    optional metadata filter (see vectorstore.build_where) applied inside the
+    retrievers; filtered queries bypass the answer cache, whose entries were
+    drawn from unfiltered results.
+    Yields:
+        {"event": "cache_hit", "matched_question", "similarity"} on a cache hit,
+        {"event": "context", "stats"} once the context is packed,
+        {"event": "token", "text"} per answer delta, and finally
+        {"event": "done", "answer", "documents", "metadatas", "cache_match",
+        "context_stats", "timings", "error"} with per-stage seconds. error is
+        None, or the reason the Groq call failed; answer then holds whatever
+        was streamed before the failure and nothing is cached.
+    """
+    result = {"cache_match": None, "context_stats": None, "error": None}
+    tracer = get_tracer()
+    names = resolve_collections(persist_dir, collections)
+    with span("query", query_bytes=len(query.encode("utf-8")), collections=len(names)) as query_attrs:
+        trace_id = tracer.current_trace_id()
+        with span("encode"):
+            query_embedding = get_embedding_service().encode_queries(query)[0]
+        version = collections_version(persist_dir, names)
+        answer_cache = None if where else get_answer_cache(persist_dir, names)
+        cached = None
+        if answer_cache:
+            with span("answer_cache") as cache_attrs:
+                cached = answer_cache.lookup(query_embedding, version)
+                cache_attrs["hit"] = int(bool(cached))
+        query_attrs["cached"] = int(bool(cached))
+
+        if cached:
+            answer, documents, metadatas = cached["answer"], cached["documents"], cached["metadatas"]
+            result["cache_match"] = {"matched_question": cached["matched_question"], "similarity": cached["similarity"]}
+            yield dict(event="cache_hit", **result["cache_match"])
+        else:
+            with span("chroma_open"):
+                for name in names:
+                    get_collection(persist_dir, name)
+            with span("retrieve", mode=mode) as retrieve_attrs:
+                results = retrieve(query, persist_dir, collection_name=names, query_embedding=query_embedding,
+                                   n_results=_context_candidates(candidates, rerank), mode=mode, rerank=rerank,
+                                   where=where)
+                for stage, seconds in results["timings"].items():
+                    record(f"retrieve.{stage}", seconds)
+                retrieve_attrs.update(chunks=len(results["ids"]), reranked=int(results["reranked"]))
+            with span("context") as context_attrs:
+                packed = build_context(
+                    results["ids"],
+                    results["documents"],
+                    results["metadatas"],
+                    results["scores"],
+                    context_budget(model, max_tokens, query),
+                )
+                context_attrs.update(tokens=packed["tokens_used"], bytes=len(packed["context"].encode("utf-8")), chunks=len(packed["documents"]))
+            result["context_stats"] = _context_stats(packed)
+            yield {"event": "context", "stats": result["context_stats"]}
+
+            documents = packed["documents"]
+            metadatas = packed["metadatas"]
+            if not documents:
+                answer = NO_RESULTS_ANSWER
+            else:
+                tokens = []
+                with span("llm", model=model) as llm_attrs:
+                    start = time.perf_counter()
+                    try:
+                        for token in stream_answer(query, packed["context"], model=model, temperature=temperature, max_tokens=max_tokens):
+                            if not tokens:
+                                record("llm.first_token", time.perf_counter() - start)
+                            tokens.append(token)
+                            yield {"event": "token", "text": token}
+                    except LLMError as e:
+                        print(f"[ERROR] LLM call failed — {e}")
+                        result["error"] = str(e)
+                    answer = "".join(tokens).strip()
+                    llm_attrs.update(tokens=len(tokens), bytes=len(answer.encode("utf-8")), error=int(bool(result["error"])))
+            if answer_cache and not result["error"]:
+                with span("answer_cache_store"):
+                    answer_cache.store(query, query_embedding, answer, documents, metadatas, version)
+
+    timings = {}
+    for traced in tracer.trace(trace_id):
+        if traced["parent"] is not None:
+            timings[traced["name"]] = round(timings.get(traced["name"], 0.0) + traced["duration_s"], 6)
+    timings["total"] = round(next((s["duration_s"] for s in tracer.trace(trace_id) if s["parent"] is None), 0.0), 6)
+    yield dict(event="done", answer=answer, documents=documents, metadatas=metadatas, timings=timings, **result)
+
+
+def answer_query(query, persist_dir, **kwargs):
+    """
+    Blocking variant of run_query.
+    Returns:
+        The final "done" event (answer, documents, metadatas, cache_match,
+        context_stats, timings).
+    """
+    for event in run_query(query, persist_dir, **kwargs):
+        if event["event"] == "done":
+            return event
+
+
+def answer_batch(questions, persist_dir, mode=DEFAULT_RETRIEVAL_MODE, candidates=DEFAULT_CONTEXT_CANDIDATES,
+                 model=DEFAULT_MODEL, temperature=0.7, max_tokens=ANSWER_MAX_TOKENS,
+                 max_concurrency=BATCH_CONCURRENCY, rerank=RERANK_ENABLED, collections=None, where=None):
+    """
+    Answer many questions with shared work batched.
+
+    Identical questions are answered once. All unique questions are encoded in
+    one call, checked against the answer cache, and the misses are retrieved
+    with a single multi-vector Chroma query. Groq calls then fan out over
+    max_concurrency threads, paced by the shared Groq rate limiter in llm.py.
+    With a where filter the answer cache is bypassed, as in run_query.
+    Returns:
+        Dict with "results" (one per input question, in input order: question,
+        answer, documents, metadatas, cache_match, context_stats, timings,
+        error, the reason the Groq call failed or None, and duplicate_of, the
+        index of the first identical question or None) and batch-level
+        "timings" for the shared stages.
+    """
+    names = resolve_collections(persist_dir, collections)
+    unique = list(dict.fromkeys(question.strip() for question in questions))
+    items = [{"question": question, "cache_match": None, "context_stats": None, "error": None, "timings": {}}
+             for question in unique]
+    batch_timings = {}
+    batch_start = time.perf_counter()
+
+    with span("batch_query", questions=len(questions), unique=len(unique)):
+        start = time.perf_counter()
+        with span("encode", queries=len(unique)):
+            embeddings = get_embedding_service().encode_queries(unique) if unique else []
+        batch_timings["encode"] = time.perf_counter() - start
+
+        version = collections_version(persist_dir, names)
+        answer_cache = None if where else get_answer_cache(persist_dir, names)
+        misses = []
+        for item, embedding in zip(items, embeddings):
+            cached = None
+            if answer_cache:
+                start = time.perf_counter()
+                cached = answer_cache.lookup(embedding, version)
+                item["timings"]["answer_cache"] = time.perf_counter() - start
+            item["embedding"] = embedding
+            if cached:
+                item.update(answer=cached["answer"], documents=cached["documents"], metadatas=cached["metadatas"])
+                item["cache_match"] = {"matched_question": cached["matched_question"], "similarity": cached["similarity"]}
+            else:
+                misses.append(item)
+
+        if misses:
+            start = time.perf_counter()
+            with span("retrieve", mode=mode, queries=len(misses)):
+                retrieved, retrieve_timings = retrieve_batch(
+                    [item["question"] for item in misses], persist_dir, collection_name=names,
+                    query_embeddings=[item["embedding"] for item in misses],
+                    n_results=_context_candidates(candidates, rerank), mode=mode, rerank=rerank, where=where,
+                )
+            batch_timings["retrieve"] = time.perf_counter() - start
+            batch_timings.update({f"retrieve.{stage}": seconds for stage, seconds in retrieve_timings.items()})
+
+            for item, results in zip(misses, retrieved):
+                start = time.perf_counter()
+                item["packed"] = build_context(
+                    results["ids"],
+                    results["documents"],
+                    results["metadatas"],
+                    results["scores"],
+                    context_budget(model, max_tokens, item["question"]),
+                )
+                item["timings"]["context"] = time.perf_counter() - start
+                item["context_stats"] = _context_stats(item["packed"])
+                item["documents"] = item["packed"]["documents"]
+                item["metadatas"] = item["packed"]["metadatas"]
+
+            def generate(item):
+                if not item["documents"]:
+                    item["answer"] = NO_RESULTS_ANSWER
+                    return
+                start = time.perf_counter()
+                try:
+                    item["answer"] = generate_answer(item["question"], item["packed"]["context"], model=model,
+                                                     temperature=temperature, max_tokens=max_tokens)
+                except LLMError as e:
+                    print(f"[ERROR] LLM call failed — {e}")
+                    item["answer"], item["error"] = "", str(e)
+                item["timings"]["llm"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            with span("llm", model=model, requests=len(misses)):
+                with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="batch-llm") as pool:
+                    list(pool.map(generate, misses))
+            batch_timings["llm"] = time.perf_counter() - start
+
+            with span("answer_cache_store"):
+                for item in misses:
+                    if answer_cache and not item["error"]:
+                        answer_cache.store(item["question"], item["embedding"], item["answer"],
+                                           item["documents"], item["metadatas"], version)
+
+    batch_timings["total"] = time.perf_counter() - batch_start
+    by_question = {item["question"]: item for item in items}
+    first_index = {}
+    results = []
+    for index, question in enumerate(questions):
+        item = by_question[question.strip()]
+        duplicate_of = first_index.setdefault(item["question"], index)
+        results.append({
+            "question": question,
+            "answer": item["answer"],
+            "documents": item["documents"],
+            "metadatas": item["metadatas"],
+            "cache_match": item["cache_match"],
+            "context_stats": item["context_stats"],
+            "error": item["error"],
+            "timings": {stage: round(seconds, 6) for stage, seconds in item["timings"].items()},
+            "duplicate_of": duplicate_of if duplicate_of != index else None,
+        })
+    return {"results": results, "timings": {stage: round(seconds, 6) for stage, seconds in batch_timings.items()}}
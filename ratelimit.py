@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second and holds at
+    most `capacity` tokens, so short bursts go through immediately while the
+    long-run rate stays under the limit.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1.0):
+        """
+        Block until `tokens` are available and take them.
+        Returns:
+            Seconds spent waiting.
+        """
+        tokens = min(float(tokens), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
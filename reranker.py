@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import text_hash
+
+# Off by default: the cross-encoder adds a second model load and ~1-5 ms per
+# (query, chunk) pair on CPU in exchange for a much better top few chunks.
+RERANK_ENABLED = os.getenv("RAGVISOR_RERANK", "0").lower() in ("1", "true", "yes")
+DEFAULT_MODEL_NAME = os.getenv("RAGVISOR_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.getenv("RAGVISOR_RERANK_TOP_N", "30"))
+RERANK_KEEP = int(os.getenv("RAGVISOR_RERANK_KEEP", "8"))
+RERANK_BUDGET_MS = float(os.getenv("RAGVISOR_RERANK_BUDGET_MS", "250"))
+RERANK_BATCH_SIZE = int(os.getenv("RAGVISOR_RERANK_BATCH_SIZE", "16"))
+RERANK_WORKERS = int(os.getenv("RAGVISOR_RERANK_WORKERS", "2"))
+SCORE_CACHE_SIZE = int(os.getenv("RAGVISOR_RERANK_CACHE_SIZE", "50000"))
+# Chunks truncated to this many characters (~128 tokens) before scoring.
+MAX_CHUNK_CHARS = 512
+
+_rerankers = {}
+_rerankers_lock = threading.Lock()
+
+
+class CrossEncoderReranker:
+    """
+    Process-wide cross-encoder that re-scores (query, chunk) pairs.
+
+    Pairs are split into batches that run on a small thread pool (PyTorch
+    releases the GIL during inference). Scores are cached per (query hash,
+    chunk id, chunk text hash), so repeated and paginated queries only score
+    new chunks. A running per-pair cost estimate lets rerank() skip the stage
+    when scoring the uncached pairs would blow the latency budget. Use
+    get_reranker() instead of constructing this directly.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, device=None, batch_size=RERANK_BATCH_SIZE,
+                 workers=RERANK_WORKERS, cache_size=SCORE_CACHE_SIZE):
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+
+        start = time.perf_counter()
+        self.model = CrossEncoder(model_name, device=self.device, max_length=256)
+        self.load_time = time.perf_counter() - start
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rerank")
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self._pair_s = None  # moving average of wall seconds per scored pair
+        self._stats = {"calls": 0, "skipped": 0, "pairs_scored": 0, "cache_hits": 0, "over_budget": 0}
+
+    def _predict(self, pairs):
+        batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
+        scores = []
+        for batch_scores in self._executor.map(
+            lambda batch: self.model.predict(batch, batch_size=self.batch_size, show_progress_bar=False), batches
+        ):
+            scores.extend(float(score) for score in batch_scores)
+        return scores
+
+    def estimate_s(self, pairs):
+        """Predicted wall seconds to score this many uncached pairs (0 until measured)."""
+        return (self._pair_s or 0.0) * pairs
+
+    def rerank(self, query, ids, documents, budget_ms=RERANK_BUDGET_MS):
+        """
+        Score each chunk against the query.
+        Args:
+            query: Question text.
+            ids: Chunk IDs, parallel to documents.
+            documents: Chunk texts.
+            budget_ms: Skip scoring if the uncached pairs are estimated to
+                take longer than this; None disables the check.
+        Returns:
+            List of cross-encoder scores parallel to ids, or None if the
+            stage was skipped for the budget.
+        """
+        query_key = text_hash(query)
+        keys = [(query_key, chunk_id, text_hash(document)) for chunk_id, document in zip(ids, documents)]
+        scores = [None] * len(keys)
+        with self._lock:
+            self._stats["calls"] += 1
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        with self._lock:
+            self._stats["cache_hits"] += len(keys) - len(missing)
+        if not missing:
+            return scores
+
+        if budget_ms is not None and self.estimate_s(len(missing)) * 1000 > budget_ms:
+            with self._lock:
+                self._stats["skipped"] += 1
+                # Decay the estimate so one slow (e.g. cold) call can't disable the stage for good.
+                self._pair_s *= 0.9
+            return None
+
+        start = time.perf_counter()
+        predicted = self._predict([(query, documents[i][:MAX_CHUNK_CHARS]) for i in missing])
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            per_pair = elapsed / len(missing)
+            self._pair_s = per_pair if self._pair_s is None else 0.8 * self._pair_s + 0.2 * per_pair
+            self._stats["pairs_scored"] += len(missing)
+            if budget_ms is not None and elapsed * 1000 > budget_ms:
+                self._stats["over_budget"] += 1
+            for i, score in zip(missing, predicted):
+                scores[i] = score
+                self._scores[keys[i]] = score
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+        return scores
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_scores"] = len(self._scores)
+        stats.update(
+            model_name=self.model_name,
+            device=self.device,
+            load_time_s=round(self.load_time, 3),
+            ms_per_pair=round((self._pair_s or 0.0) * 1000, 3),
+        )
+        return stats
+
+
+def get_reranker(model_name=DEFAULT_MODEL_NAME, device=None):
+    """
+    Return the shared CrossEncoderReranker for model_name, loading it on first use.
+    """
+    key = (model_name, device)
+    reranker = _rerankers.get(key)
+    if reranker is None:
+        with _rerankers_lock:
+            reranker = _rerankers.get(key)
+            if reranker is None:
+                reranker = CrossEncoderReranker(model_name, device=device)
+                _rerankers[key] = reranker
+    return reranker
+
+
+def reranker_stats():
+    """Counters for every reranker loaded so far (scored pairs, cache hits, budget skips)."""
+    return [reranker.stats() for reranker in list(_rerankers.values())]
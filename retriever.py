@@ -0,0 +1,314 @@
+import heapq
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dedup_index import get_dedup_index
+from embedder import get_embedding_service
+from lexical_index import get_lexical_index
+from reranker import RERANK_BUDGET_MS, RERANK_TOP_N, get_reranker
+from vector_index import get_vector_index
+from vectorstore import DEFAULT_COLLECTION_NAME, collection_version, get_collection, resolve_collections
+
+DEFAULT_CANDIDATES = 20
+RRF_K = 60
+SHARD_WORKERS = int(os.getenv("RAGVISOR_SHARD_WORKERS", "8"))
+# Filters whose matching chunk IDs are kept, per collection version.
+FILTER_CACHE_SIZE = int(os.getenv("RAGVISOR_FILTER_CACHE_SIZE", "64"))
+
+# Shared by all fan-out queries; Chroma's HNSW search and the NumPy scans
+# release the GIL, so shards really are searched in parallel.
+_shard_executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+_filter_cache = OrderedDict()
+_filter_cache_lock = threading.Lock()
+
+
+def _rrf(rankings, k=RRF_K):
+    """Reciprocal rank fusion over lists of chunk IDs, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return scores
+
+
+def _weighted(dense, lexical, dense_weight):
+    """Weighted sum of min-max normalized dense similarities and BM25 scores."""
+    def normalize(pairs):
+        if not pairs:
+            return {}
+        values = [score for _, score in pairs]
+        low, high = min(values), max(values)
+        span = (high - low) or 1.0
+        return {chunk_id: (score - low) / span for chunk_id, score in pairs}
+
+    dense_norm = normalize(dense)
+    lexical_norm = normalize(lexical)
+    return {
+        chunk_id: dense_weight * dense_norm.get(chunk_id, 0.0) + (1 - dense_weight) * lexical_norm.get(chunk_id, 0.0)
+        for chunk_id in set(dense_norm) | set(lexical_norm)
+    }
+
+
+def retrieve(query, persist_dir, collection_name=DEFAULT_COLLECTION_NAME, query_embedding=None,
+             n_results=3, mode="hybrid", candidates=DEFAULT_CANDIDATES, fusion="rrf", dense_weight=0.5,
+             rerank=False, rerank_top_n=RERANK_TOP_N, rerank_budget_ms=RERANK_BUDGET_MS, where=None):
+    """
+    Retrieve the most relevant chunks for a query.
+    Args:
+        query: Question text.
+        persist_dir: ChromaDB directory.
+        collection_name: Collection to search, a list of collections (shards)
+            to fan out to, or "*" for every collection.
+        query_embedding: Optional precomputed query embedding.
+        n_results: Number of chunks to return.
+        mode: "dense", "lexical" or "hybrid".
+        candidates: Candidates pulled from each retriever before fusion.
+        fusion: "rrf" (reciprocal rank fusion) or "weighted".
+        dense_weight: Weight of the dense score when fusion == "weighted".
+        rerank: Re-score the top rerank_top_n with the cross-encoder and keep
+            the best n_results. Falls back to the first-stage order when
+            scoring would exceed rerank_budget_ms.
+        where: Optional Chroma metadata filter (see vectorstore.build_where),
+            applied inside every retriever before ranking.
+    Returns:
+        Dict with ids, documents, metadatas, scores, collections (the
+        collection of each chunk), reranked and per-stage timings.
+    """
+    results, timings = retrieve_batch(
+        [query], persist_dir, collection_name,
+        query_embeddings=None if query_embedding is None else [query_embedding],
+        n_results=n_results, mode=mode, candidates=candidates, fusion=fusion, dense_weight=dense_weight,
+        rerank=rerank, rerank_top_n=rerank_top_n, rerank_budget_ms=rerank_budget_ms, where=where,
+    )
+    return dict(results[0], timings=timings)
+
+
+def _matching_ids(persist_dir, collection_name, collection, where):
+    """
+    IDs of the chunks stored in a collection that match a where clause, as a
+    frozenset. Repeats of a filter are served from a small LRU cache until
+    the collection's version changes.
+    """
+    key = (str(persist_dir), collection_name, collection_version(persist_dir, collection_name),
+           json.dumps(where, sort_keys=True))
+    with _filter_cache_lock:
+        ids = _filter_cache.get(key)
+        if ids is not None:
+            _filter_cache.move_to_end(key)
+            return ids
+    ids = frozenset(collection.get(where=where, include=[])["ids"])
+    with _filter_cache_lock:
+        _filter_cache[key] = ids
+        while len(_filter_cache) > FILTER_CACHE_SIZE:
+            _filter_cache.popitem(last=False)
+    return ids
+
+
+def _search_shard(queries, query_embeddings, persist_dir, collection_name, mode, k, skip_empty=False, where=None):
+    """
+    First-stage dense and lexical candidates from one collection.
+    Returns:
+        (dense, lexical, fetched, timings): per-query lists of (key, score),
+        best first, with key = (collection_name, chunk_id); the documents and
+        metadatas Chroma already returned, by key; and stage timings.
+        skip_empty avoids querying empty collections when fanning out to "*".
+        With a where filter, HNSW search filters inside Chroma; the lexical
+        and compact indexes only score the matching chunk IDs, resolved from
+        Chroma's metadata index (cached per collection version). Either way
+        the filter also admits the representatives of matching duplicates
+        (see dedup_index.py).
+    """
+    timings = {}
+    collection = get_collection(persist_dir, collection_name)
+    dense = [[] for _ in queries]
+    lexical = [[] for _ in queries]
+    fetched = {}
+    if skip_empty and not collection.count():
+        return dense, lexical, fetched, timings
+
+    vectors = get_vector_index(persist_dir, collection_name, collection) if mode in ("dense", "hybrid") else None
+    allowed_ids = None
+    if where:
+        start = time.perf_counter()
+        dedup = get_dedup_index(persist_dir, collection_name)
+        # A matching chunk linked as a duplicate is stored only as its representative.
+        linked = dedup.representatives_matching(where) if dedup is not None else set()
+        if mode != "dense" or vectors is not None:
+            allowed_ids = _matching_ids(persist_dir, collection_name, collection, where)
+            if linked:
+                allowed_ids = allowed_ids | linked
+        if linked:
+            where = {"$or": [where, {"chunk_id": {"$in": sorted(linked)}}]}
+        timings["filter"] = time.perf_counter() - start
+        if allowed_ids is not None:
+            if not allowed_ids:
+                return dense, lexical, fetched, timings
+            k = min(k, len(allowed_ids))
+
+    if mode in ("dense", "hybrid"):
+        start = time.perf_counter()
+        if vectors is not None:
+            # Compact mode: quantized scan + exact re-rank; documents are fetched later.
+            for i, hits in enumerate(vectors.search(query_embeddings, k=k, allowed_ids=allowed_ids)):
+                dense[i] = [((collection_name, chunk_id), score) for chunk_id, score in hits]
+        else:
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=where,
+                include=["documents", "metadatas", "distances"],
+            )
+            for i in range(len(queries)):
+                for chunk_id, document, metadata, distance in zip(
+                    results["ids"][i], results["documents"][i], results["metadatas"][i], results["distances"][i]
+                ):
+                    dense[i].append(((collection_name, chunk_id), -distance))
+                    fetched[(collection_name, chunk_id)] = (document, metadata or {})
+        timings["search"] = time.perf_counter() - start
+
+    if mode in ("lexical", "hybrid"):
+        start = time.perf_counter()
+        index = get_lexical_index(persist_dir, collection_name, collection)
+        for i, query in enumerate(queries):
+            lexical[i] = [((collection_name, chunk_id), score) for chunk_id, score in index.search(query, k=k, allowed_ids=allowed_ids)]
+        timings["lexical"] = time.perf_counter() - start
+    return dense, lexical, fetched, timings
+
+
+def _with_duplicate_sources(persist_dir, fetched, keys):
+    """
+    Metadata for keys, with duplicate_sources listing the other documents
+    that contain a passage stored only once (see dedup_index.py).
+    """
+    indexes = {}
+    metadatas = []
+    for name, chunk_id in keys:
+        metadata = fetched[(name, chunk_id)][1]
+        if name not in indexes:
+            indexes[name] = get_dedup_index(persist_dir, name)
+        sources = indexes[name].duplicate_sources(chunk_id) if indexes[name] is not None else []
+        sources = [source for source in sources if source != metadata.get("source")]
+        metadatas.append(dict(metadata, duplicate_sources=sources) if sources else metadata)
+    return metadatas
+
+
+def _merge_top(k, ranked_lists):
+    """Merge per-shard (key, score) lists into the global top k by score."""
+    if len(ranked_lists) == 1:
+        return ranked_lists[0][:k]
+    return heapq.nlargest(k, (item for ranked in ranked_lists for item in ranked), key=lambda item: item[1])
+
+
+def retrieve_batch(queries, persist_dir, collection_name=DEFAULT_COLLECTION_NAME, query_embeddings=None,
+                   n_results=3, mode="hybrid", candidates=DEFAULT_CANDIDATES, fusion="rrf", dense_weight=0.5,
+                   rerank=False, rerank_top_n=RERANK_TOP_N, rerank_budget_ms=RERANK_BUDGET_MS, where=None):
+    """
+    Retrieve for many queries at once: one vectorized encode (if embeddings
+    are not given), one multi-vector collection.query per collection and one
+    collection.get per collection for chunks only the lexical index surfaced.
+
+    When several collections are selected they are searched in parallel and
+    each retriever's candidates are merged into a global top-k by score before
+    fusion. Dense scores (negative squared L2) compare exactly across shards;
+    BM25 scores use per-shard term statistics, so the lexical merge is an
+    approximation when shards differ a lot in size.
+    Returns:
+        (results, timings): one {ids, documents, metadatas, scores,
+        collections, reranked} dict per query in input order, and per-stage
+        timings for the whole batch (the slowest shard for parallel stages).
+    """
+    timings = {}
+    names = resolve_collections(persist_dir, collection_name)
+    # With re-ranking the first stage only proposes; pull a deeper shortlist.
+    final_results = n_results
+    if rerank:
+        n_results = max(n_results, rerank_top_n)
+
+    if mode in ("dense", "hybrid") and queries:
+        if query_embeddings is None:
+            start = time.perf_counter()
+            query_embeddings = get_embedding_service().encode_queries(list(queries))
+            timings["encode"] = time.perf_counter() - start
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    k = candidates if mode == "hybrid" else n_results
+
+    if not queries:
+        shards = []
+    elif len(names) == 1:
+        shards = [_search_shard(queries, query_embeddings, persist_dir, names[0], mode, k, where=where)]
+    else:
+        start = time.perf_counter()
+        shards = list(_shard_executor.map(
+            lambda name: _search_shard(queries, query_embeddings, persist_dir, name, mode, k, skip_empty=True, where=where),
+            names,
+        ))
+        timings["fanout"] = time.perf_counter() - start
+
+    fetched = {}
+    for _, _, shard_fetched, shard_timings in shards:
+        fetched.update(shard_fetched)
+        for stage, seconds in shard_timings.items():
+            timings[stage] = max(timings.get(stage, 0.0), seconds)
+    dense = [_merge_top(k, [shard[0][i] for shard in shards]) for i in range(len(queries))] if shards else []
+    lexical = [_merge_top(k, [shard[1][i] for shard in shards]) for i in range(len(queries))] if shards else []
+
+    rankings = []
+    start = time.perf_counter()
+    for query_dense, query_lexical in zip(dense, lexical):
+        if mode == "dense":
+            rankings.append(query_dense[:n_results])
+        elif mode == "lexical":
+            rankings.append(query_lexical[:n_results])
+        else:
+            if fusion == "weighted":
+                fused = _weighted(query_dense, query_lexical, dense_weight)
+            else:
+                fused = _rrf([[key for key, _ in query_dense], [key for key, _ in query_lexical]])
+            rankings.append(sorted(fused.items(), key=lambda item: item[1], reverse=True)[:n_results])
+    if mode == "hybrid":
+        timings["fusion"] = time.perf_counter() - start
+
+    missing = {}
+    for ranked in rankings:
+        for key, _ in ranked:
+            if key not in fetched:
+                missing.setdefault(key[0], {})[key[1]] = None
+    if missing:
+        start = time.perf_counter()
+        for name, chunk_ids in missing.items():
+            extra = get_collection(persist_dir, name).get(ids=list(chunk_ids), include=["documents", "metadatas"])
+            for chunk_id, document, metadata in zip(extra["ids"], extra["documents"], extra["metadatas"]):
+                fetched[(name, chunk_id)] = (document, metadata or {})
+        timings["fetch"] = time.perf_counter() - start
+
+    output = []
+    if rerank and queries:
+        start = time.perf_counter()
+        reranker = get_reranker()
+    for query, ranked in zip(queries, rankings):
+        ranked = [(key, score) for key, score in ranked if key in fetched]
+        reranked = False
+        if rerank and ranked:
+            scores = reranker.rerank(
+                query, [key[1] for key, _ in ranked], [fetched[key][0] for key, _ in ranked],
+                budget_ms=rerank_budget_ms,
+            )
+            if scores is not None:
+                ranked = sorted(zip([key for key, _ in ranked], scores), key=lambda item: item[1], reverse=True)
+                reranked = True
+        ranked = ranked[:final_results]
+        output.append({
+            "ids": [key[1] for key, _ in ranked],
+            "documents": [fetched[key][0] for key, _ in ranked],
+            "metadatas": _with_duplicate_sources(persist_dir, fetched, [key for key, _ in ranked]),
+            "scores": [score for _, score in ranked],
+            "collections": [key[0] for key, _ in ranked],
+            "reranked": reranked,
+        })
+    if rerank and queries:
+        timings["rerank"] = time.perf_counter() - start
+    return output, timings
@@ -0,0 +1,446 @@
+"""
+Headless HTTP API for RAGvisor.
+
+Serves the same ingestion and query pipeline as the Streamlit app, so it can
+be called programmatically, load-tested and scaled out behind a load balancer.
+
+Usage:
+    python -m server [--host 0.0.0.0] [--port 8000]
+    uvicorn server:app --workers 4
+
+Endpoints:
+    POST /query            {"question", "mode"?, "candidates"?, "rerank"?, "collections"?} -> answer JSON
+    POST /query/stream     same body -> server-sent events (see query_service.run_query)
+    POST /query/batch      {"questions", "mode"?, "candidates"?, "rerank"?, "collections"?, "max_concurrency"?}
+                           -> results in input order
+    POST /ingest           {"paths"? | "folder"? | "urls"?, "collection"?, "max_depth"?, "max_pages"?,
+                            "background"?} -> ingest summary, or 202 + job with "background"
+    PUT  /documents/{name} raw file body, saved to the docs folder and ingested (?collection=name&background=1)
+    GET  /jobs, /jobs/{id} ingest job status and progress (see jobs.JobQueue.get)
+    GET  /collections      collection (shard) names with chunk counts and document names
+    GET  /health, /stats, /metrics (Prometheus text)
+
+"collections" is a list of collection names to fan out to, or ["*"] for all.
+Query bodies may also scope the search with "sources" (document names),
+"content_types" ("pdf", "text", "web"), "ingested_after" / "ingested_before"
+(epoch seconds) and a raw Chroma "where" clause; the filter is applied inside
+the vector store and BM25 index, before ranking.
+
+Ingestion only reads files under RAGVISOR_DOCS_DIR, and only crawls hosts
+listed in RAGVISOR_API_URL_HOSTS. When RAGVISOR_API_TOKEN is set, every
+endpoint but /health requires "Authorization: Bearer <token>".
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional
+from urllib.parse import urlparse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from embedder import service_stats
+from crawler import CRAWL_MAX_PAGES
+from dedup_index import get_dedup_index
+from ingest import collection_docs_dir
+from jobs import get_job_queue
+from llm import llm_stats
+from manifest import IngestManifest
+from reranker import RERANK_ENABLED, reranker_stats
+from query_service import (
+    BATCH_CONCURRENCY, DEFAULT_CONTEXT_CANDIDATES, DEFAULT_RETRIEVAL_MODE, answer_batch, answer_query, run_query,
+)
+from tracing import get_tracer
+from vectorstore import (
+    ALL_COLLECTIONS, DEFAULT_COLLECTION_NAME, build_where, collection_version, get_collection, list_collections,
+    validate_collection_name,
+)
+from warmup import WARMUP_ENABLED, startup_report, warm_up
+
+PERSIST_DIR = os.getenv("RAGVISOR_PERSIST_DIR", "chroma_db")
+DOCS_DIR = os.getenv("RAGVISOR_DOCS_DIR", "docs")
+API_TOKEN = os.getenv("RAGVISOR_API_TOKEN", "")
+# Hosts POST /ingest may crawl, comma-separated ("*" for any); none by default.
+API_URL_HOSTS = {host.strip().lower() for host in os.getenv("RAGVISOR_API_URL_HOSTS", "").split(",") if host.strip()}
+QUERY_WORKERS = int(os.getenv("RAGVISOR_QUERY_WORKERS", "8"))
+MAX_QUEUED_QUERIES = int(os.getenv("RAGVISOR_MAX_QUEUED_QUERIES", "32"))
+MAX_BATCH_SIZE = int(os.getenv("RAGVISOR_MAX_BATCH_SIZE", "500"))
+MIN_QUESTION_LENGTH = 3
+JOB_POLL_S = 0.25
+RetrievalMode = Literal["dense", "lexical", "hybrid"]
+
+
+class FilteredRequest(BaseModel):
+    sources: Optional[List[str]] = None
+    content_types: Optional[List[str]] = None
+    ingested_after: Optional[int] = None
+    ingested_before: Optional[int] = None
+    where: Optional[Dict[str, Any]] = None
+
+    def build_where(self):
+        try:
+            return build_where(self.sources, self.content_types, self.ingested_after, self.ingested_before, self.where)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+class QueryRequest(FilteredRequest):
+    question: str
+    mode: RetrievalMode = DEFAULT_RETRIEVAL_MODE
+    candidates: int = DEFAULT_CONTEXT_CANDIDATES
+    rerank: bool = RERANK_ENABLED
+    collections: Optional[List[str]] = None
+
+
+class BatchQueryRequest(FilteredRequest):
+    questions: List[str]
+    mode: RetrievalMode = DEFAULT_RETRIEVAL_MODE
+    candidates: int = DEFAULT_CONTEXT_CANDIDATES
+    rerank: bool = RERANK_ENABLED
+    collections: Optional[List[str]] = None
+    max_concurrency: int = BATCH_CONCURRENCY
+
+
+class IngestRequest(BaseModel):
+    paths: Optional[List[str]] = None
+    folder: Optional[str] = None
+    urls: Optional[List[str]] = None
+    collection: str = DEFAULT_COLLECTION_NAME
+    max_depth: int = 0
+    max_pages: int = CRAWL_MAX_PAGES
+    background: bool = False
+
+
+class ConcurrencyLimiter:
+    """
+    Admission control for the query worker pool: at most max_active requests
+    run at once, at most max_queued wait for a slot, and anything beyond that
+    is rejected straight away with 503 instead of piling up latency.
+    """
+
+    def __init__(self, max_active, max_queued):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(max_active)
+
+    async def acquire(self):
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, retry shortly.", headers={"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Queries share one pool sized to the limiter; ingestion runs on the job
+# queue's own workers so a bulk ingest never starves query serving.
+_query_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="query")
+limiter = ConcurrencyLimiter(QUERY_WORKERS, MAX_QUEUED_QUERIES)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start the ingest workers now, so jobs queued before a restart resume right away.
+    get_job_queue(PERSIST_DIR)
+    # Load the model and indexes before accepting traffic, so the first query is served warm.
+    if WARMUP_ENABLED:
+        await asyncio.get_running_loop().run_in_executor(_query_executor, warm_up, PERSIST_DIR)
+    yield
+
+
+async def require_token(request: Request):
+    if not API_TOKEN or request.url.path == "/health":
+        return
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode("utf-8"), API_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Missing or invalid API token.",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+
+app = FastAPI(title="RAGvisor API", lifespan=lifespan, dependencies=[Depends(require_token)])
+
+
+def _validate_collections(names, allow_all=True):
+    # Checked up front for a clean 422; ingest targets must name one collection.
+    for name in names or []:
+        if name != ALL_COLLECTIONS or not allow_all:
+            try:
+                validate_collection_name(name)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+    return names
+
+
+def _docs_path(path):
+    """Resolve a client-supplied path, refusing anything outside DOCS_DIR."""
+    resolved = Path(path).resolve()
+    if not resolved.is_relative_to(Path(DOCS_DIR).resolve()):
+        raise HTTPException(status_code=403, detail=f"Path is outside the documents folder: {path}")
+    return resolved
+
+
+def _validate_urls(urls):
+    for url in urls:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise HTTPException(status_code=422, detail=f"Invalid URL: {url}")
+        if "*" not in API_URL_HOSTS and parsed.hostname.lower() not in API_URL_HOSTS:
+            raise HTTPException(status_code=403, detail=f"Crawling {parsed.hostname} is not allowed "
+                                                         "(see RAGVISOR_API_URL_HOSTS).")
+    return urls
+
+
+def _validate_question(request):
+    question = request.question.strip()
+    if len(question) < MIN_QUESTION_LENGTH:
+        raise HTTPException(status_code=422, detail=f"Question must be at least {MIN_QUESTION_LENGTH} characters long.")
+    return question
+
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    question = _validate_question(request)
+    _validate_collections(request.collections)
+    where = request.build_where()
+    loop = asyncio.get_running_loop()
+    async with limiter.slot():
+        try:
+            result = await loop.run_in_executor(
+                _query_executor,
+                partial(answer_query, question, PERSIST_DIR, mode=request.mode, candidates=request.candidates,
+                        rerank=request.rerank, collections=request.collections, where=where),
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Query failed: {e}")
+    if result["error"]:
+        raise HTTPException(status_code=502, detail=f"LLM call failed: {result['error']}")
+    return result
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    question = _validate_question(request)
+    _validate_collections(request.collections)
+    where = request.build_where()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for event in run_query(question, PERSIST_DIR, mode=request.mode, candidates=request.candidates,
+                                   rerank=request.rerank, collections=request.collections, where=where):
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except Exception as e:
+            loop.call_soon_threadsafe(events.put_nowait, {"event": "error", "detail": f"Query failed: {e}"})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    # Take the slot before responding so an overloaded server answers 503, and
+    # hold it until the worker finishes even if the client goes away.
+    await limiter.acquire()
+    worker = loop.run_in_executor(_query_executor, produce)
+    worker.add_done_callback(lambda _: limiter.release())
+
+    async def body():
+        try:
+            while (event := await events.get()) is not None:
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            cancelled.set()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/query/batch")
+async def query_batch(request: BatchQueryRequest):
+    if not request.questions or len(request.questions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"Send between 1 and {MAX_BATCH_SIZE} questions.")
+    short = [i for i, question in enumerate(request.questions) if len(question.strip()) < MIN_QUESTION_LENGTH]
+    if short:
+        raise HTTPException(status_code=422, detail=f"Questions {short} are shorter than {MIN_QUESTION_LENGTH} characters.")
+    _validate_collections(request.collections)
+    where = request.build_where()
+    loop = asyncio.get_running_loop()
+    # A batch holds one worker slot; its Groq fan-out is bounded by max_concurrency.
+    async with limiter.slot():
+        try:
+            return await loop.run_in_executor(
+                _query_executor,
+                partial(answer_batch, request.questions, PERSIST_DIR, mode=request.mode,
+                        candidates=request.candidates, rerank=request.rerank, collections=request.collections,
+                        where=where, max_concurrency=max(1, min(request.max_concurrency, 16))),
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Batch query failed: {e}")
+
+
+async def _job_response(job, background, error_detail):
+    """202 with the job when running in the background, else wait for it without holding a thread."""
+    if background:
+        return JSONResponse(status_code=202, content=job)
+    while job["status"] in ("queued", "running"):
+        await asyncio.sleep(JOB_POLL_S)
+        job = get_job_queue(PERSIST_DIR).get(job["id"])
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"{error_detail}: {job['error']}")
+    return job["result"]
+
+
+@app.post("/ingest")
+async def ingest(request: IngestRequest):
+    _validate_collections([request.collection], allow_all=False)
+    docs_dir = collection_docs_dir(DOCS_DIR, request.collection)
+    queue = get_job_queue(PERSIST_DIR)
+    if request.urls:
+        _validate_urls(request.urls)
+    paths = [_docs_path(path) for path in request.paths or []]
+    folder = _docs_path(request.folder) if request.folder else None
+    try:
+        if request.urls:
+            job = queue.submit_urls(request.urls, docs_dir, request.collection,
+                                    max_depth=max(0, request.max_depth), max_pages=max(1, request.max_pages))
+        elif paths:
+            job = queue.submit_paths(paths, request.collection)
+        elif folder:
+            # Only the collection's own folder is synced with deletions; other folders just add files.
+            job = queue.submit_folder(folder, request.collection, remove_missing=False)
+        else:
+            job = queue.submit_folder(docs_dir, request.collection)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ingestion failed: {e}")
+    return await _job_response(job, request.background, "Ingestion failed")
+
+
+@app.put("/documents/{filename}")
+async def upload_document(filename: str, request: Request, collection: str = DEFAULT_COLLECTION_NAME,
+                          background: bool = False):
+    _validate_collections([collection], allow_all=False)
+    filename = re.sub(r'[^\w\-\.]', '_', filename)
+    if Path(filename).suffix not in (".pdf", ".txt"):
+        raise HTTPException(status_code=415, detail="Only .pdf and .txt documents are supported.")
+    file_path = collection_docs_dir(DOCS_DIR, collection) / filename
+    try:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(await request.body())
+        job = get_job_queue(PERSIST_DIR).submit_paths([file_path], collection)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process {filename}: {e}")
+    response = await _job_response(job, background, f"Failed to process {filename}")
+    if background:
+        return response
+    return dict(response, filename=filename, collection=collection)
+
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 20):
+    return get_job_queue(PERSIST_DIR).list(limit=max(1, min(limit, 200)))
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = get_job_queue(PERSIST_DIR).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.get("/collections")
+async def collections():
+    def describe():
+        described = []
+        for name in list_collections(PERSIST_DIR):
+            dedup = get_dedup_index(PERSIST_DIR, name)
+            described.append({
+                "name": name,
+                "chunks": get_collection(PERSIST_DIR, name).count(),
+                "version": collection_version(PERSIST_DIR, name),
+                "sources": IngestManifest(PERSIST_DIR, name).sources(),
+                # Chunks stored once but found in several sources (see dedup_index.py).
+                "duplicates_linked": dedup.stats()["duplicates"] if dedup is not None else 0,
+            })
+        return described
+
+    return await asyncio.get_running_loop().run_in_executor(_query_executor, describe)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "warm": startup_report() is not None, "active": limiter.active, "waiting": limiter.waiting}
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "stages": get_tracer().summary(),
+        "embedding": service_stats(),
+        "rerank": reranker_stats(),
+        "llm": llm_stats(),
+        "jobs": get_job_queue(PERSIST_DIR).stats(),
+        "startup": startup_report(),
+        "limiter": {
+            "active": limiter.active,
+            "waiting": limiter.waiting,
+            "rejected": limiter.rejected,
+            "max_active": limiter.max_active,
+            "max_queued": limiter.max_queued,
+        },
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = [
+        "# TYPE ragvisor_queries_active gauge",
+        f"ragvisor_queries_active {limiter.active}",
+        "# TYPE ragvisor_queries_waiting gauge",
+        f"ragvisor_queries_waiting {limiter.waiting}",
+        "# TYPE ragvisor_queries_rejected_total counter",
+        f"ragvisor_queries_rejected_total {limiter.rejected}",
+    ]
+    for name, value in llm_stats().items():
+        if not name.startswith("mean_"):
+            lines.append(f"# TYPE ragvisor_llm_{name}_total counter")
+            lines.append(f"ragvisor_llm_{name}_total {value}")
+    return get_tracer().prometheus_text() + "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the RAGvisor HTTP API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
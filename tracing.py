@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUFFER_SIZE = int(os.getenv("RAGVISOR_TRACE_BUFFER", "2000"))
+TRACE_JSONL_PATH = os.getenv("RAGVISOR_TRACE_JSONL")
+# Histogram buckets (seconds) for the Prometheus export.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _metric_name(text):
+    return "".join(c if c.isalnum() else "_" for c in text).lower()
+
+
+class Tracer:
+    """
+    Lightweight span recorder.
+
+    Finished spans go into a fixed-size ring buffer (oldest dropped first) and
+    into per-stage histograms and counters that never grow with traffic, so it
+    is cheap enough to leave on for every request. Numeric span attributes
+    (bytes, chunks, tokens, ...) are summed into counters per stage.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, jsonl_path=TRACE_JSONL_PATH):
+        self.spans = deque(maxlen=buffer_size)
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = {}
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Time a block of code. Spans opened inside another span on the same
+        thread share its trace_id. Yields the attrs dict so counts known only
+        at the end (chunks, bytes) can be added before the span closes.
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = {
+            "name": name,
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "parent": parent["name"] if parent else None,
+            "start": time.time(),
+            "attrs": attrs,
+        }
+        stack.append(span)
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            span["duration_s"] = time.perf_counter() - start
+            self._finish(span)
+
+    def record(self, name, duration_s, **attrs):
+        """Record a span measured elsewhere (e.g. per-stage timings returned by a helper)."""
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        self._finish({
+            "name": name,
+            "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16],
+            "parent": parent["name"] if parent else None,
+            "start": time.time() - duration_s,
+            "attrs": attrs,
+            "duration_s": duration_s,
+        })
+
+    def _finish(self, span):
+        duration = span["duration_s"]
+        with self._lock:
+            self.spans.append(span)
+            histogram = self._histograms.setdefault(span["name"], {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += duration
+            histogram["count"] += 1
+            for key, value in span["attrs"].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._counters[(span["name"], key)] = self._counters.get((span["name"], key), 0) + value
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span, default=str) + "\n")
+            except OSError as e:
+                print(f"[ERROR] Trace export failed: {self.jsonl_path} — {e}")
+
+    def current_trace_id(self):
+        """trace_id of the innermost open span on this thread, or None."""
+        stack = self._stack()
+        return stack[-1]["trace_id"] if stack else None
+
+    def trace(self, trace_id):
+        """Buffered spans belonging to one trace, in finishing order."""
+        return [span for span in self.recent() if span["trace_id"] == trace_id]
+
+    def recent(self, limit=None):
+        """Finished spans, newest last."""
+        with self._lock:
+            spans = list(self.spans)
+        return spans[-limit:] if limit else spans
+
+    def last_trace(self, root_name=None):
+        """All buffered spans of the most recent trace (optionally the most recent one rooted at root_name)."""
+        spans = self.recent()
+        for span in reversed(spans):
+            if span["parent"] is None and (root_name is None or span["name"] == root_name):
+                return [s for s in spans if s["trace_id"] == span["trace_id"]]
+        return []
+
+    def summary(self):
+        """Per-stage count, mean, p50, p95 and max (ms) over the spans in the ring buffer."""
+        durations = {}
+        for span in self.recent():
+            durations.setdefault(span["name"], []).append(span["duration_s"] * 1000)
+        rows = []
+        for name, values in sorted(durations.items()):
+            values.sort()
+            rows.append({
+                "stage": name,
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(values[int(0.5 * (len(values) - 1))], 2),
+                "p95_ms": round(values[int(0.95 * (len(values) - 1))], 2),
+                "max_ms": round(values[-1], 2),
+            })
+        return rows
+
+    def prometheus_text(self, prefix="ragvisor"):
+        """Render stage histograms and attribute counters in the Prometheus text exposition format."""
+        with self._lock:
+            histograms = {name: dict(h, buckets=list(h["buckets"])) for name, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Time spent in each pipeline stage.",
+            f"# TYPE {prefix}_stage_duration_seconds histogram",
+        ]
+        for name, histogram in sorted(histograms.items()):
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {histogram["sum"]:.6f}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {histogram["count"]}')
+
+        by_attr = {}
+        for (name, attr), total in counters.items():
+            by_attr.setdefault(attr, []).append((name, total))
+        for attr, totals in sorted(by_attr.items()):
+            metric = f"{prefix}_stage_{_metric_name(attr)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for name, total in sorted(totals):
+                lines.append(f'{metric}{{stage="{name}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def jsonl_text(self):
+        """The ring buffer as JSON lines, oldest first."""
+        return "".join(json.dumps(span, default=str) + "\n" for span in self.recent())
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self._histograms.clear()
+            self._counters.clear()
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """Process-wide tracer shared by the app, ingestion and the embedder."""
+    return _tracer
+
+
+def span(name, **attrs):
+    return _tracer.span(name, **attrs)
+
+
+def record(name, duration_s, **attrs):
+    _tracer.record(name, duration_s, **attrs)
@@ -0,0 +1,324 @@
+import os
+import pickle
+import threading
+from pathlib import Path
+import numpy as np
+
+# "float32" keeps dense search in Chroma's HNSW index; "float16" or "int8"
+# serve it from a compact quantized sidecar with exact float re-ranking.
+VECTOR_MODE = os.getenv("RAGVISOR_VECTOR_MODE", "float32")
+RERANK_OVERSAMPLE = int(os.getenv("RAGVISOR_RERANK_OVERSAMPLE", "4"))
+INDEX_FILENAME = "vectors_{name}.{mode}"
+COMPACT_MODES = ("float16", "int8")
+# Rows scored per matmul, bounding the float32 temporary to a few MB.
+SCAN_ROWS = 16384
+# Queries scored together per scan, bounding the (rows x queries) score matrix.
+QUERY_GROUP = 16
+# Chroma requires an embedding per record; collections created in a compact
+# mode get this one-value stand-in instead of a second full-precision copy.
+PLACEHOLDER_DIMENSION = 1
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class QuantizedVectorIndex:
+    """
+    Compact copy of a collection's embeddings for brute-force dense search.
+
+    Codes are float16 (2 bytes/dim) or per-row scaled int8 (1 byte/dim plus a
+    float32 scale) held in memory, versus 4 bytes/dim plus graph links for
+    HNSW. A query scores every live row on the codes, keeps the top
+    k * oversample, then re-ranks those exactly against full-precision rows
+    read from an on-disk float32 file, so only candidate rows are paged in.
+    Distances are squared L2, the same as Chroma's default space.
+    """
+
+    def __init__(self, path, mode):
+        if mode not in COMPACT_MODES:
+            raise ValueError(f"Unsupported vector mode: {mode}")
+        self.path = Path(path)
+        self.full_path = self.path.with_suffix(self.path.suffix + ".f32")
+        self.mode = mode
+        self._lock = threading.RLock()
+        self._mtime_ns = None
+        self._chroma_placeholders = None
+        self._clear()
+        if self.path.exists():
+            self._load()
+
+    def _clear(self, dimension=None):
+        self.dimension = dimension
+        self.chunk_ids = []
+        self.rows = {}
+        self.alive = bytearray()
+        self.codes = None
+        self.scales = None
+        self.sqnorms = None
+        self.size = 0
+        self._full = None
+
+    # ---- persistence ----
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        self._clear(state["dimension"])
+        self.chunk_ids = state["chunk_ids"]
+        self.alive = state["alive"]
+        self.codes = state["codes"]
+        self.scales = state["scales"]
+        self.sqnorms = state["sqnorms"]
+        self.size = len(self.chunk_ids)
+        self.rows = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids) if self.alive[i]}
+        self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def reload_if_changed(self):
+        """Pick up an index saved by another process (e.g. the ingest CLI)."""
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if mtime_ns != self._mtime_ns:
+                self._load()
+
+    def save(self):
+        with self._lock:
+            if self.alive.count(0) > len(self.alive) // 4:
+                self.compact()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "dimension": self.dimension,
+                        "chunk_ids": self.chunk_ids,
+                        "alive": self.alive,
+                        "codes": None if self.codes is None else self.codes[:self.size],
+                        "scales": None if self.scales is None else self.scales[:self.size],
+                        "sqnorms": None if self.sqnorms is None else self.sqnorms[:self.size],
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_path, self.path)
+            self._mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def _full_rows(self):
+        """Full-precision rows as a read-only memmap over the on-disk file."""
+        if self._full is None or len(self._full) < self.size:
+            self._full = np.memmap(self.full_path, dtype=np.float32, mode="r", shape=(self.size, self.dimension))
+        return self._full
+
+    # ---- updates ----
+
+    def _quantize(self, vectors):
+        if self.mode == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def _reserve(self, extra):
+        """Grow the code arrays geometrically so appends stay amortized O(1)."""
+        needed = self.size + extra
+        capacity = 0 if self.codes is None else len(self.codes)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        dtype = np.float16 if self.mode == "float16" else np.int8
+        codes = np.zeros((capacity, self.dimension), dtype=dtype)
+        sqnorms = np.zeros(capacity, dtype=np.float32)
+        scales = np.ones(capacity, dtype=np.float32)
+        if self.size:
+            codes[:self.size] = self.codes[:self.size]
+            sqnorms[:self.size] = self.sqnorms[:self.size]
+            if self.scales is not None:
+                scales[:self.size] = self.scales[:self.size]
+        self.codes, self.sqnorms = codes, sqnorms
+        self.scales = scales if self.mode == "int8" else None
+
+    def remove(self, chunk_ids):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self.alive[row] = 0
+
+    def add(self, chunk_ids, embeddings):
+        """Add or replace vectors (an (n, d) array); replaced rows are tombstoned."""
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if not len(chunk_ids):
+            return
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            self.remove(chunk_ids)
+            # Rows past self.size may be left over from an unsaved run; overwrite them.
+            self.full_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.full_path, "ab") as f:
+                f.truncate(self.size * self.dimension * 4)
+                f.write(vectors.tobytes())
+            self._full = None
+            self._reserve(len(vectors))
+            codes, scales = self._quantize(vectors)
+            start, end = self.size, self.size + len(vectors)
+            self.codes[start:end] = codes
+            if scales is not None:
+                self.scales[start:end] = scales
+            self.sqnorms[start:end] = np.einsum("ij,ij->i", vectors, vectors)
+            for offset, chunk_id in enumerate(chunk_ids):
+                self.rows[chunk_id] = start + offset
+            self.chunk_ids.extend(chunk_ids)
+            self.alive.extend(b"\x01" * len(vectors))
+            self.size = end
+
+    def compact(self):
+        """Drop tombstoned rows from the codes and the full-precision file."""
+        with self._lock:
+            live = np.flatnonzero(np.frombuffer(bytes(self.alive), dtype=np.uint8))
+            full = np.array(self._full_rows()[live]) if self.size else np.zeros((0, self.dimension or 0), np.float32)
+            self.codes = self.codes[live] if self.codes is not None else None
+            self.sqnorms = self.sqnorms[live] if self.sqnorms is not None else None
+            if self.scales is not None:
+                self.scales = self.scales[live]
+            self.chunk_ids = [self.chunk_ids[i] for i in live]
+            self.alive = bytearray(b"\x01" * len(live))
+            self.rows = {chunk_id: i for i, chunk_id in enumerate(self.chunk_ids)}
+            self.size = len(live)
+            self._full = None
+            tmp_path = self.full_path.with_suffix(".tmp")
+            full.tofile(tmp_path)
+            os.replace(tmp_path, self.full_path)
+
+    def chroma_embeddings(self, collection, embeddings):
+        """
+        Embeddings to store in Chroma next to this index: placeholders when the
+        collection holds none (it was created in a compact mode, so this index
+        and its float32 file are the only copy), else the embeddings
+        themselves, keeping a collection migrated from float32 consistent.
+        """
+        if self._chroma_placeholders is None:
+            stored = collection.get(limit=1, include=["embeddings"])["embeddings"]
+            self._chroma_placeholders = not len(stored) or len(stored[0]) == PLACEHOLDER_DIMENSION
+        if self._chroma_placeholders:
+            return np.zeros((len(embeddings), PLACEHOLDER_DIMENSION), dtype=np.float32)
+        return embeddings
+
+    def rebuild_from_collection(self, collection, batch_size=1000):
+        """Index every embedding already stored in a Chroma collection."""
+        with self._lock:
+            self._clear()
+            self.full_path.unlink(missing_ok=True)
+            offset = 0
+            while True:
+                batch = collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+                if not len(batch["ids"]):
+                    break
+                vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+                if vectors.shape[1] == PLACEHOLDER_DIMENSION:
+                    raise ValueError(
+                        f"{self.path.name} is missing and the collection only stores placeholder embeddings; "
+                        "re-ingest it (delete its ingest manifest) to rebuild the index"
+                    )
+                self.add(batch["ids"], vectors)
+                offset += len(batch["ids"])
+
+    # ---- search ----
+
+    def search(self, query_embeddings, k=20, oversample=RERANK_OVERSAMPLE, allowed_ids=None):
+        """
+        Approximate scan on the codes, then exact re-rank of the top k * oversample.
+        Args:
+            query_embeddings: (m, d) array of queries.
+            allowed_ids: Optional set of chunk IDs to restrict the search to
+                (a metadata pre-filter); only their rows are scanned.
+        Returns:
+            One list of (chunk_id, -squared_l2) per query, best first.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        with self._lock:
+            if not self.rows:
+                return [[] for _ in queries]
+            full = self._full_rows()
+            n = self.size
+            dead = np.frombuffer(bytes(self.alive[:n]), dtype=np.uint8) == 0
+            live_rows = len(self.rows)
+            if allowed_ids is not None:
+                rows = np.array(sorted(self.rows[c] for c in allowed_ids if c in self.rows), dtype=np.int64)
+                if not len(rows):
+                    return [[] for _ in queries]
+                if len(rows) <= SCAN_ROWS:
+                    # Small filtered set: score just those rows exactly, no approximate pass.
+                    exact = (self.sqnorms[rows, None] - 2 * (full[rows] @ queries.T)
+                             + np.einsum("ij,ij->i", queries, queries))
+                    results = []
+                    for column in range(len(queries)):
+                        order = np.argsort(exact[:, column])[:k]
+                        results.append([(self.chunk_ids[rows[i]], -float(exact[i, column])) for i in order])
+                    return results
+                dead = np.ones(n, dtype=bool)
+                dead[rows] = False
+                live_rows = len(rows)
+            shortlist = min(live_rows, max(k, k * oversample))
+            results = []
+            for group_start in range(0, len(queries), QUERY_GROUP):
+                group = queries[group_start:group_start + QUERY_GROUP]
+                approx = np.empty((n, len(group)), dtype=np.float32)
+                for start in range(0, n, SCAN_ROWS):
+                    end = min(start + SCAN_ROWS, n)
+                    dots = self.codes[start:end].astype(np.float32) @ group.T
+                    if self.scales is not None:
+                        dots *= self.scales[start:end, None]
+                    approx[start:end] = self.sqnorms[start:end, None] - 2 * dots
+                approx[dead] = np.inf
+
+                for column, query in enumerate(group):
+                    # Sorted row numbers keep the reads from the float32 file sequential.
+                    candidates = np.sort(np.argpartition(approx[:, column], shortlist - 1)[:shortlist])
+                    exact = self.sqnorms[candidates] - 2 * (full[candidates] @ query) + float(query @ query)
+                    order = np.argsort(exact)[:k]
+                    results.append([(self.chunk_ids[candidates[i]], -float(exact[i])) for i in order])
+            return results
+
+    def stats(self):
+        code_bytes = 0 if self.codes is None else self.size * self.codes.shape[1] * self.codes.itemsize
+        if self.scales is not None:
+            code_bytes += self.size * 4
+        return {
+            "mode": self.mode,
+            "vectors": len(self.rows),
+            "rows": self.size,
+            "code_bytes": code_bytes + self.size * 4,  # + squared norms
+            "float32_bytes": self.size * (self.dimension or 0) * 4,
+        }
+
+
+def get_vector_index(persist_dir, collection_name, collection=None, mode=None):
+    """
+    Return the process-wide quantized index for a collection, or None when
+    dense search is served by Chroma (mode "float32", the default).
+
+    If no index file exists yet but the collection already holds chunks, the
+    index is built from the collection's stored embeddings once.
+    """
+    mode = mode or VECTOR_MODE
+    if mode not in COMPACT_MODES:
+        return None
+    path = Path(persist_dir).resolve() / INDEX_FILENAME.format(name=collection_name, mode=mode)
+    key = str(path)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = QuantizedVectorIndex(path, mode)
+                if not path.exists() and collection is not None and collection.count():
+                    index.rebuild_from_collection(collection)
+                    index.save()
+                _indexes[key] = index
+    else:
+        index.reload_if_changed()
+    return index
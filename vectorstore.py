@@ -0,0 +1,240 @@
+from pathlib import Path
+import re
+import threading
+import time
+
+DEFAULT_COLLECTION_NAME = "rag_pdf"
+# Pass as a collection name to search every collection (shard) in a directory.
+ALL_COLLECTIONS = "*"
+# Chroma's own naming rules; names are also used as folder names under docs/.
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{1,61}[A-Za-z0-9]$")
+
+_clients = {}
+_collections = {}
+_open_times = {}
+_lock = threading.Lock()
+
+
+def _key(persist_dir):
+    return str(Path(persist_dir).resolve())
+
+
+def get_client(persist_dir):
+    """
+    Return the process-wide PersistentClient for persist_dir, opening it on first use.
+
+    Streamlit reruns and concurrent sessions all share the same client, so the
+    SQLite connection and HNSW segments are only loaded once per process.
+    """
+    key = _key(persist_dir)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                start = time.perf_counter()
+                from chromadb import PersistentClient  # heavy; imported on first use
+
+                client = PersistentClient(path=persist_dir)
+                _open_times[(key, None)] = time.perf_counter() - start
+                _clients[key] = client
+    return client
+
+
+def validate_collection_name(name):
+    """
+    Check a user-supplied collection name before it reaches Chroma or the file system.
+    Returns:
+        name, unchanged.
+    Raises:
+        ValueError: If name breaks Chroma's naming rules (and so could also
+            escape the docs folder, e.g. "../x").
+    """
+    if not isinstance(name, str) or not COLLECTION_NAME_PATTERN.match(name):
+        raise ValueError(f"Invalid collection name: {name!r} (3-63 letters, digits, '.', '_' or '-', "
+                         "starting and ending with a letter or digit)")
+    return name
+
+
+def get_collection(persist_dir, name=DEFAULT_COLLECTION_NAME):
+    """Return a cached collection handle, creating the collection if needed."""
+    key = (_key(persist_dir), name)
+    collection = _collections.get(key)
+    if collection is None:
+        client = get_client(persist_dir)
+        with _lock:
+            collection = _collections.get(key)
+            if collection is None:
+                start = time.perf_counter()
+                collection = client.get_or_create_collection(name)
+                _open_times[key] = time.perf_counter() - start
+                _collections[key] = collection
+    return collection
+
+
+def list_collections(persist_dir):
+    """Names of every collection stored in persist_dir, sorted."""
+    # Chroma >= 0.6 returns names; older releases return Collection objects.
+    return sorted(c if isinstance(c, str) else c.name for c in get_client(persist_dir).list_collections())
+
+
+def resolve_collections(persist_dir, names=DEFAULT_COLLECTION_NAME):
+    """
+    Expand a collection selector into a list of collection names.
+    Args:
+        names: A collection name, a list of names, or ALL_COLLECTIONS ("*")
+            for every collection in persist_dir. None means the default.
+    """
+    if names is None:
+        return [DEFAULT_COLLECTION_NAME]
+    if isinstance(names, str):
+        names = [names]
+    if ALL_COLLECTIONS in names:
+        return list_collections(persist_dir) or [DEFAULT_COLLECTION_NAME]
+    return list(dict.fromkeys(names))
+
+
+def build_where(sources=None, content_types=None, ingested_after=None, ingested_before=None, where=None):
+    """
+    Build a Chroma metadata filter from the common query scopes.
+    Args:
+        sources: Document file names to search within.
+        content_types: Chunk types to keep ("pdf", "text", "web").
+        ingested_after / ingested_before: Epoch seconds bounding ingested_at
+            (inclusive / exclusive).
+        where: Extra raw Chroma where clause, ANDed with the rest.
+    Returns:
+        A where dict, or None when nothing is filtered.
+    Raises:
+        ValueError: If where is malformed or uses an operator that
+            matches_where (and so duplicate-aware filtering) can't evaluate.
+    """
+    if where:
+        _check_where(where)
+    clauses = []
+    if sources:
+        clauses.append({"source": {"$in": list(sources)}})
+    if content_types:
+        clauses.append({"content_type": {"$in": list(content_types)}})
+    if ingested_after is not None:
+        clauses.append({"ingested_at": {"$gte": int(ingested_after)}})
+    if ingested_before is not None:
+        clauses.append({"ingested_at": {"$lt": int(ingested_before)}})
+    if where:
+        clauses.append(where)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+_OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def _check_where(where):
+    if not isinstance(where, dict) or not where:
+        raise ValueError(f"Invalid where clause: {where!r}")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} takes a non-empty list of where clauses")
+            for clause in condition:
+                _check_where(clause)
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported where operator: {key}")
+        elif isinstance(condition, dict):
+            for op, operand in condition.items():
+                if op not in _OPERATORS:
+                    raise ValueError(f"Unsupported operator {op} on {key}; use one of {', '.join(_OPERATORS)}")
+                if op in ("$in", "$nin") and not isinstance(operand, list):
+                    raise ValueError(f"{op} on {key} takes a list")
+
+
+def matches_where(metadata, where):
+    """Whether a metadata dict satisfies a Chroma where clause, for chunks kept outside Chroma."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_OPERATORS[op](value, operand) for op, operand in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def where_sources(where):
+    """The document names a where clause restricts source to, or None if it doesn't."""
+    sources = None
+    clauses = where.get("$and", []) + [{key: value} for key, value in where.items() if key != "$and"]
+    for clause in clauses:
+        condition = clause.get("source")
+        if condition is None:
+            continue
+        if not isinstance(condition, dict):
+            allowed = {condition}
+        elif "$in" in condition or "$eq" in condition:
+            allowed = set(condition["$in"]) if "$in" in condition else {condition["$eq"]}
+        else:
+            continue
+        sources = allowed if sources is None else sources & allowed
+    return sources
+
+
+def forget_collection(persist_dir, name):
+    """Drop a cached handle, e.g. after the collection was deleted."""
+    with _lock:
+        _collections.pop((_key(persist_dir), name), None)
+
+
+def open_cost(persist_dir, name=DEFAULT_COLLECTION_NAME):
+    """
+    Seconds it took to open the client and collection the first time; this is
+    what every query used to pay before handles were cached.
+    """
+    key = _key(persist_dir)
+    return _open_times.get((key, None), 0.0) + _open_times.get((key, name), 0.0)
+
+
+def _version_marker(persist_dir, name):
+    return Path(persist_dir) / f".version_{name}"
+
+
+def bump_collection_version(persist_dir, name=DEFAULT_COLLECTION_NAME):
+    """Mark a collection as changed; call after any upsert or delete."""
+    marker = _version_marker(persist_dir, name)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.write_text(str(time.time_ns()), encoding="utf-8")
+
+
+def collection_version(persist_dir, name=DEFAULT_COLLECTION_NAME):
+    """
+    Opaque token that changes whenever the collection's contents change.
+    Stored as a marker file so the ingest CLI and the app see the same value.
+    """
+    try:
+        return _version_marker(persist_dir, name).read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return "0"
+
+
+def collections_version(persist_dir, names):
+    """Version token covering several collections; changes when any of them changes."""
+    if len(names) == 1:
+        return collection_version(persist_dir, names[0])
+    return ";".join(f"{name}={collection_version(persist_dir, name)}" for name in sorted(names))
@@ -0,0 +1,162 @@
+"""
+Cold-start tooling: per-dependency import timing and a warm-up that loads
+everything the first query needs before any user is waiting for it.
+
+The app modules import torch, sentence-transformers, chromadb, PyPDF2 and
+the tokenizer lazily, so importing them is cheap; warm_up() then pays for the
+imports, the model load, the Chroma/HNSW open and the first inference up
+front. The server runs it during startup (RAGVISOR_WARMUP=0 disables), the
+Streamlit app in a background thread.
+
+Usage:
+    python -m warmup [--persist-dir chroma_db] [--collection rag_pdf] [--json]
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from tracing import span
+
+WARMUP_ENABLED = os.getenv("RAGVISOR_WARMUP", "1").lower() in ("1", "true", "yes")
+# Imported in this order, so each time excludes what earlier modules pulled in.
+HEAVY_MODULES = ("numpy", "torch", "sentence_transformers", "chromadb", "openai", "PyPDF2", "tokenizers")
+WARMUP_QUERIES = ("warm-up query", "what does the document say about startup time")
+
+_report = None
+_report_lock = threading.Lock()
+_thread = None
+
+
+def import_times(modules=HEAVY_MODULES):
+    """
+    Seconds to import each dependency.
+    Returns:
+        {module: seconds}, 0.0 for modules that were already loaded and None
+        for ones that are not installed.
+    """
+    times = {}
+    for name in modules:
+        if name in sys.modules:
+            times[name] = 0.0
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            times[name] = None
+            continue
+        times[name] = round(time.perf_counter() - start, 4)
+    return times
+
+
+def warm_up(persist_dir, collections=None, rerank=None):
+    """
+    Load everything the first query touches: the heavy dependencies, the
+    embedding model (plus one inference, so kernels are initialized), every
+    selected collection with its BM25 and compact indexes, the cross-encoder
+    if re-ranking is on, the Groq client, and one retrieval across the
+    collections so HNSW segments are paged in. Nothing is written to the
+    answer cache and no Groq request is sent.
+    Returns:
+        Report dict with imports ({module: seconds}), steps ({step:
+        seconds}), warm_query_ms (a retrieval after warm-up), errors and
+        total_s. Also kept for startup_report().
+    """
+    global _report
+    start = time.perf_counter()
+    report = {"imports": import_times(), "steps": {}, "errors": {}}
+
+    def step(name, fn):
+        step_start = time.perf_counter()
+        try:
+            with span(f"warmup.{name}"):
+                result = fn()
+            report["steps"][name] = round(time.perf_counter() - step_start, 4)
+            return result
+        except Exception as e:
+            report["errors"][name] = str(e)
+            print(f"[ERROR] Warm-up step {name} failed — {e}")
+
+    # Imported here so that importing this module stays cheap.
+    from embedder import get_embedding_service
+    from lexical_index import get_lexical_index
+    from llm import prepare_client
+    from query_service import DEFAULT_RETRIEVAL_MODE
+    from reranker import RERANK_ENABLED, get_reranker
+    from retriever import retrieve
+    from vector_index import get_vector_index
+    from vectorstore import get_collection, resolve_collections
+
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    names = resolve_collections(persist_dir, collections)
+    service = step("embedding_model", get_embedding_service)
+    # Straight to the model: a cached embedding would skip the first inference.
+    step("first_inference", lambda: service.model.encode([WARMUP_QUERIES[0]], convert_to_numpy=True))
+    step("collections", lambda: [get_collection(persist_dir, name) for name in names])
+    step("indexes", lambda: [
+        (get_lexical_index(persist_dir, name, get_collection(persist_dir, name)),
+         get_vector_index(persist_dir, name, get_collection(persist_dir, name)))
+        for name in names
+    ])
+    if rerank:
+        step("reranker", get_reranker)
+    if os.getenv("GROQ_API_KEY"):
+        step("llm_client", prepare_client)
+    step("first_query", lambda: retrieve(WARMUP_QUERIES[0], persist_dir, collection_name=names,
+                                         mode=DEFAULT_RETRIEVAL_MODE, rerank=rerank, rerank_budget_ms=None))
+
+    query_start = time.perf_counter()
+    if step("warm_query", lambda: retrieve(WARMUP_QUERIES[1], persist_dir, collection_name=names,
+                                           mode=DEFAULT_RETRIEVAL_MODE, rerank=rerank)) is not None:
+        report["warm_query_ms"] = round((time.perf_counter() - query_start) * 1000, 2)
+    report["collections"] = names
+    report["total_s"] = round(time.perf_counter() - start, 3)
+    with _report_lock:
+        _report = report
+    return report
+
+
+def start_warmup(persist_dir, collections=None):
+    """Run warm_up() once per process in a background thread; later calls are no-ops."""
+    global _thread
+    with _report_lock:
+        if _thread is not None or not WARMUP_ENABLED:
+            return
+        _thread = threading.Thread(target=warm_up, args=(persist_dir, collections), name="warmup", daemon=True)
+    _thread.start()
+
+
+def startup_report():
+    """The last warm_up() report, or None while it hasn't finished."""
+    with _report_lock:
+        return _report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm up RAGvisor and report where startup time goes.")
+    parser.add_argument("--persist-dir", default="chroma_db", help="ChromaDB directory (default: chroma_db)")
+    parser.add_argument("--collection", action="append", help="Collection to open (repeatable, '*' for all)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = warm_up(args.persist_dir, args.collection)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print("Imports:")
+    for name, seconds in report["imports"].items():
+        print(f"  {name:<24} {'not installed' if seconds is None else f'{seconds * 1000:8.1f} ms'}")
+    print("Warm-up:")
+    for name, seconds in report["steps"].items():
+        print(f"  {name:<24} {seconds * 1000:8.1f} ms")
+    for name, error in report["errors"].items():
+        print(f"  {name:<24} failed: {error}")
+    print(f"Total {report['total_s']} s; a warm query then took {report.get('warm_query_ms', '-')} ms")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())